@@ -0,0 +1,180 @@
+## @package benchmark
+# Scaling benchmark of the stages of a simulation with differential checks of the fast paths against R_inf.
+# Every configuration (graph type, number of peers) runs in a fresh python process with a pinned seed so that
+# the peak memory (ru_maxrss) is the one of that configuration only. One JSON line is printed per configuration:
+# {"g_type", "num_peers", "g_char", "seed", "stages": {stage: seconds}, "iterations": {engine: n},
+#  "errors": {engine: max|R - R_inf|}, "local_crossover", "passed", "max_rss_kb", "cpus", "physical_cores"}
+# The 'parallel' engine is timed for every worker count of PARALLEL_WORKERS from a cold start ("R_itr_parallel_<workers>")
+# and again on the workers kept by the first solve ("R_itr_parallel_<workers>_warm")
+# The local 'push' query of computation.local_opinion is timed on the graph state for every count of LOCAL_QUERIES
+# ("local_push_<queries>") and "local_crossover" is the number of queries costing as much as the 'sparse' solve of all peers
+# Usage: python benchmark.py [max_num_peers [output_file]]
+from __future__ import division # to allow integer division to produce a floating point
+import json
+import multiprocessing as mp
+import math
+import random as rd
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+SEED = 2016 # seed of every configuration
+ALPHA = 0.3 # weight given to self opinion
+NEUTRAL_RANGE = 0.001 # opinion between +ve and -ve values of this range are considered neutral
+TOLERANCE = 1e-4 # maximum accepted difference between an opinion engine and R_inf
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6] # numbers of normal peers
+G_TYPES = ['random', 'geometric', 'barabasi_albert']
+ENGINES = ['sparse', 'gauss-seidel', 'sor', 'chebyshev', 'cg'] # engines of R_itr checked against R_inf
+LOCAL_QUERIES = [1, 10, 100] # numbers of peers estimated by one local query
+PARALLEL_WORKERS = [1, 2, 4] # worker counts of the 'parallel' engine, the number of physical cores is added
+LOOP_MAX = 1000 # largest graph on which the 'loop' engine of R_itr is run
+DENSE_MAX = 2000 # largest graph on which the dense R_inf is run
+SMART_MAX = 100 # largest graph on which add_smart is run
+SMART_TIME_LIMIT = 60 # maximum solving time of add_smart in seconds
+NETWORKX_MAX = 10**4 # largest graph generated by networkx, larger ones use the 'fast' backend
+
+##
+# returns the graph characteristic giving an average degree of about 2 ln(n), in the regime where the graph is
+# almost surely connected: probability for 'random', radius for 'geometric', edges per new node for 'barabasi_albert'
+# @param g_type graph type
+# @param num_peers number of normal peers
+#
+def graph_char(g_type, num_peers):
+	if g_type == 'random':
+		return min(1.0, 2*math.log(num_peers)/num_peers)
+	elif g_type == 'geometric':
+		return math.sqrt(2*math.log(num_peers)/(math.pi*num_peers))
+	elif g_type == 'barabasi_albert':
+		return 3
+	else : raise SystemExit('Chosen graph type ['+str(g_type)+'] is not applicable.\nProgram will terminate')
+
+##
+# returns the number of physical cores (distinct core ids of /proc/cpuinfo), the number of cpus if it cannot be read
+#
+def physical_cores():
+	cores = set()
+	try:
+		with open('/proc/cpuinfo') as f:
+			physical = core = None
+			for line in f:
+				if line.startswith('physical id'): physical = line.split(':')[1].strip()
+				elif line.startswith('core id'): core = line.split(':')[1].strip()
+				elif line.strip() == '' and core is not None:
+					cores.add((physical, core))
+					physical = core = None
+			if core is not None: cores.add((physical, core))
+	except IOError: pass
+	return len(cores) if len(cores) > 0 else mp.cpu_count()
+
+##
+# returns the list of configurations of the benchmark as dictionaries
+# @param max_peers largest number of normal peers
+#
+def configurations(max_peers):
+	return [{'g_type': g_type, 'num_peers': n, 'g_char': graph_char(g_type, n), 'seed': SEED}
+			for n in SIZES if n <= max_peers for g_type in G_TYPES]
+
+##
+# Runs the stages of one configuration in the current process
+# returns the JSON record of the configuration
+# @param config dictionary made by configurations
+#
+def run_configuration(config):
+	# imported here so that the parent process stays small
+	import graph_modification as gm
+	import computation as cp
+	import parallel_solve as ps
+	import graph_state as gs
+	n = config['num_peers']
+	np.random.seed(config['seed']) ; rd.seed(config['seed'])
+	stages = {}
+	iterations = {}
+	errors = {}
+	def timed(stage, f, *args):
+		start = time.time()
+		result = f(*args)
+		stages[stage] = time.time() - start
+		return result
+	backend = 'networkx' if n <= NETWORKX_MAX else 'fast'
+	G = timed('create_graph', gm.create_graph, config['g_type'], n, config['g_char'], backend)
+	G = timed('connect_graph', gm.connect_graph, G, 'giant')
+	timed('add_forceful', gm.add_forceful, G, 'D', 10, '1/D', 10)
+	R_inf = np.array(timed('R_inf', cp.R_inf, G, ALPHA))
+	if n <= DENSE_MAX:
+		errors['dense'] = float(np.abs(np.array(timed('R_inf_dense', cp.R_inf, G, ALPHA, 'dense')) - R_inf).max())
+	engines = (['loop'] if n <= LOOP_MAX else []) + ENGINES
+	# every engine starts from the opinions of the placement, the graph solved by 'sparse' is classified
+	solved = None
+	for engine in engines:
+		H = G.copy()
+		R = np.array(timed('R_itr_' + engine, gm.R_itr, H, ALPHA, engine))
+		errors[engine] = float(np.abs(R - R_inf).max())
+		if engine != 'loop': iterations[engine] = H.graph['convergence']['iterations']
+		if engine == 'sparse': solved = H
+	# 'parallel' from a cold start (workers started by the solve) then warm (workers of the previous solve) for every worker count
+	for workers in sorted(set(PARALLEL_WORKERS + [physical_cores()])):
+		ps.close_solver()
+		for start in ['', '_warm']:
+			H = G.copy()
+			R = np.array(timed('R_itr_parallel_%d%s' % (workers, start), gm.R_itr, H, ALPHA, 'parallel', None, None, workers))
+		errors['parallel_%d' % workers] = float(np.abs(R - R_inf).max())
+		iterations['parallel_%d' % workers] = H.graph['convergence']['iterations']
+	ps.close_solver()
+	# local queries of random peers to the error bound of the differential checks, on a graph state read in place,
+	# more peers are queried until the query is slower than the 'sparse' solve of all peers
+	state = timed('to_state', gs.from_networkx, G)
+	per_query = []
+	for queries in LOCAL_QUERIES:
+		nodes = np.random.choice(len(R_inf), min(queries, len(R_inf)), replace=False)
+		estimates, bounds = timed('local_push_%d' % queries, cp.local_opinion, state, nodes, ALPHA, TOLERANCE)
+		errors['local_push_%d' % queries] = float(np.abs(estimates - R_inf.ravel()[nodes]).max())
+		per_query.append(stages['local_push_%d' % queries]/len(nodes))
+		if stages['local_push_%d' % queries] > stages['R_itr_sparse']: break
+	# number of queries costing one global solve, below 1 a single query is slower
+	crossover = stages['R_itr_sparse']/min(per_query)
+	timed('percentages', cp.percentages, solved, NEUTRAL_RANGE)
+	if n <= SMART_MAX:
+		# generation and repair of the graph of the smart peer
+		H = timed('create_connect_smart', lambda: gm.connect_graph(gm.create_graph(config['g_type'], n, config['g_char']), 'giant'))
+		gm.add_one_forceful(H, 'D', 10)
+		try:
+			timed('add_smart', gm.add_smart, H, ALPHA, 10, NEUTRAL_RANGE, 'sparse', SMART_TIME_LIMIT)
+		# no placement found within the time limit, the stage is recorded without a time
+		except SystemExit:
+			stages['add_smart'] = None
+	record = dict(config)
+	record.update({'nodes': G.number_of_nodes() - 2, 'edges': G.number_of_edges(), 'stages': stages,
+			'iterations': iterations, 'errors': errors, 'local_crossover': crossover, 'passed': all(e <= TOLERANCE for e in errors.values()),
+			'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'cpus': mp.cpu_count(), 'physical_cores': physical_cores()})
+	return record
+
+##
+# Runs every configuration in its own process and writes one JSON line per configuration
+# returns True if every differential check passed
+# @param max_peers largest number of normal peers
+# @param out file object receiving the JSON lines
+#
+def run_benchmark(max_peers, out):
+	passed = True
+	for config in configurations(max_peers):
+		child = subprocess.Popen([sys.executable, __file__, '--config', json.dumps(config)], stdout=subprocess.PIPE)
+		output = child.communicate()[0]
+		if child.returncode != 0:
+			record = dict(config, passed = False, error = 'exit status %d' % child.returncode)
+		else: record = json.loads(output.strip().splitlines()[-1])
+		passed = passed and record['passed']
+		out.write(json.dumps(record, sort_keys=True) + '\n')
+		out.flush()
+	return passed
+
+if __name__ == "__main__":
+	if len(sys.argv) > 2 and sys.argv[1] == '--config':
+		print json.dumps(run_configuration(json.loads(sys.argv[2])))
+		sys.exit()
+	max_peers = int(float(sys.argv[1])) if len(sys.argv) > 1 else SIZES[-1]
+	out = open(sys.argv[2], 'w') if len(sys.argv) > 2 else sys.stdout
+	passed = run_benchmark(max_peers, out)
+	if out is not sys.stdout: out.close()
+	if not passed: sys.exit('Differential check failed: an opinion engine differs from R_inf by more than ' + str(TOLERANCE))
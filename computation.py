@@ -4,8 +4,11 @@
 # Also functions relate to calculations for the simulation of different strategies e.g. percentage of positive nodes
 from __future__ import division # to allow integer division to produce a floating point
 from scipy import linalg
+from scipy import sparse
+from scipy.sparse.linalg import splu, eigsh
 import numpy as np
 import networkx as nx
+import graph_state as gs
 
 ##
 # creates the A[normal] matrix that holds the (1-alpha)/deg part of the opinion calculation equation
@@ -14,9 +17,8 @@ import networkx as nx
 # @param G graph from which the A matrix will be extracted
 # @param alpha weigh given to self opinion
 def mat_A(G, alpha):
-	all_peers = nx.number_of_nodes(G)
 	# normal peers are all peers except the forceful ones
-	n = all_peers - 2
+	n = gs.num_normal(G)
 	# initialize array A to zeros
 	A = np.zeros(shape=(n,n))
 	#iterate all normal nodes in the graph
@@ -35,7 +37,7 @@ def mat_A(G, alpha):
 
 ##
 # Calculates A[forceful] matrix which represents the (1-alpha)/deg part where forceful peers are involved
-# returns nx2 matrix (where n are normal nodes) 
+# returns nxk matrix (where n are normal nodes and k forceful peers, 2 unless G.graph['forceful'] lists them)
 # R = (I - A[normal])^-1 ( h + A[forceful] * R[F])
 # @param G graph under test
 # @param alpha wight given to self opinion
@@ -43,19 +45,18 @@ def mat_A(G, alpha):
 def mat_AF(G, alpha):
 	all_peers = nx.number_of_nodes(G)
 	# normal peers are all peers except the forceful ones
-	n = all_peers - 2
+	n = gs.num_normal(G)
 	# initialize array A to zeros
-	AF = np.zeros(shape=(n,2))
+	AF = np.zeros(shape=(n,all_peers-n))
 	# Iterate for all rows of the matrix
 	for i in range(n):
 		edges_weight = 0
 		for neighbor in G.neighbors(i):
 			edges_weight += G[i][neighbor]['weight']
-		# fill for the 2 columns (representing connection to forceful peers)
-		if n in G.neighbors(i):
-			AF[i,0] = ((1-alpha)/edges_weight)*G[i][n]['weight']
-		if n+1 in G.neighbors(i):
-			AF[i,1] = ((1-alpha)/edges_weight)*G[i][n+1]['weight']
+		# fill one column per forceful peer (representing connection to forceful peers)
+		for f in range(n, all_peers):
+			if f in G.neighbors(i):
+				AF[i,f-n] = ((1-alpha)/edges_weight)*G[i][f]['weight']
 	return AF;
 ##
 # creates the h vector that contains the initial opinions of all nodes in the graph multiplied by alpha
@@ -64,9 +65,9 @@ def mat_AF(G, alpha):
 # @param alpha wwight given to self opinion
 #
 def vec_h(G, alpha):
-	all_peers = nx.number_of_nodes(G)
+	if gs.is_state(G): return alpha*G['initial_opinion'][:G['n']].reshape(-1, 1)
 	# normal peers are all peers except the forceful ones
-	n = all_peers - 2
+	n = gs.num_normal(G)
 	# initialize vector h to zeros
 	h = np.zeros(shape=(n,1))
 	#iterate all nodes in the graph
@@ -75,37 +76,485 @@ def vec_h(G, alpha):
 	h = h*alpha
 	return h;
 
+##
+# creates the sparse weight matrix W of the whole graph (normal and forceful peers) directly from its edge list
+# W[i,j] holds the total weight of the edges between i and j, multiple edges are summed
+# returns a CSR matrix with one row and one column per node, in the order of node keys
+# @param G graph from which the weight matrix will be extracted, or graph state
+# @param single True for float32 weights and int32 indices, made without a float64 copy of the matrix of a networkx graph
+#
+def mat_W(G, single=False):
+	if gs.is_state(G):
+		W = G['W']
+		if not single: return W
+		return sparse.csr_matrix((W.data.astype(np.float32), W.indices.astype(np.int32), W.indptr.astype(np.int32)), shape=W.shape)
+	# a missing key (see graph_state.num_keys) gets an empty row and column
+	W = nx.to_scipy_sparse_matrix(G, nodelist=range(gs.num_keys(G)), dtype=np.float32 if single else float, weight='weight', format='csr')
+	if single: W.indices, W.indptr = W.indices.astype(np.int32, copy=False), W.indptr.astype(np.int32, copy=False)
+	return W
+
+##
+# creates the system of the synchronous local update r(t) = b + P r(t-1) restricted to the peers that are updated
+# (normal peers with at least one neighbor), all other peers are fixed boundary values in r
+# returns P: CSR matrix with (1-alpha)*w[i,j]/deg[i] for every updated peer i and all peers j
+# b: alpha * initial opinion of the updated peers, r: current opinion of all peers, free: keys of the updated peers
+# and deg: weighted degree of the updated peers
+# @param G graph of nodes to update their opinions, or graph state
+# @param alpha weight given to self opinion
+# @param single True for P with float32 weights and int32 indices (see mat_W), the vectors stay float64
+#
+def opinion_system(G, alpha, single=False):
+	W = mat_W(G, single)
+	# weighted degree of every node
+	deg = np.asarray(W.sum(axis=1, dtype=float)).ravel()
+	normal, initial, opinion = gs.node_arrays(G)
+	# Nodes without neighbors keep their opinion as in the local update
+	free = np.flatnonzero(normal & (deg > 0))
+	P = sparse.diags(((1-alpha)/deg[free]).astype(W.dtype), 0).dot(W[free]).tocsr()
+	b = alpha*initial[free]
+	r = opinion.copy()
+	return P, b, r, free, deg[free]
+
+##
+# creates A[normal], A[forceful] and h of the equation R = (I - A[normal])^-1 ( h + A[forceful] * R[F])
+# as sparse matrices assembled straight from the edge list instead of dense nested loops
+# returns A: nxn CSR matrix, AF: nx2 CSR matrix, h: nx1 vector (where n are normal nodes)
+# A row of a node without neighbors is left empty, AF has one column per forceful peer of a graph state
+# @param G graph under test, or graph state
+# @param alpha weight given to self opinion
+#
+def sparse_system(G, alpha):
+	W = mat_W(G)
+	# normal peers are all peers except the forceful ones
+	n = gs.num_normal(G)
+	deg = np.asarray(W.sum(axis=1)).ravel()[:n]
+	# (1-alpha)/deg for every row with at least one neighbor
+	scale = np.zeros(n)
+	scale[deg > 0] = (1-alpha)/deg[deg > 0]
+	W_normal = sparse.diags(scale, 0).dot(W[:n]).tocsr()
+	A = W_normal[:, :n]
+	AF = W_normal[:, n:]
+	h = alpha*gs.normal_initial(G).reshape(-1, 1)
+	return A, AF, h
+
+##
+# returns the sparse LU factorization of a matrix with the symmetric pattern of the graph, e.g. I - A[normal]
+# The columns are ordered by minimum degree on the pattern of M^T + M, the default ordering (COLAMD, on M^T M)
+# fills in far more on these matrices
+# @param M square sparse matrix
+#
+def factorize(M):
+	return splu(sparse.csc_matrix(M), permc_spec='MMD_AT_PLUS_A')
+
 ##
 # Calculates R (inf) using the eq R = (I - A[normal])^-1 ( h + A[forceful] * R[F])
-# @param G graph under test
+# @param G graph under test, or graph state
 # @param alpha wight given to self opinion
+# @param solver 'sparse' solves the system by a sparse LU factorization,
+# 'dense' inverts the dense (I - A[normal]) matrix
 #
-def R_inf(G,alpha):
-	all_peers = nx.number_of_nodes(G)
+def R_inf(G,alpha,solver='sparse'):
 	# normal peers are all peers except the forceful ones
-	n = all_peers - 2
-	A = mat_A(G, alpha)
-	h = vec_h(G,alpha)
-	# Identity matrix to be used in the equation
-	I = np.identity(n)
-	AF = mat_AF(G,alpha)
+	n = gs.num_normal(G)
 	# Initial opinion of the forceful peers
-	RF = np.array([ [1],[-1] ])
-
-	R = (linalg.inv(I-A)).dot(h+(AF.dot(RF)))
+	RF = gs.forceful_opinions(G)
+	if solver == 'sparse':
+		A, AF, h = sparse_system(G, alpha)
+		I = sparse.identity(n, format='csr')
+		R = factorize(I-A).solve(h+(AF.dot(RF)))
+	elif solver == 'dense':
+		if gs.is_state(G): G = gs.to_networkx(G)
+		A = mat_A(G, alpha)
+		h = vec_h(G,alpha)
+		# Identity matrix to be used in the equation
+		I = np.identity(n)
+		AF = mat_AF(G,alpha)
+		R = (linalg.inv(I-A)).dot(h+(AF.dot(RF)))
+	else : raise SystemExit('Chosen solver ['+str(solver)+'] is not applicable.\nProgram will terminate')
 	return R;
 
+##
+# Solves the influence of every forceful peer on every normal peer with one factorization of (I - A[normal])
+# and the k columns of A[forceful] as a matrix right hand side: X = (I - A[normal])^-1 A[forceful]
+# X[i,j] is the weight of the opinion of peer j in the final opinion of i, so that R_inf = (I - A[normal])^-1 h + X R[F]
+# returns the n x k influence matrix X
+# @param G graph with k forceful peers (see graph_modification.add_forceful_peers), or graph state
+# @param alpha weight given to self opinion
+#
+def influence_matrix(G, alpha):
+	A, AF, h = sparse_system(G, alpha)
+	I = sparse.identity(A.shape[0], format='csr')
+	return factorize(I-A).solve(AF.toarray())
+
+##
+# Calculates the share of the normal peers following each forceful peer from an influence matrix and the peer opinions
+# C[i,j] = X[i,j] R[F_j] is the part of the final opinion r_i = sum_j C[i,j] brought by peer j (initial opinions are
+# neutral). A normal peer is neutral when |r_i| is not above neutral_range, otherwise it takes the side of the sign of r_i
+# and follows the peer of that side bringing the largest part of its opinion: allied peers (same sign) add their pulls
+# instead of cancelling each other, and a peer of opinion 0 is never followed. With 2 peers of opinions +1 and -1
+# this is the sign rule of percentages since r = X[:,0] - X[:,1]
+# returns [share of peer 0, ..., share of peer k-1, neutral share]
+# @param X n x k influence matrix returned by influence_matrix
+# @param opinions the k opinions of the forceful peers
+# @param neutral_range final opinions in [-neutral_range, neutral_range] are neutral
+#
+def peer_shares(X, opinions, neutral_range):
+	n, k = X.shape
+	C = X*np.asarray(opinions, dtype=float).reshape(1, k)
+	r = C.sum(axis=1)
+	followers = np.abs(r) > neutral_range
+	# the largest part of the opinion on the side of r
+	leader = np.argmax(np.sign(r).reshape(-1, 1)*C, axis=1)
+	counts = np.bincount(leader[followers], minlength = k)
+	return (counts/n).tolist() + [np.count_nonzero(~followers)/n]
+
+##
+# Decomposes the degree normalized adjacency of the normal peers once for all values of alpha
+# With D the weighted degree (forceful edges included) and W the weights between normal peers, D^-1 W is similar to the
+# symmetric S = D^-1/2 W D^-1/2 = V L V^T, so that (I - (1-alpha) D^-1 W)^-1 = D^-1/2 V (I - (1-alpha) L)^-1 V^T D^1/2
+# and alpha only scales the eigenvalues (see alpha_sweep). Peers without neighbors are left out of S.
+# returns a dictionary with the number of normal peers 'n', the keys of the peers in S 'free', their degree 'deg',
+# the 'values' and 'vectors' of S (all of them for 'full', the k largest in magnitude for 'partial'), the matrix 'S',
+# the initial opinions 'h0' and p = D^1/2 h0, q = D^-1/2 W[forceful] R[F] of the peers in S
+# @param G graph with 2 forceful peers, or graph state
+# @param method 'full' for a dense eigendecomposition, 'partial' for the k eigenpairs of largest magnitude (Lanczos)
+# @param k number of eigenpairs of the 'partial' method
+#
+def spectral_system(G, method='full', k=64):
+	W = mat_W(G)
+	n = gs.num_normal(G)
+	deg = np.asarray(W.sum(axis=1)).ravel()[:n]
+	free = np.flatnonzero(deg > 0)
+	sq = np.sqrt(deg[free])
+	S = sparse.diags(1/sq, 0).dot(W[free][:, free]).dot(sparse.diags(1/sq, 0)).tocsr()
+	h0 = gs.normal_initial(G)
+	# influence of the forceful peers with their static opinions
+	u = W[free][:, n:].dot(gs.forceful_opinions(G).ravel())
+	if method == 'full':
+		values, vectors = linalg.eigh(S.toarray())
+	elif method == 'partial':
+		k = min(k, len(free) - 2)
+		values, vectors = eigsh(S, k, which='LM')
+	else : raise SystemExit('Chosen decomposition ['+str(method)+'] is not applicable.\nProgram will terminate')
+	return {'n': n, 'free': free, 'deg': deg[free], 'values': values, 'vectors': vectors, 'S': S, 'method': method,
+			'h0': h0, 'p': sq*h0[free], 'q': u/sq}
+
+##
+# Computes the final opinions R_inf of the normal peers and their percentages for many values of alpha from one decomposition
+# With beta = 1-alpha and y = D^1/2 R: y = V (alpha V^T p + beta V^T q) / (1 - beta L), which costs O(n k) per alpha.
+# With a 'partial' decomposition the part of p and q out of the span of V is added by the Neumann series
+# sum beta^t S^t (alpha p + beta q), that converges as (beta l)^t where l bounds the eigenvalues left out;
+# the terms are accumulated for all alphas at once so only the current S^t p and S^t q are kept.
+# returns R: n x len(alphas) array (column j holds the opinions for alphas[j]) and a len(alphas) x 3 array of percentages
+# [S1, S2, neutral] as computed by classify
+# @param G graph with 2 forceful peers, graph state, or the dictionary returned by spectral_system
+# @param alphas list of weights given to self opinion (between 0 and 1)
+# @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
+# @param method decomposition of spectral_system, None for 'full' up to 2000 normal peers and 'partial' above
+# @param k number of eigenpairs of the 'partial' method
+# @param tol accepted truncation error of the Neumann series
+#
+def alpha_sweep(G, alphas, neutral_range, method=None, k=64, tol=1e-10):
+	if isinstance(G, dict) and 'vectors' in G: spec = G
+	else:
+		if method is None: method = 'full' if gs.num_normal(G) <= 2000 else 'partial'
+		spec = spectral_system(G, method, k)
+	alphas = np.asarray(alphas, dtype=float)
+	betas = 1 - alphas
+	V = spec['vectors']
+	gp = V.T.dot(spec['p'])
+	gq = V.T.dot(spec['q'])
+	# coefficients of the eigenvectors, one column per alpha
+	C = (np.outer(gp, alphas) + np.outer(gq, betas))/(1 - np.outer(spec['values'], betas))
+	Y = V.dot(C)
+	if spec['method'] == 'partial':
+		p = spec['p'] - V.dot(gp)
+		q = spec['q'] - V.dot(gq)
+		bound = np.abs(spec['values']).min()*betas.max()
+		terms = 1 if bound <= 0 else int(min(10000, max(1, np.ceil(np.log(tol)/np.log(bound)))))
+		power = np.ones(len(alphas))
+		for t in xrange(terms):
+			Y += np.outer(p, power*alphas) + np.outer(q, power*betas)
+			p = deflate(spec['S'].dot(p), V)
+			q = deflate(spec['S'].dot(q), V)
+			power = power*betas
+	R = np.outer(spec['h0'], alphas)
+	R[spec['free']] = Y/np.sqrt(spec['deg'])[:, None]
+	return R, np.array([classify(R[:, j], neutral_range) for j in xrange(len(alphas))])
+
+##
+# returns the vector x without its components on the orthonormal columns of V
+# @param x vector
+# @param V matrix with orthonormal columns
+#
+def deflate(x, V):
+	return x - V.dot(V.T.dot(x))
+
+##
+# Factorizes the system of the normal peers alone M0 = (I - A0), before any forceful peer is attached,
+# so that many placements of the forceful peers can be scored without a new factorization.
+# A forceful edge on node i only rescales row i of A0 by deg[i]/(deg[i]+f[i]) (f: weight from the forceful peers),
+# thus each placement is a low rank correction of M0 applied with the Woodbury identity (see placement_opinions)
+# returns a dictionary with the factorization 'lu', the matrix 'A0', the normal degrees 'deg', 'h', 'y0' = M0^-1 h
+# and the cache 'columns' of the columns of M0^-1 already computed
+# @param G graph of the normal peers, edges to other peers are ignored, or graph state
+# @param alpha weight given to self opinion
+# @param max_bytes memory of the cache of columns of M0^-1 (n floats each), at least the columns of one placement are kept
+#
+def base_system(G, alpha, max_bytes=2**27):
+	if gs.is_state(G):
+		n = G['n']
+		# the matrix of a state without forceful peers (e.g. the memory maps of the corpus) is used as is
+		W0 = G['W'] if len(G['forceful']) == 0 else G['W'][:n][:, :n]
+		h0 = G['initial_opinion'][:n]
+	else:
+		n = sum(1 for i in G if G.node[i]['type'] == 'normal')
+		W0 = nx.to_scipy_sparse_matrix(G, nodelist=range(n), weight='weight', format='csr')
+		h0 = np.array([G.node[i]['initial_opinion'] for i in range(n)], dtype=float)
+	deg = np.asarray(W0.sum(axis=1)).ravel()
+	scale = np.zeros(n)
+	scale[deg > 0] = (1-alpha)/deg[deg > 0]
+	A0 = sparse.diags(scale, 0).dot(W0).tocsr()
+	lu = factorize(sparse.identity(n, format='csr') - A0)
+	h = alpha*h0
+	return {'n': n, 'alpha': alpha, 'lu': lu, 'A0': A0, 'deg': deg, 'h': h, 'y0': lu.solve(h),
+			'columns': {}, 'max_columns': max(1, max_bytes // (8*max(n, 1)))}
+
+##
+# returns the columns of M0^-1 for the given nodes as a n x k matrix, solving only the ones missing from the cache
+# @param base dictionary returned by base_system
+# @param nodes array of node keys
+#
+def base_columns(base, nodes):
+	columns = base['columns']
+	missing = [i for i in nodes if i not in columns]
+	if len(missing) > 0:
+		if len(columns) + len(missing) > base['max_columns']:
+			# evicts the columns of other nodes only, the ones of this placement are read below
+			wanted = set(nodes)
+			for i in [i for i in columns if i not in wanted]:
+				del columns[i]
+				if len(columns) + len(missing) <= base['max_columns']: break
+		E = np.zeros((base['n'], len(missing)))
+		E[missing, range(len(missing))] = 1
+		Z = base['lu'].solve(E)
+		for j in range(len(missing)):
+			columns[missing[j]] = Z[:, j]
+	Z = np.zeros((base['n'], len(nodes)))
+	for j in range(len(nodes)):
+		Z[:, j] = columns[nodes[j]]
+	return Z
+
+##
+# Calculates R (inf) for a placement of the 2 forceful peers (+1 and -1) from the factorization of the normal peers
+# M = M0 + U V^T where U selects the k targeted nodes and V^T = (1 - deg/(deg+f)) A0[targets]
+# R = y - Z (I + V^T Z)^-1 V^T y with Z = M0^-1 U and y = M0^-1 (h + A[forceful] * R[F])
+# returns the nx1 opinion vector of the normal peers, as R_inf would for the graph with the forceful peers attached
+# @param base dictionary returned by base_system
+# @param f1_neighbors list of neighbors of the first forceful peer (+1), a node can appear several times
+# @param f2_neighbors list of neighbors of the second forceful peer (-1)
+#
+def placement_opinions(base, f1_neighbors, f2_neighbors):
+	n = base['n']
+	w1 = np.bincount(np.asarray(f1_neighbors, dtype=int), minlength=n)
+	w2 = np.bincount(np.asarray(f2_neighbors, dtype=int), minlength=n)
+	targets = np.flatnonzero(w1 + w2)
+	if len(targets) == 0:
+		return base['y0'].reshape(n, 1)
+	deg = base['deg'][targets]
+	deg_f = deg + w1[targets] + w2[targets]
+	# A[forceful] * R[F] is only non zero on the targeted nodes
+	c = (1-base['alpha'])*(w1[targets] - w2[targets])/deg_f
+	Z = base_columns(base, targets)
+	VT = sparse.diags(1 - deg/deg_f, 0).dot(base['A0'][targets])
+	y = base['y0'] + Z.dot(c)
+	K = np.identity(len(targets)) + VT.dot(Z)
+	R = y - Z.dot(linalg.solve(K, VT.dot(y)))
+	return R.reshape(n, 1)
+
+##
+# returns upper bounds of the gain of the sum of opinions of the normal peers when one more unit of the first forceful
+# peer (+1) is placed on each normal peer, without solving for the columns of M0^-1 of every peer.
+# One unit on node v only changes row v of the system: the new opinions are R' = R + M'^-1 e_v r_v where
+# r_v = (1 - alpha - R_v + h_v)/(d_v + 1) >= 0 is the residual of R in the new row v (d_v: degree with the forceful weights).
+# The entries of A' are the ones of A0 scaled down, so 1^T M'^-1 e_v <= 1^T M0^-1 e_v = w_v with M0^T w = 1,
+# a single adjoint solve shared by all peers (kept in base['adjoint']).
+# @param base dictionary returned by base_system
+# @param f1_neighbors list of neighbors of the first forceful peer (+1), a node can appear several times
+# @param f2_neighbors list of neighbors of the second forceful peer (-1)
+#
+def placement_gain_bounds(base, f1_neighbors, f2_neighbors):
+	n = base['n']
+	if 'adjoint' not in base:
+		base['adjoint'] = base['lu'].solve(np.ones(n), trans='T')
+	w = np.bincount(np.asarray(f1_neighbors, dtype=int), minlength=n) + np.bincount(np.asarray(f2_neighbors, dtype=int), minlength=n)
+	R = placement_opinions(base, f1_neighbors, f2_neighbors).ravel()
+	residual = np.maximum(1 - base['alpha'] - R + base['h'], 0)/(base['deg'] + w + 1)
+	return base['adjoint']*residual
+
+##
+# Calculates the followers percentages of many placements of the 2 forceful peers on the same normal peers graph
+# returns a list with one [S1, S2, neutral] list per placement, as percentages would report for each
+# @param base dictionary returned by base_system
+# @param placements list of (f1_neighbors, f2_neighbors) as returned by graph_modification.draw_placement
+# @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
+#
+def placement_percentages(base, placements, neutral_range):
+	return [classify(placement_opinions(base, f1, f2), neutral_range) for f1, f2 in placements]
+
+##
+# returns the neighbors of node u with the weights of the edges, True for the normal ones and their opinions,
+# and the initial opinion of u, read from the adjacency of u only
+# @param G graph or graph state
+# @param u node key
+#
+def local_row(G, u):
+	if gs.is_state(G):
+		W = G['W']
+		start, end = W.indptr[u], W.indptr[u+1]
+		nbrs = W.indices[start:end]
+		return nbrs, W.data[start:end], G['type'][nbrs] == 0, G['opinion'][nbrs], G['initial_opinion'][u]
+	nbrs = list(G[u])
+	return (np.array(nbrs, dtype=np.int64), np.array([G[u][v]['weight'] for v in nbrs], dtype=float),
+			np.array([G.node[v]['type'] == 'normal' for v in nbrs], dtype=bool),
+			np.array([G.node[v]['opinion'] for v in nbrs], dtype=float), G.node[u]['initial_opinion'])
+
+##
+# Estimates the final opinion R_inf of a few normal peers without solving the whole system, reading only the nodes reached
+# The opinion satisfies R[u] = alpha*h0[u] + (1-alpha) sum_v w[u,v]/deg[u] R[v], forceful peers keep their opinion.
+# 'push' (forward push on the row of the query) keeps R[t] = estimate + sum_u q[u] R[u] and only pushes the residual q[u] of
+# a peer to its normal neighbors when q[u] > eps*deg[u] (deg: number of neighbors), every push removes at least alpha*q[u]
+# of residual. The pushes go by rounds: all peers above the threshold (the frontier) are pushed at once with one sparse
+# mat-vec of their rows of W restricted to the columns they reach. When the frontier is empty and the error bound
+# max|R| sum q (deterministic, from the leftover residual) is still above tol, eps is halved.
+# 'walk' averages absorbing random walks: from a normal peer the walk stops with probability alpha on its initial opinion,
+# otherwise it moves to a neighbor chosen by weight and stops on the opinion of a forceful peer. Every walk is an unbiased
+# sample in [-M, M] (M: largest absolute opinion), so 2 M^2 ln(2/delta)/tol^2 walks give the error bound tol with
+# probability 1-delta (Hoeffding).
+# The cost of 'walk' depends on alpha, tol and the degrees met by the walks, not on the size of the graph. A push touches
+# the neighbors of the pushed peer, the number of pushes grows with 1/eps and the reached neighborhood, which can be most
+# of a small world graph for a small tol: the bound then shrinks by 1-alpha per round over the whole graph, which takes more
+# rounds than the sweeps of a global solve (see R_itr) stopped on the difference of two iterations. 'push' reads W of a graph state in place, a networkx graph is converted once
+# per call (see mat_W), so many queries of a networkx graph are best made in one call. benchmark.py records the number
+# of queries from which one global solve is faster.
+# returns the estimates and the error bounds of the queried peers as arrays
+# @param G graph or graph state, opinions are assumed in [-1, 1] except the ones of the forceful peers
+# @param nodes keys of the queried normal peers
+# @param alpha weight given to self opinion
+# @param tol requested error bound
+# @param method 'push' or 'walk'
+# @param delta probability that a 'walk' estimate is further than tol from R_inf
+# @param max_pushes maximum number of pushes of a queried peer, None for no limit, the returned bound tells if tol was reached
+#
+def local_opinion(G, nodes, alpha, tol=1e-4, method='push', delta=0.01, max_pushes=None):
+	M = max(1.0, np.abs(gs.forceful_opinions(G)).max())
+	rows = {}
+	def row(u):
+		if u not in rows: rows[u] = local_row(G, u)
+		return rows[u]
+	# cumulative weights of the rows visited by the walks
+	cumulative = {}
+	if method == 'push':
+		W = mat_W(G)
+		normal, initial, opinion = gs.node_arrays(G)
+		# position of the columns reached by a round of pushes
+		slot = np.empty(W.shape[0], dtype=np.int64)
+	estimates = np.zeros(len(nodes))
+	bounds = np.zeros(len(nodes))
+	for k, t in enumerate(nodes):
+		if method == 'push':
+			estimate = 0.0
+			residual = np.zeros(W.shape[0])
+			residual[t] = 1.0
+			# peers holding a residual, listed in active and marked in held
+			active = np.array([t])
+			held = np.zeros(W.shape[0], dtype=bool)
+			held[t] = True
+			eps = tol/M
+			pushes = 0
+			while max_pushes is None or pushes < max_pushes:
+				frontier = active[residual[active] > eps*(W.indptr[active+1] - W.indptr[active])]
+				if len(frontier) == 0:
+					bound = M*residual[active].sum()
+					if bound <= tol: break
+					# every residual is at most eps*deg, the bound shrinks about as eps
+					eps *= min(0.5, tol/bound)
+					continue
+				if max_pushes is not None: frontier = frontier[:max_pushes - pushes]
+				pushes += len(frontier)
+				q = residual[frontier]
+				residual[frontier] = 0
+				block = W[frontier]
+				deg = np.asarray(block.sum(axis=1)).ravel()
+				estimate += alpha*q.dot(initial[frontier])
+				share = np.zeros(len(frontier))
+				share[deg > 0] = q[deg > 0]*(1-alpha)/deg[deg > 0]
+				# the distinct columns reached by the frontier without sorting: the last write of a column keeps its slot
+				reach = np.arange(len(block.indices))
+				slot[block.indices] = reach
+				columns = block.indices[slot[block.indices] == reach]
+				slot[columns] = np.arange(len(columns))
+				# the rows of the frontier on the columns they reach only
+				reached = sparse.csr_matrix((block.data, slot[block.indices], block.indptr), shape=(len(frontier), len(columns))).T.dot(share)
+				pulled = normal[columns]
+				estimate += reached[~pulled].dot(opinion[columns[~pulled]])
+				residual[columns[pulled]] += reached[pulled]
+				kept = residual[active] > 0
+				held[active[~kept]] = False
+				new = columns[pulled & ~held[columns]]
+				held[new] = True
+				active = np.concatenate((active[kept], new))
+			estimates[k] = estimate
+			bounds[k] = M*residual[active].sum()
+		elif method == 'walk':
+			walks = int(np.ceil(2*M**2*np.log(2/delta)/tol**2))
+			total = 0.0
+			for i in xrange(walks):
+				u = t
+				while True:
+					nbrs, weights, normal, opinion, h0 = row(u)
+					if len(nbrs) == 0:
+						total += alpha*h0
+						break
+					if np.random.random() < alpha:
+						total += h0
+						break
+					if u not in cumulative: cumulative[u] = np.cumsum(weights)
+					j = min(np.searchsorted(cumulative[u], np.random.random()*cumulative[u][-1], side='right'), len(nbrs) - 1)
+					if not normal[j]:
+						total += opinion[j]
+						break
+					u = nbrs[j]
+			estimates[k] = total/walks
+			bounds[k] = tol
+		else : raise SystemExit('Chosen local method ['+str(method)+'] is not applicable.\nProgram will terminate')
+	return estimates, bounds
+
+##
+# Calculates the percentage of positive, negative and neutral values of an opinion vector
+# returns [positive percentage, negative percentage, neutral percentage] with the same categories as percentages
+# @param R opinion vector of the normal peers
+# @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
+#
+def classify(R, neutral_range):
+	R = np.asarray(R).ravel()
+	n = len(R)
+	S1 = np.count_nonzero(R > neutral_range)
+	S2 = np.count_nonzero(R < - neutral_range)
+	neutral_nodes = np.count_nonzero((R >= - neutral_range) & (R <= neutral_range))
+	return [S1/n, S2/n, neutral_nodes/n]
+
 ##
 # Calculates the percentage of normal positive, negative and neutral nodes depending on a given neutral range around 0
-# @param G graph to calculate the percentage of different nodes from
+# @param G graph to calculate the percentage of different nodes from, or graph state
 # @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
 # returs a list of three elements storing with the following order:
 # [0]positive nodes percentage, [1] negative nodes percentage and [2] neutral nodes percentage 
 #
 def percentages(G,neutral_range):
-	all_peers = nx.number_of_nodes(G)
+	if gs.is_state(G): return classify(G['opinion'][:G['n']], neutral_range)
 	# normal peers are all peers except the forceful ones
-	n = all_peers - 2
+	n = gs.num_normal(G)
 	S1_followers_percent = S2_followers_percent = neutral_perc = 0
 	for i in range(n):
 		if G.node[i]['opinion'] < - neutral_range:
@@ -124,6 +573,24 @@ def percentages(G,neutral_range):
 	neutral_perc /= n
 	return [S1_followers_percent,S2_followers_percent,neutral_perc]
 
+##
+# Calculates the percentages as percentages does but refuses to classify the normal peers whose opinion is within the error
+# of the boundary of the neutral range (e.g. the 'error' of the float32 engine of graph_modification.sparse_update)
+# returns [positive percentage, negative percentage, neutral percentage, refused percentage]
+# @param G graph to calculate the percentage of different nodes from, or graph state
+# @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
+# @param error maximum deviation of the opinions
+#
+def guarded_percentages(G, neutral_range, error):
+	if gs.is_state(G): R = G['opinion'][:G['n']]
+	else: R = np.array([G.node[i]['opinion'] for i in range(gs.num_normal(G))], dtype=float)
+	n = len(R)
+	refused = np.abs(np.abs(R) - neutral_range) <= error
+	S1 = np.count_nonzero((R > neutral_range) & ~refused)
+	S2 = np.count_nonzero((R < - neutral_range) & ~refused)
+	neutral_nodes = np.count_nonzero((R >= - neutral_range) & (R <= neutral_range) & ~refused)
+	return [S1/n, S2/n, neutral_nodes/n, np.count_nonzero(refused)/n]
+
 ##
 # Updates followers and winning percentages percentages of the two strategies
 # @param new_perc Followers for either of the forceful peers in the last match [S1_followers,S2_followers,neutral]
@@ -187,6 +654,36 @@ def get_precision(mean, followers_list, n):
 
 	return (100*z*s)/(np.sqrt(n)*mean) 
 	
+##
+# creates running statistics of a series of values, updated one value at a time by update_stats (Welford's method)
+# 'n' number of values, 'mean' their mean and 'm2' the sum of squared differences to the mean
+#
+def running_stats():
+	return {'n': 0, 'mean': 0.0, 'm2': 0.0}
+
+##
+# adds a value to running statistics in O(1) time and memory
+# @param stats dictionary returned by running_stats
+# @param x new value
+#
+def update_stats(stats, x):
+	stats['n'] += 1
+	delta = x - stats['mean']
+	stats['mean'] += delta/stats['n']
+	stats['m2'] += delta*(x - stats['mean'])
+	return
+
+##
+# returns precision as a percentage of mean of running statistics, with the same equation as get_precision
+# r = (100*z*s)/sqrt(n)*mean), infinite while it cannot be computed (less than 2 values or zero mean)
+# @param stats dictionary returned by running_stats
+#
+def stats_precision(stats):
+	if stats['n'] < 2 or stats['mean'] == 0:
+		return np.inf
+	s = np.sqrt(stats['m2']/(stats['n']-1))
+	z = 1.96
+	return (100*z*s)/(np.sqrt(stats['n'])*abs(stats['mean']))
 
 def drange(start, stop, step):
 	r = start
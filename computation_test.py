@@ -2,6 +2,8 @@ from __future__ import division
 from scipy import linalg
 import unittest as ut
 import computation as cp
+import graph_modification as gm
+import graph_state as gs
 import numpy as np
 import networkx as nx
 
@@ -59,6 +61,45 @@ class ComputationTest(ut.TestCase):
 		R_inf_exp = (linalg.inv(I-A)).dot(h+(AF_exp.dot(RF)))
 		np.testing.assert_array_almost_equal(cp.R_inf(self.G,self.alpha),R_inf_exp,7,'Error in R_inf function')
 
+	# Asserting the sparse system and solver against the dense ones with forceful peers attached
+	def test_R_inf_sparse(self):
+		G = nx.Graph()
+		G.add_edges_from([(0,1),(1,2),(2,3),(3,0),(1,3)], weight = 1)
+		G.add_edges_from([(4,0),(5,2)], weight = 1)
+		G.add_edge(4,1, weight = 2)
+		for i in range(4):
+			G.node[i]['initial_opinion'] = G.node[i]['opinion'] = 0
+			G.node[i]['type'] = 'normal'
+		A, AF, h = cp.sparse_system(G,self.alpha)
+		np.testing.assert_array_almost_equal(A.toarray(),cp.mat_A(G,self.alpha),7,'error in sparse A calculation')
+		np.testing.assert_array_almost_equal(AF.toarray(),cp.mat_AF(G,self.alpha),7,'error in sparse AF calculation')
+		np.testing.assert_array_almost_equal(cp.R_inf(G,self.alpha),cp.R_inf(G,self.alpha,'dense'),7,'error in sparse R_inf')
+
+	# Asserting the low rank placement evaluation against R_inf of the graph with the forceful peers attached
+	def test_placement_opinions(self):
+		np.random.seed(10)
+		G = gm.create_graph('barabasi_albert', 30, 2)
+		base = cp.base_system(G,self.alpha)
+		# a cache of 10 columns is overflown by every placement
+		small = cp.base_system(G, self.alpha, 8*30*10)
+		for strategies in [('D','1/D'),('random','D^2')]:
+			f1, f2 = gm.draw_placement(G, strategies[0], 8, strategies[1], 8)
+			G_f = G.copy()
+			G_f.add_node(30, type = 'f1', opinion = 1)
+			G_f.add_node(31, type = 'f2', opinion = -1)
+			gm.attach_neighbors(G_f, 30, f1)
+			gm.attach_neighbors(G_f, 31, f2)
+			R_inf = cp.R_inf(G_f,self.alpha)
+			np.testing.assert_array_almost_equal(cp.placement_opinions(base, f1, f2),R_inf,7,'error in placement opinions')
+			np.testing.assert_array_almost_equal(cp.placement_opinions(small, f1, f2),R_inf,7,'error in placement opinions')
+			self.assertLessEqual(len(small['columns']), max(10, len(set(f1) | set(f2))))
+			self.assertEqual(cp.placement_percentages(base, [(f1, f2)], 0.001)[0], cp.classify(R_inf, 0.001))
+			# the bounds of one more unit of the first forceful peer are not below the gains
+			score = np.sum(cp.placement_opinions(base, f1, f2))
+			bounds = cp.placement_gain_bounds(base, f1, f2)
+			for v in [0, 5, 29] + list(f1[:2]):
+				self.assertLessEqual(np.sum(cp.placement_opinions(base, list(f1) + [v], f2)) - score, bounds[v] + 1e-12)
+
 	# Testing percentages function
 	def test_percentages(self):
 		neutral_range = 0.001
@@ -77,5 +118,121 @@ class ComputationTest(ut.TestCase):
 		self.G.node[2]['opinion'] = -0.01
 		percentages_exp = [0/3,1/3,2/3]
 		np.testing.assert_array_equal(cp.percentages(self.G,neutral_range),percentages_exp)
+	# Asserting running statistics against get_precision
+	def test_running_stats(self):
+		values = [0.52, 0.48, 0.55, 0.5, 0.61]
+		stats = cp.running_stats()
+		for x in values:
+			cp.update_stats(stats, x)
+		np.testing.assert_almost_equal(stats['mean'], np.mean(values), 10)
+		np.testing.assert_almost_equal(cp.stats_precision(stats), cp.get_precision(np.mean(values), values, len(values)), 10)
+	# Asserting the alpha sweep of both decompositions against R_inf solved for every alpha
+	def test_alpha_sweep(self):
+		np.random.seed(3)
+		G = gm.create_graph('random', 60, 0.1)
+		gm.add_forceful(G, 'D', 8, '1/D', 8)
+		alphas = [0.05, 0.3, 0.9]
+		for method in ['full', 'partial']:
+			R, perc = cp.alpha_sweep(G, alphas, 0.001, method, k = 20)
+			for j, alpha in enumerate(alphas):
+				np.testing.assert_array_almost_equal(R[:, [j]], cp.R_inf(G, alpha), 6, 'error in ' + method + ' alpha sweep')
+				np.testing.assert_array_almost_equal(perc[j], cp.classify(cp.R_inf(G, alpha), 0.001), 7)
+	# Asserting that a graph state gives the results of the networkx graph it was made from
+	def test_graph_state(self):
+		np.random.seed(5)
+		edges, pos = gm.generate_edges('geometric', 50, 0.25)
+		G = gm.graph_from_edges('geometric', 50, edges, pos)
+		state = gs.from_edges('geometric', 50, edges, pos)
+		f1_neighbors, f2_neighbors = gm.draw_placement(G, 'D', 6, 'random', 6)
+		G.add_node(50, type = 'D', opinion = 1, budget = 6)
+		G.add_node(51, type = 'U', opinion = -1, budget = 6)
+		gm.attach_neighbors(G, 50, f1_neighbors)
+		gm.attach_neighbors(G, 51, f2_neighbors)
+		gs.attach_peer(state, 'D', 1, f1_neighbors, 6)
+		gs.attach_peer(state, 'U', -1, f2_neighbors, 6)
+		np.testing.assert_array_equal(state['W'].toarray(), gs.from_networkx(G)['W'].toarray())
+		np.testing.assert_array_equal(state['forceful'], [50, 51])
+		R = cp.R_inf(G, self.alpha)
+		np.testing.assert_array_almost_equal(cp.R_inf(state, self.alpha), R, 10)
+		state['opinion'][:50] = R.ravel()
+		H = gs.to_networkx(state)
+		edges = lambda G: sorted((min(i, j), max(i, j), d['weight']) for i, j, d in G.edges(data = True))
+		self.assertEqual(edges(H), edges(G))
+		self.assertEqual(H.node[51]['type'], 'U')
+		self.assertEqual(cp.percentages(state, 0.001), cp.percentages(H, 0.001))
+	# Asserting the multi-column solve against R_inf and the shares against the sign rule of percentages
+	def test_influence_matrix(self):
+		np.random.seed(7)
+		G = gm.create_graph('barabasi_albert', 60, 2)
+		gm.add_forceful_peers(G, [('D', 8, 1), ('random', 8, -1), ('1/D', 8, 0.5)])
+		self.assertEqual(G.graph['forceful'], [60, 61, 62])
+		X = cp.influence_matrix(G, self.alpha)
+		self.assertEqual(X.shape, (60, 3))
+		np.testing.assert_array_almost_equal(X.dot([[1], [-1], [0.5]]), cp.R_inf(G, self.alpha), 10)
+		np.testing.assert_array_almost_equal(cp.R_inf(G, self.alpha, 'dense'), cp.R_inf(G, self.alpha), 10)
+		self.assertAlmostEqual(sum(cp.peer_shares(X, [1, -1, 0.5], 0.001)), 1, 10)
+		np.random.seed(7)
+		H = gm.create_graph('barabasi_albert', 60, 2)
+		gm.add_forceful(H, 'D', 8, 'random', 8)
+		R = cp.R_inf(H, self.alpha)
+		for i in range(60): H.node[i]['opinion'] = R[i, 0]
+		self.assertEqual(cp.peer_shares(cp.influence_matrix(H, self.alpha), [1, -1], 0.001), cp.percentages(H, 0.001))
+	# Asserting the shares of k peers with arbitrary opinions against the final opinions: allied peers share one side
+	def test_peer_shares(self):
+		np.random.seed(11)
+		G = gm.create_graph('barabasi_albert', 80, 2)
+		opinions = [1, 0.5, 1, -0.7, 0]
+		gm.add_forceful_peers(G, [('D', 6, 1), ('random', 6, 0.5), ('D', 6, 1), ('random', 10, -0.7), ('random', 6, 0)])
+		X = cp.influence_matrix(G, self.alpha)
+		R = cp.R_inf(G, self.alpha).ravel()
+		shares = cp.peer_shares(X, opinions, 0.001)
+		self.assertEqual(len(shares), 6)
+		self.assertAlmostEqual(shares[-1], np.mean(np.abs(R) <= 0.001), 10)
+		self.assertAlmostEqual(sum(shares[:3]), np.mean(R > 0.001), 10)
+		self.assertAlmostEqual(shares[3], np.mean(R < -0.001), 10)
+		self.assertEqual(shares[4], 0)
+		# a normal peer follows the peer bringing the largest part of its opinion on its side
+		counts = [0]*5
+		for i in range(80):
+			parts = [X[i, j]*opinions[j]*np.sign(R[i]) for j in range(5)]
+			if abs(R[i]) > 0.001: counts[parts.index(max(parts))] += 1
+		self.assertEqual(shares[:5], [c/80 for c in counts])
+		# two identical allied peers do not make their followers neutral
+		H = gm.create_graph('barabasi_albert', 30, 2)
+		gm.add_forceful_peers(H, [('D', 5, 1), ('D', 5, 1)])
+		Y = cp.influence_matrix(H, self.alpha)
+		self.assertAlmostEqual(cp.peer_shares(Y, [1, 1], 0.001)[-1], np.mean(np.abs(Y.sum(axis=1)) <= 0.001), 10)
+	# Asserting the local estimates of a few peers against R_inf within their bounds
+	def test_local_opinion(self):
+		np.random.seed(4)
+		G = gm.create_graph('barabasi_albert', 80, 2)
+		gm.add_forceful(G, 'D', 10, 'random', 10)
+		R = cp.R_inf(G, self.alpha).ravel()
+		nodes = [0, 17, 55]
+		for H in [G, gs.from_networkx(G)]:
+			estimates, bounds = cp.local_opinion(H, nodes, self.alpha, 1e-6)
+			self.assertTrue(np.all(bounds <= 1e-6))
+			self.assertTrue(np.all(np.abs(estimates - R[nodes]) <= bounds + 1e-12))
+		# a query stopped by max_pushes keeps a valid bound
+		estimates, bounds = cp.local_opinion(G, nodes, self.alpha, 1e-6, max_pushes=4)
+		self.assertTrue(np.all(bounds > 1e-6))
+		self.assertTrue(np.all(np.abs(estimates - R[nodes]) <= bounds + 1e-12))
+		estimates, bounds = cp.local_opinion(G, nodes, self.alpha, 0.05, 'walk', 0.001)
+		self.assertTrue(np.all(np.abs(estimates - R[nodes]) <= 0.05))
+	# Asserting the error of the float32 engine and the nodes refused within it of the neutral range boundary
+	def test_guarded_percentages(self):
+		np.random.seed(5)
+		G = gm.create_graph('geometric', 60, 0.3)
+		gm.add_forceful(G, 'D', 8, '1/D', 8)
+		R = cp.R_inf(G, self.alpha).ravel()
+		gm.R_itr(G, self.alpha, 'float32')
+		error = G.graph['convergence']['error']
+		self.assertLess(error, 1e-3)
+		self.assertTrue(np.all(np.abs(np.array(gm.get_opinion(G))[:60] - R) <= error + 1e-12))
+		self.assertEqual(cp.guarded_percentages(G, 0.001, 0), cp.percentages(G, 0.001) + [0])
+		neutral_range = abs(G.node[0]['opinion'])
+		guarded = cp.guarded_percentages(G, neutral_range, 1e-4)
+		self.assertGreaterEqual(guarded[3], 1/60)
+		self.assertAlmostEqual(sum(guarded), 1, 10)
 if __name__ == "__main__":
 	ut.main()
\ No newline at end of file
@@ -0,0 +1,92 @@
+## @package corpus
+# Persistent store of generated graphs of normal peers, indexed by their generation parameters and seed.
+# Every graph is a directory holding its symmetric weight matrix in CSR form ('indptr.npy', 'indices.npy' as int32 when
+# they fit, 'data.npy' float64), 'pos.npy' (n x 2 positions, geometric graphs only) and 'meta.json' (number of nodes and
+# statistics of the generation). Graphs stored as an edge list ('edges.npy', m x 2 int64) by older versions are still read.
+# A graph is written to a temporary directory which is then renamed, so a reader never sees a partial graph and
+# concurrent workers generating the same graph keep the first one written.
+# Arrays are loaded as read only memory maps wrapped in a CSR matrix: no copy is made and worker processes share the same pages.
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+##
+# returns the key of a graph: the parameters that determine its generation and the seed of its random stream
+# @param params dictionary of the match parameters (see simulation.simulate)
+# @param graph_seed seed of the random stream of the graph generation
+#
+def graph_key(params, graph_seed):
+	return '%s_%d_%s_%s_%s_%d' %(params['g_type'], params['num_peers'], repr(params['g_char']),
+			params.get('backend', 'networkx'), params.get('connect', 'reject'), graph_seed)
+
+##
+# returns the CSR weight matrix (every edge has a unit weight) and the positions (None if the graph has none)
+# of a networkx graph whose nodes are 0..n-1
+# @param G graph of normal peers
+#
+def graph_arrays(G):
+	n = G.number_of_nodes()
+	W = nx.to_scipy_sparse_matrix(G, nodelist=range(n), weight=None, dtype=float, format='csr')
+	pos = None
+	if n > 0 and 'pos' in G.node[0]:
+		pos = np.array([G.node[i]['pos'] for i in xrange(n)], dtype=float)
+	return W, pos
+
+##
+# Writes a graph to the corpus unless it is already there
+# @param root directory of the corpus
+# @param key key returned by graph_key
+# @param W symmetric CSR weight matrix
+# @param pos n x 2 positions, None if the graph has none
+# @param meta dictionary with at least the number of nodes 'num_nodes'
+#
+def store_graph(root, key, W, pos, meta):
+	path = os.path.join(root, key)
+	if os.path.exists(path): return
+	if not os.path.isdir(root): os.makedirs(root)
+	tmp = tempfile.mkdtemp(prefix = '.' + key + '.', dir = root)
+	W = sparse.csr_matrix(W)
+	W.sort_indices()
+	# the index type scipy keeps for the matrix, so that the memory maps are not converted when loaded
+	index_type = np.int32 if max(W.nnz, W.shape[0]) < 2**31 else np.int64
+	np.save(os.path.join(tmp, 'indptr.npy'), W.indptr.astype(index_type))
+	np.save(os.path.join(tmp, 'indices.npy'), W.indices.astype(index_type))
+	np.save(os.path.join(tmp, 'data.npy'), W.data.astype(float))
+	if pos is not None: np.save(os.path.join(tmp, 'pos.npy'), np.asarray(pos, dtype=float))
+	with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+		json.dump(meta, f)
+	try:
+		os.rename(tmp, path)
+	except OSError:
+		# written by another process in the meantime
+		shutil.rmtree(tmp, ignore_errors = True)
+		if not os.path.exists(path): raise
+
+##
+# Loads a graph of the corpus as read only memory maps
+# returns (W, pos, meta) with the CSR weight matrix W on the memory maps, pos is None if the graph has no positions,
+# or None if the graph is not in the corpus
+# @param root directory of the corpus
+# @param key key returned by graph_key
+#
+def load_graph(root, key):
+	path = os.path.join(root, key)
+	if not os.path.isdir(path): return None
+	with open(os.path.join(path, 'meta.json')) as f:
+		meta = json.load(f)
+	n = meta['num_nodes']
+	if os.path.exists(os.path.join(path, 'edges.npy')):
+		# edge list of an older corpus, symmetrized in memory
+		edges = np.load(os.path.join(path, 'edges.npy'))
+		W = sparse.coo_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(n, n))
+		W = (W + W.T).tocsr()
+	else:
+		data, indices, indptr = [np.load(os.path.join(path, name + '.npy'), mmap_mode = 'r') for name in ['data', 'indices', 'indptr']]
+		W = sparse.csr_matrix((data, indices, indptr), shape=(n, n), copy=False)
+	pos_path = os.path.join(path, 'pos.npy')
+	pos = np.load(pos_path, mmap_mode = 'r') if os.path.exists(pos_path) else None
+	return W, pos, meta
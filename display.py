@@ -1,21 +1,31 @@
 import networkx as nx
-import matplotlib.pyplot as plt
 import excp as ex
 import time
 import random as rd
 import numpy as np
+import graph_state as gs
+import hashlib
+import os
+from scipy import sparse
+from scipy.sparse.linalg import eigsh
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 #import graphviz
 #import pygraphviz
 #import pydot
 
 ##
-# draws the graph according to both category and opinion
+# draws the graph according to both category and opinion in an interactive window (see render_graph to write a file)
 # @param G graph to be displayed
 # @param neutral_range opinion between + and - of this value are considered neutral
 # @param num_nodes number of nodes to be displayed: expected to be either all or without forceful peers
 # @param SEED can be used to regenerate the same layout.
 #
 def display_graph(G,neutral_range,num_nodes,SEED):
+	# pyplot needs a display, render_graph does not
+	import matplotlib.pyplot as plt
 	# Seed for the graph creation to have the two graphs (category and opinion) with the same shape
 	np.random.seed(SEED)
 	total_nodes = nx.number_of_nodes(G) 
@@ -64,71 +74,155 @@ def display_graph(G,neutral_range,num_nodes,SEED):
 ##
 # colors graph to distinguish between different categories of nodes
 # categories: +1, -1, attached to +1 only, attached to -1 only, attached to both, not attached to any of them
-# @param G graph from which the nodes colors will be chsen accordingly
+# The neighbors of the forceful peers are read from the columns of the weight matrix instead of one node at a time
+# @param G graph from which the nodes colors will be chsen accordingly, or graph state
 #
 def color_graph_cat(G):
-	n = nx.number_of_nodes(G)
-	color_map = []
-	for i in xrange(n):
-		# color for forceful peer +1
-		if G.node[i]['opinion'] == 1:
-			color_map.append('blue')
-		# color for forceful peer -1
-		elif G.node[i]['opinion'] == -1:
-			color_map.append('crimson')
-		# if neighbor of -1 forceful peer
-		elif n-1 in G.neighbors(i) and n-2 not in G.neighbors(i):
-			color_map.append('lightsalmon')
-		# if neighbor of +1 forceful peer
-		elif n-2 in G.neighbors(i) and n-1 not in G.neighbors(i):
-			color_map.append('lightskyblue')
-		# if neighbor of both forceful peers
-		elif n-1 in G.neighbors(i) and n-2 in G.neighbors(i):
-			color_map.append('w')
-		# if not connected to any of the forceful peer
-		elif n-2 not in G.neighbors(i) and n-1 not in G.neighbors(i): # If neighbor of none of the forceful peers
-			color_map.append('grey')
-		# a test if a category of nodes has not been covered
-		else :
-			try:
-				color_map.append('limegreen')
-				raise ex.UncategorizedNodeError(i)
-			except ex.UncategorizedNodeError as un:
-				print 'warning a node [',i,'] out of the specifed categories\n will be colored in lime green '
-
-
-	return color_map;
+	state = gs.as_state(G)
+	opinion = state['opinion']
+	W = state['W'].tocsc()
+	forceful = state['forceful']
+	# normal peers attached to a forceful peer of each sign
+	near_pos = np.asarray(W[:, forceful[opinion[forceful] > 0]].sum(axis=1)).ravel() > 0
+	near_neg = np.asarray(W[:, forceful[opinion[forceful] < 0]].sum(axis=1)).ravel() > 0
+	categories = [opinion == 1, opinion == -1, near_neg & ~near_pos, near_pos & ~near_neg, near_pos & near_neg,
+			~near_pos & ~near_neg]
+	return np.select(categories, ['blue', 'crimson', 'lightsalmon', 'lightskyblue', 'w', 'grey'], 'limegreen').tolist();
 
 ##
 # colors graph to distinguish between nodes according to their opinion
 # categories: +1, -1, less than neutral range, neutral, more than neutral range
-# @param G graph to be drawn
+# @param G graph to be drawn, or graph state
 # @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
 #
 def color_graph_op(G,neutral_range):
-	n = nx.number_of_nodes(G)
-	color_map = []
-	for i in xrange(n):
-		# color for forceful peer +1
-		if G.node[i]['opinion'] == 1:
-			color_map.append('blue')
-		# color for forceful peer -1
-		elif G.node[i]['opinion'] == -1:
-			color_map.append('crimson')
-		# color for normal peer with negative opinion
-		elif G.node[i]['opinion'] < - neutral_range: 
-			color_map.append('lightsalmon')
-		# color for normal peer with positive value
-		elif G.node[i]['opinion'] > neutral_range:
-			color_map.append('lightskyblue')
-		# color for neutral normal peer
-		elif G.node[i]['opinion'] >= - neutral_range and G.node[i]['opinion'] <= neutral_range:
-			color_map.append('grey')
-		# a test if a category of nodes has not been covered
-		else :
-			try:
-				color_map.append('limegreen')
-				raise ex.UncategorizedNodeError(i)
-			except ex.UncategorizedNodeError as un:
-				print 'warning a node [',i,'] out of the specifed categories according to opinion\n will be colored in lime green '
-	return color_map;
\ No newline at end of file
+	opinion = gs.node_arrays(G)[2]
+	categories = [opinion == 1, opinion == -1, opinion < - neutral_range, opinion > neutral_range,
+			(opinion >= - neutral_range) & (opinion <= neutral_range)]
+	color_map = np.select(categories, ['blue', 'crimson', 'lightsalmon', 'lightskyblue', 'grey'], 'limegreen')
+	# a test if a category of nodes has not been covered (e.g. nan opinion)
+	for i in np.flatnonzero(color_map == 'limegreen'):
+		try:
+			raise ex.UncategorizedNodeError(i)
+		except ex.UncategorizedNodeError as un:
+			print 'warning a node [',i,'] out of the specifed categories according to opinion\n will be colored in lime green '
+	return color_map.tolist();
+
+# layouts already computed, keyed by (seed, fingerprint of the graph)
+_layouts = {}
+
+##
+# returns a fingerprint of the edges between the normal peers of a graph state
+# two graphs with the same fingerprint have the same layout
+# @param state graph state
+#
+def graph_fingerprint(state):
+	n = state['n']
+	W = state['W'][:n][:, :n].tocsr()
+	W.sort_indices()
+	digest = hashlib.sha1()
+	for a in (W.indptr, W.indices, W.data):
+		digest.update(np.ascontiguousarray(a).tostring())
+	return '%d-%s' %(n, digest.hexdigest())
+
+##
+# returns the n x 2 positions of the normal peers of a graph state
+# Geometric graphs use the positions of their nodes, other graphs a spring layout up to spring_max nodes and a spectral layout
+# (eigenvectors of the 2nd and 3rd largest eigenvalues of D^-1/2 W D^-1/2) above, which only costs a few sparse products.
+# Layouts are cached in memory and, with a cache directory, on disk under the key (seed, graph fingerprint)
+# @param state graph state
+# @param seed seed of the layout
+# @param cache_dir directory of the layouts stored on disk, None to keep them in memory only
+# @param spring_max largest number of normal peers laid out by nx.spring_layout
+#
+def graph_layout(state, seed, cache_dir=None, spring_max=2000):
+	n = state['n']
+	if state['pos'] is not None: return state['pos']
+	key = (seed, graph_fingerprint(state))
+	if key in _layouts: return _layouts[key]
+	path = None
+	if cache_dir is not None:
+		path = os.path.join(cache_dir, 'layout_%d_%s.npy' % key)
+		if os.path.exists(path):
+			_layouts[key] = np.load(path)
+			return _layouts[key]
+	W = state['W'][:n][:, :n].tocsr()
+	if n <= spring_max:
+		np.random.seed(seed)
+		layout = nx.spring_layout(nx.from_scipy_sparse_matrix(W))
+		pos = np.array([layout[i] for i in xrange(n)], dtype=float)
+	else:
+		deg = np.asarray(W.sum(axis=1)).ravel()
+		scale = 1/np.sqrt(np.maximum(deg, 1e-12))
+		S = sparse.diags(scale, 0).dot(W).dot(sparse.diags(scale, 0))
+		v0 = np.random.RandomState(seed).random_sample(n)
+		values, vectors = eigsh(S, 3, which='LA', v0 = v0)
+		order = np.argsort(values)[::-1]
+		# eigenvectors of the random walk matrix D^-1 W (Laplacian eigenmaps)
+		pos = vectors[:, order[1:3]]*scale[:, None]
+	# fit the layout in the unit square
+	pos = pos - pos.min(axis=0)
+	pos = pos/np.maximum(pos.max(axis=0), 1e-12)
+	_layouts[key] = pos
+	if path is not None:
+		if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+		np.save(path, pos)
+	return pos
+
+##
+# Draws the graph colored by opinion straight into an image file (PNG, SVG... from the extension), without a display
+# Colors are classified for all nodes at once, edges are drawn as one line collection and the legend uses proxy markers.
+# Above max_nodes normal peers a random sample of max_nodes peers is drawn (forceful peers are always drawn),
+# and at most max_edges of the edges between the drawn nodes
+# @param G graph or graph state
+# @param neutral_range opinion between + and - of this value are considered neutral
+# @param path image file to write
+# @param seed seed of the layout and of the sampling
+# @param max_nodes largest number of normal peers drawn
+# @param max_edges largest number of edges drawn
+# @param cache_dir directory where the layouts are cached (see graph_layout)
+#
+def render_graph(G, neutral_range, path, seed, max_nodes=5000, max_edges=20000, cache_dir=None):
+	state = gs.as_state(G)
+	n = state['n']
+	N = len(state['opinion'])
+	forceful = state['forceful']
+	pos = np.zeros((N, 2))
+	pos[:n] = graph_layout(state, seed, cache_dir)
+	# forceful peers are drawn out of the unit square, the positive ones on the left and the negative ones on the right
+	opinion = state['opinion']
+	for k, f in enumerate(forceful):
+		pos[f] = [-0.25, 0.2 + 0.1*k] if opinion[f] > 0 else [1.25, 0.8 - 0.1*k]
+	colors = np.array(color_graph_op(state, neutral_range))
+	rs = np.random.RandomState(seed)
+	if n > max_nodes: drawn = np.sort(rs.choice(n, max_nodes, replace = False))
+	else: drawn = np.arange(n)
+	drawn = np.concatenate([drawn, forceful])
+	keep = np.zeros(N, dtype=bool)
+	keep[drawn] = True
+	edges = sparse.triu(state['W'], 1).tocoo()
+	mask = keep[edges.row] & keep[edges.col]
+	rows, cols = edges.row[mask], edges.col[mask]
+	if len(rows) > max_edges:
+		sample = rs.choice(len(rows), max_edges, replace = False)
+		rows, cols = rows[sample], cols[sample]
+	fig = Figure(figsize = (8.5, 8), dpi = 80)
+	FigureCanvasAgg(fig)
+	ax = fig.add_subplot(111)
+	ax.add_collection(LineCollection(np.stack([pos[rows], pos[cols]], axis=1), colors = 'black', linewidths = 0.3,
+			alpha = 0.3, zorder = 1))
+	size = 100 if len(drawn) <= 500 else max(2, 100*500/len(drawn))
+	ax.scatter(pos[drawn, 0], pos[drawn, 1], s = size, c = colors[drawn].tolist(), linewidths = 0, zorder = 2)
+	types = state['types']
+	names = [types[state['type'][f]] for f in forceful]
+	positive = [name for f, name in zip(forceful, names) if opinion[f] > 0]
+	negative = [name for f, name in zip(forceful, names) if opinion[f] < 0]
+	legend = [('crimson', '/'.join(negative) + ' forceful peer'), ('blue', '/'.join(positive) + ' forceful peer'),
+			('lightskyblue', 'following ' + '/'.join(positive)), ('lightsalmon', 'following ' + '/'.join(negative)),
+			('grey', 'Neutral')]
+	ax.legend([Line2D([0], [0], linestyle = 'none', marker = 'o', color = c) for c, label in legend],
+			[label for c, label in legend], numpoints = 1, loc = (0, 0.88))
+	ax.set_title('Opinion ' + ' VS '.join(names) + ('' if len(drawn) == N else ' (%d of %d nodes)' %(len(drawn), N)))
+	ax.autoscale_view()
+	fig.savefig(path)
+	return;
@@ -12,4 +12,9 @@ class ConvergenceError(AssertionError):
 # Exception triggered when a node is not in one of the specified category
 class UncategorizedNodeError(Exception):
 	def __init__(self,n_key):
-		self.node = n_key
\ No newline at end of file
+		self.node = n_key
+
+# Exception raised by a worker process instead of the SystemExit of the simulation code:
+# a pool worker only catches Exception, a SystemExit would kill it and leave the parent waiting for the lost task
+class WorkerExit(Exception):
+	pass
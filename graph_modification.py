@@ -6,10 +6,21 @@ import networkx as nx
 import random as rd
 import numpy as np
 import operator as op
+import heapq
 import sys
-import pulp
 import excp as ex
 import math as m
+import computation as cp
+import graph_state as gs
+import instrument as ins
+import parallel_solve as ps
+from scipy import sparse
+from scipy.sparse.linalg import splu, cg
+
+# strategies of choose_neighbors, opinion engines of R_itr and MILP solvers of add_smart
+STRATEGIES = ['random', 'D', 'D^2', '1/D']
+ENGINES = ['loop', 'sparse', 'parallel', 'float32', 'gauss-seidel', 'sor', 'chebyshev', 'cg']
+SMART_SOLVERS = ['sparse', 'gurobi', 'cbc']
 
 ##
 # Create a network graph, of a given type and characteristic
@@ -17,8 +28,14 @@ import math as m
 # @param g_char graph charateristic that depends on the graph type
 # For a random graph: probability of an edge between any 2 nodes
 # For a geometric graph maximum euclidean distance for a edge to exist between 2 nodes
+# @param backend 'networkx' uses the networkx generators, 'fast' the array generators of generate_edges
 #
-def create_graph(g_type,num_peers, g_char):
+def create_graph(g_type,num_peers, g_char, backend='networkx'):
+	if backend == 'fast':
+		edges, pos = generate_edges(g_type, num_peers, g_char)
+		return graph_from_edges(g_type, num_peers, edges, pos)
+	elif backend != 'networkx':
+		raise SystemExit('Chosen graph backend ['+str(backend)+'] is not applicable.\nProgram will terminate')
 	if g_type == 'random':
 		# Initialize an erdos renyi graph with probability g_char
 		G = nx.erdos_renyi_graph(num_peers,g_char)
@@ -37,6 +54,187 @@ def create_graph(g_type,num_peers, g_char):
 	# Assign normal peers with type and opinion
 	assign_normal(G)
 	return G;
+
+##
+# Generates the edges of a graph of a given type and characteristic with NumPy arrays, without building a networkx graph
+# g_type and g_char have the same meaning as in create_graph, all edges have a unit weight
+# returns (edges, pos): edges is an m x 2 integer array, pos the n x 2 node positions of a geometric graph (None otherwise)
+# @param g_type 'random', 'geometric' or 'barabasi_albert'
+# @param num_peers number of normal peers in the graph
+# @param g_char graph charateristic that depends on the graph type
+#
+def generate_edges(g_type, num_peers, g_char):
+	pos = None
+	if g_type == 'random':
+		edges = erdos_renyi_edges(num_peers, g_char)
+	elif g_type == 'geometric':
+		# positions uniformly distributed in the unit square
+		pos = np.random.random((num_peers, 2))
+		edges = geometric_edges(pos, g_char)
+	elif g_type == 'barabasi_albert':
+		edges = barabasi_albert_edges(num_peers, g_char)
+	else : raise SystemExit('Chosen graph type ['+str(g_type)+'] is not applicable.\nProgram will terminate')
+	return edges, pos
+
+##
+# Builds the networkx graph of normal peers from an edge array, with the same attributes as create_graph
+# @param g_type type of the graph stored in G.graph['type']
+# @param num_peers number of normal peers in the graph
+# @param edges m x 2 integer array of edges, each with a unit weight
+# @param pos optional n x 2 array of node positions
+#
+def graph_from_edges(g_type, num_peers, edges, pos=None):
+	G = nx.Graph()
+	# The initial opinion is given as neutral = 0
+	G.add_nodes_from(xrange(num_peers), type = 'normal', opinion = 0, initial_opinion = 0)
+	G.add_edges_from(np.asarray(edges).tolist(), weight = 1)
+	if pos is not None:
+		for n in xrange(num_peers):
+			G.node[n]['pos'] = pos[n].tolist()
+	G.graph['type'] = g_type
+	return G
+
+##
+# Edges of an Erdos Renyi graph by geometric skip sampling, in O(n + m) instead of testing the n(n-1)/2 pairs
+# The gaps between the linear indices of successive edges among all pairs are geometric with parameter p
+# @param n number of nodes
+# @param p probability of an edge between any 2 nodes
+#
+def erdos_renyi_edges(n, p):
+	total = n*(n-1)//2
+	if p <= 0 or total == 0:
+		return np.zeros((0, 2), dtype=np.int64)
+	if p >= 1:
+		k = np.arange(total, dtype=np.int64)
+	else:
+		# draw the gaps by batches a bit larger than the expected number of edges
+		batch = int(total*p + 4*np.sqrt(total*p) + 16)
+		chunks = []
+		last = -1
+		while last < total:
+			k = last + np.cumsum(np.random.geometric(p, batch))
+			chunks.append(k)
+			last = k[-1]
+		k = np.concatenate(chunks)
+		k = k[k < total]
+	# pair (w, v) with w < v of the linear index k = v(v-1)/2 + w
+	v = np.floor((1 + np.sqrt(1 + 8*k.astype(float)))/2).astype(np.int64)
+	# correct the rounding of the square root
+	v -= (v*(v-1)//2 > k)
+	v += ((v+1)*v//2 <= k)
+	w = k - v*(v-1)//2
+	return np.column_stack((w, v))
+
+##
+# Edges of a random geometric graph between nodes at an euclidean distance of at most radius
+# Nodes are bucketed in a grid of cells of side radius, only pairs in the same or adjacent cells are compared
+# @param pos n x 2 array of node positions in the unit square
+# @param radius maximum euclidean distance for a edge to exist between 2 nodes
+#
+def geometric_edges(pos, radius):
+	n = len(pos)
+	if n == 0 or radius <= 0:
+		return np.zeros((0, 2), dtype=np.int64)
+	ncell = max(1, int(np.ceil(1/radius)))
+	cx = np.minimum((pos[:, 0]/radius).astype(np.int64), ncell-1)
+	cy = np.minimum((pos[:, 1]/radius).astype(np.int64), ncell-1)
+	cell = cx*ncell + cy
+	order = np.argsort(cell, kind='mergesort')
+	sorted_cell = cell[order]
+	chunks = []
+	# the same cell and half of the adjacent ones, so that every pair of cells is visited once
+	for dx, dy in [(0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]:
+		src = np.flatnonzero((cx + dx < ncell) & (cy + dy >= 0) & (cy + dy < ncell))
+		target = (cx[src] + dx)*ncell + cy[src] + dy
+		lo = np.searchsorted(sorted_cell, target, 'left')
+		counts = np.searchsorted(sorted_cell, target, 'right') - lo
+		i = np.repeat(src, counts)
+		offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		j = order[np.repeat(lo, counts) + offsets]
+		keep = ((pos[i] - pos[j])**2).sum(axis=1) <= radius**2
+		if dx == 0 and dy == 0: keep &= i < j
+		chunks.append(np.column_stack((np.minimum(i, j), np.maximum(i, j)))[keep])
+	return np.concatenate(chunks)
+
+##
+# Edges of a Barabasi Albert graph by preferential attachment on a preallocated array of repeated nodes
+# Every new node attaches to m distinct nodes chosen with a probability proportional to their degree,
+# the first new node (m) attaches to the m starting nodes as in networkx
+# The array of repeated nodes holds the block [targets of s, s repeated m times] of every new node s in order, so that
+# the targets of s are uniform draws among the 2m(s-m) entries of the blocks before its own. All draws are made in one batch:
+# an entry in the second half of a block is the node of the block, one in the first half is the target of an earlier draw,
+# followed by pointer jumping. The draws giving a node twice the same target are drawn again until all targets are distinct.
+# @param n number of nodes
+# @param m number of edges of every new node
+#
+def barabasi_albert_edges(n, m):
+	if m < 1 or m >= n:
+		raise nx.NetworkXError("Barabasi-Albert network must have m>=1 and m<n, m=%d,n=%d" % (m, n))
+	# one draw per edge, the draws of the new node s are (s-m)*m..(s-m)*m+m-1
+	source = np.repeat(np.arange(m, n, dtype=np.int64), m)
+	draws = len(source)
+	# the first new node takes the starting nodes, its draws stay fixed
+	entry = np.zeros(draws, dtype=np.int64)
+	redraw = np.arange(m, draws)
+	while True:
+		# uniform entry of the blocks before the one of the source
+		entry[redraw] = (np.random.random(len(redraw))*(2*m*(source[redraw] - m))).astype(np.int64)
+		block, offset = entry//(2*m), entry % (2*m)
+		# an entry in the first half of a block points to the draw of the target written there
+		parent = np.where(offset < m, block*m + offset, -1)
+		target = np.where(offset < m, -1, m + block)
+		target[:m] = np.arange(m)
+		pending = np.flatnonzero(target < 0)
+		while len(pending) > 0:
+			up = parent[pending]
+			known = target[up] >= 0
+			target[pending[known]] = target[up[known]]
+			# jump over the draw that is not known yet
+			parent[pending[~known]] = parent[up[~known]]
+			pending = pending[~known]
+		# draws repeating a target of the same node, all but its first draw of that target
+		rows = target.reshape(-1, m)
+		order = np.argsort(rows, axis=1, kind='mergesort')
+		ordered = rows[np.arange(len(rows))[:, None], order]
+		repeated = np.zeros(rows.shape, dtype=bool)
+		repeated[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+		redraw = (np.arange(len(rows))[:, None]*m + order)[repeated]
+		if len(redraw) == 0: break
+	return np.column_stack((source, target))
+
+##
+# Makes a graph of normal peers connected without generating a new one
+# 'giant' keeps the largest connected component (lowest node key first on ties) and relabels its nodes 0..k-1 in their order
+# 'bridge' links every other component, from the largest to the smallest, to the part already connected by one edge of weight 1
+# from the lowest key node of the component to a node of the connected part chosen uniformly at random (np.random)
+# G.graph['repair'] stores the number of 'components', the 'added_edges' and the 'dropped_nodes'
+# returns the connected graph: a new graph for 'giant', G itself for 'bridge'
+# @param G graph of normal peers
+# @param mode 'giant' or 'bridge'
+#
+def connect_graph(G, mode):
+	# components sorted from the largest to the smallest, each as a sorted list of node keys
+	components = sorted((sorted(c) for c in nx.connected_components(G)), key = lambda c: (-len(c), c[0]))
+	repair = {'components': len(components), 'added_edges': 0, 'dropped_nodes': 0}
+	if mode == 'giant':
+		if len(components) > 1:
+			repair['dropped_nodes'] = G.number_of_nodes() - len(components[0])
+			G = nx.convert_node_labels_to_integers(G.subgraph(components[0]), ordering = 'sorted')
+	elif mode == 'bridge':
+		# keys of the connected part, in the order they joined it
+		connected = np.empty(G.number_of_nodes(), dtype=np.int64)
+		count = len(components[0]) if len(components) > 0 else 0
+		connected[:count] = components[0] if count > 0 else []
+		for c in components[1:]:
+			G.add_edge(c[0], int(connected[np.random.randint(0, count)]), weight = 1)
+			repair['added_edges'] += 1
+			connected[count:count+len(c)] = c
+			count += len(c)
+		if len(components) > 1: gs.changed(G)
+	else : raise SystemExit('Chosen connectivity mode ['+str(mode)+'] is not applicable.\nProgram will terminate')
+	G.graph['repair'] = repair
+	return G
+
 ##
 # assign type and opinion attributes to all nodes of the graph as normal peers
 # @param G graph containing the nodes to be edited
@@ -56,46 +254,332 @@ def assign_normal(G):
 
 ##
 # Calculates the final opinion vector R_inf by iterations using algorithm 15 in Dr. Amira's thesis
-# @param G graph of nodes to update their opinions
+# The engines other than 'loop' store their number of iterations and residuals in the 'convergence' graph attribute
+# (G.graph['convergence'], see graph_state.attributes)
+# @param G graph of nodes to update their opinions, or graph state
 # @param ALPHA weight given to self opinion (between 0 and 1)
+# @param engine opinion engine used for the iterations:
+# 'loop' calls local_update on the networkx graph, 'sparse' runs the same update as a sparse matrix-vector product,
+# 'gauss-seidel', 'sor', 'chebyshev' and 'cg' are accelerated solvers of the same system (see sparse_update),
+# 'parallel' runs the iterations of 'sparse' on blocks of peers in worker processes (see parallel_solve)
+# and 'float32' runs them in single precision (see sparse_update)
+# @param omega relaxation factor of the 'sor' engine, None for the optimal value estimated from ALPHA
+# @param trace convergence trace made by new_trace recording the residual of every iteration, nothing is written to disk
+# until flush_trace is called
+# @param workers number of worker processes of the 'parallel' engine, None for the number of cores
 #
-def R_itr(G,ALPHA):
+def R_itr(G,ALPHA,engine='loop',omega=None,trace=None,workers=None):
 	# The maximum accepted difference of opinions between two iterations.iterations terminated when reached
 	THRESHOLD = 0.00001
-	# maximum difference variable to indicate the change in opinion after local update
-	max_diff = 1
-	# Loop to call Local update function until max difference is less than the threshold
-	# @var num_loops nuber of loops needed until conversion
-	num_loops = 0
-	# File to store imulation related info
-	f = open("Opinions_last_simulation.txt", "w")
-	while (max_diff > THRESHOLD):
-		# storing opinion values in a list before update at (t-1)
-		op_list_t_1 = get_opinion(G)
-		local_update(G,ALPHA)
-		# storing opinions after update at time t
-		op_list_t = get_opinion(G)
-		max_diff = max_opinion_difference(op_list_t, op_list_t_1)
-		num_loops += 1
-	f.write('The maximum difference = '+ str(max_diff)+ '\n')
-	f.write('number of loops until conversion = '+ str(num_loops)+ '\n')
+	if engine == 'loop':
+		# maximum difference variable to indicate the change in opinion after local update
+		max_diff = 1
+		# Loop to call Local update function until max difference is less than the threshold
+		# @var num_loops nuber of loops needed until conversion
+		num_loops = 0
+		while (max_diff > THRESHOLD):
+			# storing opinion values in a list before update at (t-1)
+			op_list_t_1 = get_opinion(G)
+			local_update(G,ALPHA)
+			# storing opinions after update at time t
+			op_list_t = get_opinion(G)
+			max_diff = max_opinion_difference(op_list_t, op_list_t_1)
+			num_loops += 1
+			if trace is not None: trace_record(trace, max_diff, op_list_t)
+	else: max_diff, num_loops = sparse_update(G, ALPHA, THRESHOLD, engine, omega, trace, workers)
+	ins.count('solver_calls')
+	ins.count('iterations', num_loops)
 	# R_itr contains opinion of nodes due to iterations
 	R_itr = []
-	# Write the opinions of nodes in a file
-	f.write('Opinion of nodes:\n')
-	for n in range(G.number_of_nodes()-2):
-		R_itr.append([G.node[n]['opinion']])
-		f.write('Opinion of %d is %f\n' %(n,G.node[n]['opinion']))
+	if gs.is_state(G): R_itr = G['opinion'][:G['n']].reshape(-1, 1).tolist()
+	else:
+		for n in range(gs.num_normal(G)):
+			R_itr.append([G.node[n]['opinion']])
+	if trace is not None:
+		trace['runs'] += 1
+		trace['last'] = {'engine': engine, 'max_diff': max_diff, 'loops': num_loops, 'opinions': R_itr}
+	return R_itr;
+
+##
+# returns an empty convergence trace to be passed to R_itr
+# The residuals (maximum difference between 2 iterations) of the last 'size' iterations are kept in a preallocated ring buffer,
+# the iterations of consecutive calls of R_itr follow each other in the buffer.
+# Every snapshot_every iterations the opinions of the sampled nodes are copied into a second ring buffer of 'snapshots' rows
+# @param size number of residuals kept
+# @param nodes keys of the nodes whose opinions are sampled, None for no snapshots
+# @param snapshot_every number of iterations between 2 snapshots
+# @param snapshots number of snapshots kept
+#
+def new_trace(size=4096, nodes=None, snapshot_every=10, snapshots=64):
+	nodes = np.zeros(0, dtype=np.int64) if nodes is None else np.asarray(nodes, dtype=np.int64)
+	if len(nodes) == 0: snapshots = 0
+	return {'size': size, 'residuals': np.zeros(size), 'iterations': 0,
+			'nodes': nodes, 'snapshot_every': snapshot_every, 'snapshots': np.zeros((snapshots, len(nodes))),
+			'snapshot_iterations': np.zeros(snapshots, dtype=np.int64), 'num_snapshots': 0,
+			'runs': 0, 'last': None}
+
+##
+# Records the residual of one iteration in a trace, and a snapshot of the sampled opinions when one is due
+# @param trace dictionary returned by new_trace
+# @param residual maximum difference of the iteration
+# @param opinions opinions of all nodes indexed by their keys, or a function returning them (only called for a snapshot)
+#
+def trace_record(trace, residual, opinions):
+	trace['residuals'][trace['iterations'] % trace['size']] = residual
+	trace['iterations'] += 1
+	if len(trace['snapshots']) > 0 and trace['iterations'] % trace['snapshot_every'] == 0:
+		if callable(opinions): opinions = opinions()
+		row = trace['num_snapshots'] % len(trace['snapshots'])
+		trace['snapshots'][row] = np.asarray(opinions)[trace['nodes']]
+		trace['snapshot_iterations'][row] = trace['iterations']
+		trace['num_snapshots'] += 1
+	return;
+
+##
+# returns the residuals kept by a trace, oldest first
+# @param trace dictionary returned by new_trace
+#
+def trace_residuals(trace):
+	count = min(trace['iterations'], trace['size'])
+	start = trace['iterations'] - count
+	return trace['residuals'][np.arange(start, start + count) % trace['size']]
+
+##
+# Writes a trace to a text file: the last run of R_itr with the opinions of the normal peers as R_itr used to write them,
+# followed by the residuals and the snapshots kept
+# @param trace dictionary returned by new_trace
+# @param path file to write, e.g. Opinions_last_simulation.txt
+#
+def flush_trace(trace, path):
+	f = open(path, "w")
+	last = trace['last']
+	if last is not None:
+		f.write('The maximum difference = '+ str(last['max_diff'])+ '\n')
+		f.write('number of loops until conversion = '+ str(last['loops'])+ '\n')
+		f.write('Opinion of nodes:\n')
+		for n in range(len(last['opinions'])):
+			f.write('Opinion of %d is %f\n' %(n,last['opinions'][n][0]))
+		f.write('===========================\n')
+	residuals = trace_residuals(trace)
+	f.write('Residuals of the last %d of %d iterations (%d runs):\n' %(len(residuals), trace['iterations'], trace['runs']))
+	for i, res in enumerate(residuals):
+		f.write('%d %e\n' %(trace['iterations'] - len(residuals) + i + 1, res))
+	count = min(trace['num_snapshots'], len(trace['snapshots']))
+	if count > 0:
+		f.write('Snapshots of nodes ' + ' '.join(str(n) for n in trace['nodes']) + ':\n')
+		for j in xrange(trace['num_snapshots'] - count, trace['num_snapshots']):
+			row = j % len(trace['snapshots'])
+			f.write(str(trace['snapshot_iterations'][row]) + ' ' + ' '.join('%f' % o for o in trace['snapshots'][row]) + '\n')
 	f.write('===========================\n')
 	f.close()
-	return R_itr;
+	return;
+
+##
+# Solves the opinions of all normal peers with sparse matrices, forceful peers are held as fixed boundary values
+# The system x = c + Pf x is the one of the synchronous local update r(t) = alpha*h + (1-alpha)/deg * W r(t-1)
+# restricted to the updated peers (c holds alpha*h and the influence of the fixed peers)
+# The final opinions are written back to the opinions of the nodes and the 'convergence' graph attribute (graph_state.attributes) stores
+# the 'engine', the number of 'iterations', the 'residuals' of every iteration and the final 'residual' max|c + Pf x - x|
+# The 'float32' engine builds and iterates its system with float32 weights and opinions and int32 indices (half the memory),
+# its 'residual' is the float64 one of a sample of rows (sampled_residual) and 'error' (residual/alpha) estimates the maximum deviation
+# of its opinions from the float64 solution
+# returns the last maximum difference (relative residual for cg) and the number of iterations
+# @param G graph of nodes to update their opinions, or graph state
+# @param alpha weight given to self opinion (between 0 and 1)
+# @param threshold maximum accepted difference of opinions between two iterations (relative residual for cg)
+# @param engine 'sparse' (Jacobi, the update of local_update), 'parallel' (Jacobi on worker processes), 'float32' (Jacobi in
+# single precision), 'gauss-seidel', 'sor', 'chebyshev' or 'cg'
+# @param omega relaxation factor of 'sor', None for 2/(1+sqrt(1-(1-alpha)^2))
+# @param trace convergence trace made by new_trace, None for no trace
+# @param workers number of worker processes of 'parallel', None for the number of cores
+#
+def sparse_update(G, alpha, threshold, engine='sparse', omega=None, trace=None, workers=None):
+	P, b, r, free, deg = cp.opinion_system(G, alpha, engine == 'float32')
+	Pf = P[:, free].tocsr()
+	# contribution of the fixed peers
+	fixed = r.copy()
+	fixed[free] = 0
+	c = b + P.dot(fixed)
+	# only Pf is kept during the iterations
+	del P, fixed
+	x = r[free]
+	# spectral radius bound of Pf, which is similar to a symmetric matrix with eigenvalues in [-(1-alpha), 1-alpha]
+	rho = 1 - alpha
+	callback = None
+	if trace is not None:
+		def callback(max_diff, x_t):
+			def opinions():
+				r_t = r.copy()
+				r_t[free] = x_t
+				return r_t
+			trace_record(trace, max_diff, opinions)
+	if len(free) == 0:
+		residuals = [0]
+	elif engine == 'sparse':
+		x, residuals = jacobi(Pf, c, x, threshold, callback)
+	elif engine == 'parallel':
+		x, residuals = ps.parallel_jacobi(Pf, c, x, threshold, workers, callback)
+	elif engine == 'float32':
+		x, residuals = jacobi(single_precision(Pf), c.astype(np.float32), x.astype(np.float32), threshold, callback)
+		x = x.astype(float)
+	elif engine == 'gauss-seidel':
+		x, residuals = sor(Pf, c, x, threshold, 1, callback)
+	elif engine == 'sor':
+		if omega is None: omega = 2/(1 + np.sqrt(1 - rho**2))
+		x, residuals = sor(Pf, c, x, threshold, omega, callback)
+	elif engine == 'chebyshev':
+		x, residuals = chebyshev(Pf, c, x, threshold, rho, callback)
+	elif engine == 'cg':
+		x, residuals = conjugate_gradient(Pf, c, x, threshold, deg, callback)
+	else : raise SystemExit('Chosen opinion engine ['+str(engine)+'] is not applicable.\nProgram will terminate')
+	r[free] = x
+	if gs.is_state(G): G['opinion'][free] = x
+	else:
+		for i in free:
+			G.node[i]['opinion'] = r[i]
+	if engine == 'float32':
+		residual = sampled_residual(Pf, c, x) if len(free) > 0 else 0
+	else: residual = np.abs(c + Pf.dot(x) - x).max() if len(free) > 0 else 0
+	convergence = {'engine': engine, 'iterations': len(residuals), 'residuals': residuals, 'residual': residual}
+	if engine == 'float32': convergence['error'] = residual/alpha
+	gs.attributes(G)['convergence'] = convergence
+	return residuals[-1], len(residuals)
+
+##
+# returns a CSR matrix with float32 values and int32 indices, arrays already of these types are not copied
+# @param M sparse matrix with less than 2^31 non zeros
+#
+def single_precision(M):
+	M = sparse.csr_matrix(M)
+	return sparse.csr_matrix((M.data.astype(np.float32, copy=False), M.indices.astype(np.int32, copy=False),
+			M.indptr.astype(np.int32, copy=False)), shape=M.shape)
+
+##
+# returns the maximum float64 residual |c + Pf x - x| of a sample of rows
+# Every row sum of Pf is at most 1-alpha so the deviation of x from the solution is at most the maximum residual over alpha,
+# the sample estimates that maximum with float64 copies of the sampled rows only
+# @param Pf matrix of the updated peers (float32 or float64)
+# @param c float64 constant part of the update
+# @param x opinions to check
+# @param sample number of rows checked, all rows if there are fewer
+#
+def sampled_residual(Pf, c, x, sample=1024):
+	n = len(x)
+	if n <= sample: rows = np.arange(n)
+	else: rows = np.sort(np.random.RandomState(n).choice(n, sample, replace=False))
+	x = np.asarray(x, dtype=float)
+	return np.abs(c[rows] + Pf[rows].astype(float).dot(x) - x[rows]).max()
+
+##
+# Jacobi iterations x(t) = c + Pf x(t-1), the synchronous update of local_update
+# returns the solution and the list of maximum differences of every iteration
+# @param Pf matrix of the updated peers
+# @param c constant part of the update
+# @param x initial opinions
+# @param threshold maximum accepted difference of opinions between two iterations
+# @param callback function called with the maximum difference and the opinions of every iteration, None for no call
+#
+def jacobi(Pf, c, x, threshold, callback=None):
+	residuals = []
+	max_diff = 1
+	while (max_diff > threshold):
+		x_t = c + Pf.dot(x)
+		max_diff = np.abs(x_t - x).max()
+		x = x_t
+		residuals.append(max_diff)
+		if callback is not None: callback(max_diff, x)
+	return x, residuals
+
+##
+# Successive over-relaxation of (I - Pf) x = c, Gauss-Seidel when omega is 1
+# Pf = L + D + U (strictly lower, diagonal, strictly upper): ((I-D) - omega L) x(t) = omega (c + U x(t-1)) + (1-omega)(I-D) x(t-1)
+# The triangular matrix is factorized once without pivoting so that every sweep is one sparse triangular solve
+# returns the solution and the list of maximum differences of every iteration
+# @param Pf matrix of the updated peers
+# @param c constant part of the update
+# @param x initial opinions
+# @param threshold maximum accepted difference of opinions between two iterations
+# @param omega relaxation factor between 0 and 2
+# @param callback function called with the maximum difference and the opinions of every iteration, None for no call
+#
+def sor(Pf, c, x, threshold, omega, callback=None):
+	d = 1 - Pf.diagonal()
+	L = sparse.tril(Pf, -1)
+	U = sparse.triu(Pf, 1).tocsr()
+	T = (sparse.diags(d, 0) - omega*L).tocsc()
+	lu = splu(T, permc_spec='NATURAL', diag_pivot_thresh=0, options=dict(SymmetricMode=True))
+	residuals = []
+	max_diff = 1
+	while (max_diff > threshold):
+		x_t = lu.solve(omega*(c + U.dot(x)) + (1-omega)*d*x)
+		max_diff = np.abs(x_t - x).max()
+		x = x_t
+		residuals.append(max_diff)
+		if callback is not None: callback(max_diff, x)
+	return x, residuals
+
+##
+# Chebyshev semi-iterative acceleration of the Jacobi iterations, for eigenvalues of Pf in [-rho, rho]
+# x(t+1) = w(t+1) (c + Pf x(t) - x(t-1)) + x(t-1) with w(1) = 1, w(2) = 1/(1-rho^2/2), w(t+1) = 1/(1-rho^2 w(t)/4)
+# returns the solution and the list of maximum differences of every iteration
+# @param Pf matrix of the updated peers
+# @param c constant part of the update
+# @param x initial opinions
+# @param threshold maximum accepted difference of opinions between two iterations
+# @param rho bound of the spectral radius of Pf
+# @param callback function called with the maximum difference and the opinions of every iteration, None for no call
+#
+def chebyshev(Pf, c, x, threshold, rho, callback=None):
+	x_prev = x
+	x = c + Pf.dot(x)
+	residuals = [np.abs(x - x_prev).max()]
+	if callback is not None: callback(residuals[-1], x)
+	w = 1
+	while (residuals[-1] > threshold):
+		if len(residuals) == 1: w = 1/(1 - rho**2/2)
+		else: w = 1/(1 - rho**2*w/4)
+		x_t = w*(c + Pf.dot(x) - x_prev) + x_prev
+		x_prev = x
+		x = x_t
+		residuals.append(np.abs(x - x_prev).max())
+		if callback is not None: callback(residuals[-1], x)
+	return x, residuals
+
+##
+# Conjugate gradient on the symmetrized system D^1/2 (I - Pf) D^-1/2 y = D^1/2 c with x = D^-1/2 y
+# where D is the weighted degree of the updated peers. The matrix is symmetric positive definite (eigenvalues >= alpha),
+# the symmetric scaling by D^1/2 is the Jacobi preconditioner of the symmetric system (D - (1-alpha) W) x = D c
+# returns the solution and the list of relative residuals of every iteration
+# @param Pf matrix of the updated peers
+# @param c constant part of the update
+# @param x initial opinions
+# @param threshold relative residual at which the iterations stop
+# @param deg weighted degree of the updated peers
+# @param callback function called with the relative residual and the opinions of every iteration, None for no call
+#
+def conjugate_gradient(Pf, c, x, threshold, deg, callback=None):
+	sq = np.sqrt(deg)
+	S = (sparse.identity(len(deg), format='csr') - sparse.diags(sq, 0).dot(Pf).dot(sparse.diags(1/sq, 0))).tocsr()
+	rhs = sq*c
+	norm = max(np.linalg.norm(rhs), 1e-300)
+	residuals = []
+	def record(y):
+		residuals.append(np.linalg.norm(rhs - S.dot(y))/norm)
+		if callback is not None: callback(residuals[-1], y/sq)
+	y, info = cg(S, rhs, x0 = sq*x, tol = threshold, callback = record)
+	if len(residuals) == 0: record(y)
+	return y/sq, residuals
 
 ##
 # updates local opinion of a node using it's own opinion and neighbor's
-# @param G graph of nodes to update its local opinion
+# @param G graph of nodes to update its local opinion, a graph state is updated by one sparse matrix-vector product
 # @param alpha weigh given to the opinion of the node itself
 #
 def local_update(G,alpha):
+	if gs.is_state(G):
+		P, b, r, free, deg = cp.opinion_system(G, alpha)
+		G['opinion'][free] = b + P.dot(r)
+		return;
 	# storing opinions of all nodes in a list to avoid using updated opinions of neighbors in the process
 	op_list = get_opinion(G)
 	# Loop all nodes in the graph
@@ -130,6 +614,46 @@ def max_opinion_difference(l_t, l_t_1):
 	# return the maximum value in l_difference 
 	return max(l_diff);
 
+##
+# returns the list of neighbors chosen by a forceful peer with one of the 4 strategies
+# Strategies: Random, Degree, 1/Degree, Degree ^ 2
+# @param G graph with nodes from which the forceful peer will choose
+# @param strategy strategy of the forceful peer by which it will choose its neigbors
+# @param budget the total edge weights the forceful peer can have
+# @param peer name of the forceful peer used in the error message
+#
+def choose_neighbors(G, strategy, budget, peer = 'forceful peer'):
+	n = G['n'] if gs.is_state(G) else nx.number_of_nodes(G)
+	if strategy == 'random':
+		# Create a list of 'budget' random numbers [0, NUM_PEERS]
+		return np.random.random_integers(0, n - 1, budget)
+	elif strategy == 'D':
+		# call strategy_D function to calculate neighbors of forceful peer
+		return strategy_D(G,budget)
+	elif strategy == 'D^2':
+		# call strategy_D2 function to calculate neighbors for forceful peer
+		return strategy_D2(G, budget)
+	elif strategy == '1/D':
+		# call strategy_1_D function to calculate neighbors for forceful peer
+		return strategy_1_D(G, budget)
+	# an Error statement if the chosen strategy is not applicable
+	else:
+		raise SystemExit('Chosen strategy for ' + peer + ' [[' + strategy+ ']] is not applicable\nprogram will exit');
+
+##
+# returns the neighbors lists of 2 forceful peers chosen with one of the 4 strategies each, without changing the graph
+# The lists are the ones add_forceful attaches, they can be scored with computation.placement_percentages
+# @param G graph with the normal peers only, or graph state
+# @param strategy1 strategy by first forceful peer by which it will choose its neighbors
+# @param budget1 the total edge weights the first forceful peer can have
+# @param strategy2 strategy by second forceful peer by which it will choose its neighbors
+# @param budget2 the total edge weights the second forceful peer can have
+#
+def draw_placement(G, strategy1, budget1, strategy2, budget2):
+	f1_neighbors = choose_neighbors(G, strategy1, budget1, 'first forceful peer')
+	f2_neighbors = choose_neighbors(G, strategy2, budget2, 'second forceful peer')
+	return f1_neighbors, f2_neighbors
+
 ##
 # Adding 2 forceful peers with one of the 4 strategies each
 # Strategies: Random, Degree, 1/Degree, Degree ^ 2
@@ -140,57 +664,31 @@ def max_opinion_difference(l_t, l_t_1):
 # @param budget2 the total edge weights the second forceful peer can have
 #
 def add_forceful(G, strategy1, budget1, strategy2, budget2):
+	# the first is with opinion 1, the second is with opinion -1
+	add_forceful_peers(G, [(strategy1, budget1, 1), (strategy2, budget2, -1)])
+	return;
+
+##
+# Adding k forceful peers, each with its own strategy, budget and static opinion
+# All peers choose their neighbors among the normal peers before any of them is attached, in the order of the list,
+# they get the keys n..n+k-1 which are listed in G.graph['forceful'] (in 'forceful' for a graph state)
+# @param G graph with the normal peers only, or graph state
+# @param peers list of (strategy, budget, opinion)
+#
+def add_forceful_peers(G, peers):
+	# Selection of neighbors depending on chosen strategy for every forceful peer
+	neighbors = [choose_neighbors(G, strategy, budget, 'forceful peer %d' % (j+1)) for j, (strategy, budget, opinion) in enumerate(peers)]
+	if gs.is_state(G):
+		for j, (strategy, budget, opinion) in enumerate(peers):
+			gs.attach_peer(G, 'U' if strategy == 'random' else strategy, opinion, neighbors[j], budget)
+		return;
 	n = nx.number_of_nodes(G)
-	# Selection of neighbors depending on chosen strategy for forceful peer 1
-	if strategy1 == 'random':
-		# Create a list of 'budget' random numbers [0, NUM_PEERS]
-		f1_neighbors = np.random.random_integers(0, n - 1, budget1)
-		strategy1 = 'U'
-	elif strategy1 == 'D':
-		# call strategy_D function to calculate neighbors of forceful peer 1
-		f1_neighbors = strategy_D(G,budget1)
-	elif strategy1 == 'D^2':
-		# call strategy_D2 function to calculate neighbors for forceful peer 1
-		f1_neighbors = strategy_D2(G, budget1)
-	elif strategy1 == '1/D':
-		# call strategy_1_D function to calculate neighbors for forceful peer 1
-		f1_neighbors = strategy_1_D(G, budget1)
-	else:
-		raise SystemExit('Chosen strategy for first forceful peer [[' + strategy1+ ']] is not applicable\nprogram will exit');
-
-	# Selection of the neighbors depending on the strategy for peer 2
-	if strategy2 == 'random':
-		# Create a list of 'budget1' random numbers [0, NUM_PEERS]
-		f2_neighbors = np.random.random_integers(0, n - 1, budget2)	
-		strategy2 = 'U'
-	elif strategy2 == 'D':
-		# call strategy_D function to calculate neighbors of forceful 2
-		f2_neighbors = strategy_D(G,budget2)
-	elif strategy2 == 'D^2':
-		# call strategy_D2 function to calculate neighbors of forceful 2
-		f2_neighbors = strategy_D2(G,budget2)
-	elif strategy2 == '1/D':
-		# call strategy_1_D function to calculate neighbors of forceful 2
-		f2_neighbors = strategy_1_D(G,budget2)
-	# an Error statement if the chosen strategy is not applicable
-	else:
-		raise SystemExit('Chosen strategy for second forceful peer [[' + strategy2+ ']] is not applicable\nprogram will exit');
-
-	# add the forceful peers to the graph, the first is with opinion 1 
-	# The second is with opinion -1
-	G.add_node(n,type = strategy1, opinion = 1, budget = budget1)
-	G.add_node(n+1,type = strategy2, opinion = -1, budget = budget2)
-	# iterate the array of neighbors and add an edge
-	for i in f1_neighbors:
-		# If an edge already exists between the 2 nodes increase the weight.
-		if G.number_of_edges(n,i) > 0: 
-			G[n][i]['weight'] +=1
-		else:G.add_edge(n, i, weight = 1)
-	for i in f2_neighbors:
-		# If an edge already exists between the 2 nodes increase the weight.
-		if G.number_of_edges(n+1,i) > 0:
-			G[n+1][i]['weight'] +=1
-		else: G.add_edge(n+1,i, weight = 1)
+	for j, (strategy, budget, opinion) in enumerate(peers):
+		if strategy == 'random': strategy = 'U'
+		G.add_node(n+j,type = strategy, opinion = opinion, budget = budget)
+	for j in range(len(peers)):
+		attach_neighbors(G, n+j, neighbors[j])
+	G.graph['forceful'] = range(n, n+len(peers))
 	return;
 
 ##
@@ -204,44 +702,55 @@ def add_forceful(G, strategy1, budget1, strategy2, budget2):
 def add_one_forceful(G, strategy, budget):
 	n = nx.number_of_nodes(G)
 	# Selection of neighbors depending on chosen strategy for forceful peer
-	if strategy == 'random':
-		# Create a list of 'budget' random numbers [0, NUM_PEERS]
-		f_neighbors = np.random.random_integers(0, n - 1, budget)
-		strategy = 'U'
-	elif strategy == 'D':
-		# call strategy_D function to calculate neighbors of forceful peer
-		f_neighbors = strategy_D(G,budget)
-	elif strategy == 'D^2':
-		# call strategy_D2 function to calculate neighbors for forceful peer
-		f_neighbors = strategy_D2(G, budget)
-	elif strategy == '1/D':
-		# call strategy_1_D function to calculate neighbors for forceful peer
-		f_neighbors = strategy_1_D(G, budget)
-	else:
-		raise SystemExit('Chosen strategy for forceful peer [[' + strategy+ ']] is not applicable\nprogram will exit');
-
+	f_neighbors = choose_neighbors(G, strategy, budget)
+	if strategy == 'random': strategy = 'U'
 	# add the forceful peers to the graph, with opinion 1 
 	G.add_node(n+1,type = strategy, opinion = -1, budget = budget)
-	# iterate the array of neighbors and add an edge
-	for i in f_neighbors:
+	attach_neighbors(G, n+1, f_neighbors)
+	return;
+
+##
+# adds an edge from a forceful peer to every chosen neighbor, weighted by the number of times it was chosen
+# If an edge already exists between the 2 nodes its weight is increased
+# @param G graph containing the forceful peer
+# @param f key of the forceful peer
+# @param f_neighbors list of neighbors, a node chosen several times gets an edge with the corresponding weight
+#
+def attach_neighbors(G, f, f_neighbors):
+	# count how many times each neighbor was chosen and add one edge per neighbor
+	nodes, counts = np.unique(np.asarray(f_neighbors, dtype=int), return_counts=True)
+	for i, c in zip(nodes.tolist(), counts.tolist()):
 		# If an edge already exists between the 2 nodes increase the weight.
-		if G.number_of_edges(n+1,i) > 0: 
-			G[n+1][i]['weight'] +=1
-		else:G.add_edge(n+1, i, weight = 1)
+		if G.number_of_edges(f,i) > 0: 
+			G[f][i]['weight'] += c
+		else:G.add_edge(f, i, weight = c)
+	gs.changed(G)
 	return;
 ##
 # Adds a smart peer to the graph with minmum possible connections to beat the alread existing peer
 # Linear programming is used: default solver is COIN MP other available solvers: COIN CMD, CPLEX, CPLEX_DLL, GLPK, GUROBI, 
 # First tried with: PULP_CBC_CMD (was not enough to solve the problem on n=100 in 3 days)
 # Second trial: GLPK_CMD a prolem that took 1 min. with CBC_CMD took 6 seconds with GLPK
+# The 'sparse' solver builds the same model as sparse matrices and hands it to CBC row by row (see smart_milp)
 # @param G graph with normal peer and one frceful peer that is already connected
-def add_smart(G,alpha, budget, neutral_range):
+# @param solver 'gurobi' or 'cbc' through pulp, 'sparse' for the sparse model solved by the CBC of pulp
+# @param time_limit maximum solving time in seconds
+# @param gap relative MIP gap at which the solver stops, None for the solver default
+# @param warm_start weights of a known winning placement (one per normal node): the budget is bounded by its budget
+# and it is returned if the solver finds no better placement in time
+def add_smart(G,alpha, budget, neutral_range, solver='gurobi', time_limit=3600, gap=None, warm_start=None):
 	normal = G.number_of_nodes() - 1
 	# Compute the number of binary bits needed to store the largest possible weight which depends on the budget
 	#num_bits = (len("{0:b}".format(budget))/2)
 	if budget > 200:
 		num_bits = 3
 	else: num_bits = 2
+	ins.count('milp_calls')
+	if solver == 'sparse':
+		weights, opinions, followers = smart_milp(G, alpha, num_bits, neutral_range, time_limit, gap, warm_start)
+		return attach_smart(G, normal, weights, opinions, followers)
+	# pulp is only imported by the smart peer
+	import pulp
 	#initialise the model
 	win_with_min = pulp.LpProblem('Beat existing peer with min budget',pulp.LpMinimize)
 	# Parameters 
@@ -292,27 +801,239 @@ def add_smart(G,alpha, budget, neutral_range):
 	# Even number of normal nodes
 	else:
 		win_with_min += sum ([pvars[i] for i in xrange(normal)]) >= (normal/2)+1
+	# the incumbent bounds the budget
+	if warm_start is not None:
+		win_with_min += sum ([x[i] for i in xrange(normal)]) <= sum(warm_start)
+
+	if solver == 'gurobi':
+		command = pulp.solvers.GUROBI(DisplayInterval=10, TimeLimit = time_limit)
+	elif solver == 'cbc':
+		command = pulp.PULP_CBC_CMD(maxSeconds = time_limit, fracGap = gap)
+	else : raise SystemExit('Chosen solver ['+str(solver)+'] is not applicable.\nProgram will terminate')
+	if not command.available():
+		raise SystemExit('Solver ['+str(solver)+'] of the smart peer is not available, the \'sparse\' solver only needs pulp.\nProgram will terminate')
+	win_with_min.solve(command)
+	if x[0].value() is None and warm_start is not None:
+		return attach_smart(G, normal, list(warm_start), None, None)
+	return attach_smart(G, normal, [x[i].value() for i in xrange(normal)], [y.value() for y in yvars],
+			sum ([pvars[i].value() for i in xrange(normal)]))
+
+##
+# Builds the model of add_smart directly as sparse coefficient matrices and solves it with the CBC of pulp (see sparse_milp)
+# Variables are stored by blocks: x (weights), z (binary digits of x), y (opinions), t (y*z) and p (follows the smart peer),
+# with z and t of node i at i*num_bits + j in their block. Constraints are the ones of add_smart, row block by row block.
+# A warm start incumbent bounds the objective (sum of weights) and is returned if no better solution is found in time.
+# returns the weights to the normal nodes, their opinions (None with the incumbent) and the number of followers
+# @param G graph with normal peer and one forceful peer that is already connected
+# @param alpha weight given to self opinion
+# @param num_bits number of binary digits of every weight
+# @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
+# @param time_limit maximum solving time in seconds
+# @param gap relative MIP gap at which the solver stops, None for the solver default
+# @param warm_start weights of a known winning placement, None if there is no incumbent
+#
+def smart_milp(G, alpha, num_bits, neutral_range, time_limit=3600, gap=None, warm_start=None):
+	normal = G.number_of_nodes() - 1
+	n = normal
+	nb = num_bits
+	# edge weight between normal nodes and existing forceful
+	weight_existing = np.array([G[n+1][i]['weight'] if G.has_edge(n+1,i) else 0 for i in xrange(n)], dtype=float)
+	# normal neighbors to each node
+	adjacency = nx.to_scipy_sparse_matrix(G, nodelist=range(n), format='csr')
+	adjacency.setdiag(0)
+	adjacency.eliminate_zeros()
+	num_neighbors = np.diff(adjacency.indptr)
+	nodes = np.arange(n)
+	bits = np.tile(np.arange(nb), n)
+	bit_nodes = np.repeat(nodes, nb)
+	powers = 2.0**bits
+	# first column of every block of variables
+	X, Z, Y = 0, n, n + n*nb
+	T, P = 2*n + n*nb, 2*n + 2*n*nb
+	num_vars = 3*n + 2*n*nb
+	rows, cols, vals, lower, upper = [], [], [], [], []
+	def block(r, c, v):
+		rows.append(np.asarray(r)); cols.append(np.asarray(c)); vals.append(np.asarray(v, dtype=float))
+	# binary representation of edges: sum 2^j z[i][j] - x[i] = 0
+	block(bit_nodes, Z + nodes.repeat(nb)*nb + bits, powers)
+	block(nodes, X + nodes, -np.ones(n))
+	lower.append(np.zeros(n)); upper.append(np.zeros(n))
+	# Opinion and intermediate constraints:
+	# sum 2^j t[i][j] + y[i]*(we[i] + deg[i]) - (1-alpha)*(sum y[neighbors] + x[i]) = -(1-alpha)*we[i]
+	r0 = n
+	block(r0 + bit_nodes, T + bit_nodes*nb + bits, powers)
+	block(r0 + nodes, Y + nodes, weight_existing + num_neighbors)
+	block(r0 + np.repeat(nodes, num_neighbors), Y + adjacency.indices, -(1-alpha)*np.ones(len(adjacency.indices)))
+	block(r0 + nodes, X + nodes, -(1-alpha)*np.ones(n))
+	lower.append(-(1-alpha)*weight_existing); upper.append(-(1-alpha)*weight_existing)
+	# tvar constraints to satisfy yi*zj, one row per node and bit for each of the 4 inequalities
+	r0 = 2*n
+	k = np.arange(n*nb)
+	t_cols = T + k
+	z_cols = Z + k
+	y_cols = Y + bit_nodes
+	ones = np.ones(n*nb)
+	inf = np.inf*ones
+	# t >= -z
+	block(r0 + k, t_cols, ones); block(r0 + k, z_cols, ones)
+	lower.append(0*ones); upper.append(inf)
+	# t <= z
+	r0 += n*nb
+	block(r0 + k, t_cols, ones); block(r0 + k, z_cols, -ones)
+	lower.append(-inf); upper.append(0*ones)
+	# t >= y - 1 + z
+	r0 += n*nb
+	block(r0 + k, t_cols, ones); block(r0 + k, y_cols, -ones); block(r0 + k, z_cols, -ones)
+	lower.append(-ones); upper.append(inf)
+	# t <= y + 1 - z
+	r0 += n*nb
+	block(r0 + k, t_cols, ones); block(r0 + k, y_cols, -ones); block(r0 + k, z_cols, ones)
+	lower.append(-inf); upper.append(ones)
+	# Constraint to count the number of nodes following smart peer: y[i] - p[i]*(1+neutral_range) >= -1
+	r0 += n*nb
+	block(r0 + nodes, Y + nodes, np.ones(n)); block(r0 + nodes, P + nodes, -(1+neutral_range)*np.ones(n))
+	lower.append(-np.ones(n)); upper.append(np.inf*np.ones(n))
+	# more than half of the normal nodes follow the smart node
+	r0 += n
+	block(r0*np.ones(n, dtype=int), P + nodes, np.ones(n))
+	lower.append([m.ceil(normal/2) if normal%2 != 0 else (normal/2)+1]); upper.append([np.inf])
+	num_rows = r0 + 1
+	# the incumbent bounds the budget: sum x <= its budget
+	if warm_start is not None:
+		block(num_rows*np.ones(n, dtype=int), X + nodes, np.ones(n))
+		lower.append([-np.inf]); upper.append([sum(warm_start)])
+		num_rows += 1
+	A = sparse.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(num_rows, num_vars)).tocsr()
+	c = np.zeros(num_vars)
+	c[X:X+n] = 1
+	integrality = np.zeros(num_vars)
+	integrality[X:Y] = 1
+	integrality[P:] = 1
+	lb = np.zeros(num_vars)
+	ub = np.inf*np.ones(num_vars)
+	ub[Z:Y] = 1
+	lb[Y:T] = -1
+	ub[Y:T] = 1
+	ub[P:] = 1
+	sol, status = sparse_milp(c, integrality, lb, ub, A, np.concatenate(lower), np.concatenate(upper), time_limit, gap)
+	if sol is None:
+		if warm_start is None:
+			raise SystemExit('No placement found for the smart peer: ' + status + '\nProgram will terminate')
+		return list(warm_start), None, None
+	return np.round(sol[X:X+n]).tolist(), sol[Y:Y+n].tolist(), int(round(sol[P:P+n].sum()))
+
+##
+# Minimizes c.v subject to lower <= A v <= upper, lb <= v <= ub and integer variables with the CBC solver of pulp
+# Every row of A becomes one constraint built from its non zeros, no expression is built term by term
+# returns the solution (None if no feasible solution was found in time) and the status of the solver
+# @param c objective coefficients
+# @param integrality 1 for integer variables, 0 for continuous ones
+# @param lb lower bounds of the variables (-inf for none)
+# @param ub upper bounds of the variables (inf for none)
+# @param A sparse constraint matrix
+# @param lower lower bounds of the constraints (-inf for none)
+# @param upper upper bounds of the constraints (inf for none)
+# @param time_limit maximum solving time in seconds
+# @param gap relative MIP gap at which the solver stops, None for the solver default
+#
+def sparse_milp(c, integrality, lb, ub, A, lower, upper, time_limit=3600, gap=None):
+	# pulp is only imported by the smart peer
+	import pulp
+	bound = lambda b: None if np.isinf(b) else float(b)
+	v = [pulp.LpVariable('v%d' %j, bound(lb[j]), bound(ub[j]), 'Integer' if integrality[j] else 'Continuous')
+			for j in xrange(len(c))]
+	model = pulp.LpProblem('smart peer', pulp.LpMinimize)
+	model += pulp.LpAffineExpression([(v[j], float(c[j])) for j in np.flatnonzero(c)])
+	A = sparse.csr_matrix(A)
+	for r in xrange(A.shape[0]):
+		start, end = A.indptr[r], A.indptr[r+1]
+		row = pulp.LpAffineExpression([(v[j], a) for j, a in zip(A.indices[start:end].tolist(), A.data[start:end].tolist())])
+		if lower[r] == upper[r]: model += pulp.LpConstraint(row, pulp.LpConstraintEQ, rhs = float(lower[r]))
+		else:
+			if not np.isinf(lower[r]): model += pulp.LpConstraint(row, pulp.LpConstraintGE, rhs = float(lower[r]))
+			if not np.isinf(upper[r]): model += pulp.LpConstraint(row, pulp.LpConstraintLE, rhs = float(upper[r]))
+	model.solve(pulp.PULP_CBC_CMD(maxSeconds = time_limit, fracGap = gap))
+	status = pulp.LpStatus[model.status]
+	# a run stopped on the time limit keeps the best solution found
+	if model.status in [pulp.LpStatusInfeasible, pulp.LpStatusUnbounded] or any(x.value() is None for x in v): return None, status
+	return np.array([x.value() for x in v], dtype=float), status
 
-	win_with_min.solve(pulp.solvers.GUROBI(DisplayInterval=10, TimeLimit = 3600))
+##
+# Writes the solution of the smart peer to smart_peer_info.txt and adds the smart peer with its edges to the graph
+# returns the budget of the smart peer
+# @param G graph with normal peer and one forceful peer that is already connected
+# @param normal number of normal nodes, key of the smart peer
+# @param weights weight from the smart peer to every normal node
+# @param opinions opinion of every normal node in the solution (None if unknown)
+# @param followers number of nodes following the smart peer in the solution (None if unknown)
+#
+def attach_smart(G, normal, weights, opinions, followers):
 	f = open("smart_peer_info.txt", "w")
 	f.write('Weights to nodes:\n')
 	for node in xrange(normal):
-		f.write('weight to %d is %d\n' %(node,x[node].value()))
+		f.write('weight to %d is %d\n' %(node,weights[node]))
 	f.write('===========================\n')
 
 	f.write('Opinion of nodes:\n')
 
-	for i in xrange(len(yvars)):
-		f.write('y' + str(i) + ':' + str(yvars[i].value()) + '\n')
+	if opinions is not None:
+		for i in xrange(len(opinions)):
+			f.write('y' + str(i) + ':' + str(opinions[i]) + '\n')
 	f.write('===========================\n')
 	# Using the weights solution to add edges to chosen neighbors for smart peer
 	G.add_node(normal,type = 'smart', opinion = 1)
 	for node in xrange(normal):
-		if x[node].value() != 0:
-			G.add_edge(normal,node, weight =x[node].value()) 	
-	print 'Smart peer budget: ' + str(sum([x[i].value() for i in xrange(normal)]))
-	print 'number of followers:', sum ([pvars[i].value() for i in xrange(normal)])
-	return sum([x[i].value() for i in xrange(normal)])
+		if weights[node] != 0:
+			G.add_edge(normal,node, weight =weights[node]) 	
+	gs.changed(G)
+	print 'Smart peer budget: ' + str(sum(weights))
+	print 'number of followers:', followers
+	return sum(weights)
+
+
+##
+# Adds a forceful peer (opinion 1) placing its budget as a best response to the existing forceful peer (opinion -1)
+# Lazy greedy (CELF): one unit of edge weight is placed at a time on the node with the largest marginal gain of the sum of
+# opinions of the normal peers, gains of previous rounds are upper bounds and are only recomputed for the node on top of the heap.
+# The heap starts from the bounds of computation.placement_gain_bounds (one adjoint solve) instead of an evaluation of every node,
+# and every evaluation is an incremental re-solve of the normal peers system (computation.placement_opinions)
+# returns the list of chosen neighbors (a node appears once per unit of weight) and the percentages computed by computation.percentages
+# @param G graph with normal peers and one forceful peer already connected by add_one_forceful
+# @param alpha weight given to self opinion
+# @param budget the total edge weights the forceful peer can have
+# @param neutral_range a number that any node with an opinion between its negative and positive value is considered neutral
+# @param candidates nodes the forceful peer can connect to, None for all normal nodes
+#
+def add_best_response(G, alpha, budget, neutral_range, candidates=None):
+	base = cp.base_system(G, alpha)
+	n = base['n']
+	# existing placement of the forceful peer n+1
+	f2_neighbors = []
+	for i in G.neighbors(n+1):
+		f2_neighbors += [i]*int(G[n+1][i]['weight'])
+	if candidates is None: candidates = range(n)
+	f1_neighbors = []
+	score = np.sum(cp.placement_opinions(base, f1_neighbors, f2_neighbors))
+	# heap of (-gain, node, round in which the gain was computed), -1 for a bound to be evaluated
+	bounds = cp.placement_gain_bounds(base, f1_neighbors, f2_neighbors)
+	heap = [(-bounds[v], v, -1) for v in candidates]
+	heapq.heapify(heap)
+	for r in xrange(budget):
+		while True:
+			gain, v, computed = heapq.heappop(heap)
+			if computed == r: break
+			gain = score - np.sum(cp.placement_opinions(base, f1_neighbors + [v], f2_neighbors))
+			heapq.heappush(heap, (gain, v, r))
+		f1_neighbors.append(v)
+		score -= gain
+		# the node can receive more units in the next rounds
+		heapq.heappush(heap, (gain, v, -1))
+	G.add_node(n, type = 'best_response', opinion = 1, budget = budget)
+	attach_neighbors(G, n, f1_neighbors)
+	R = cp.placement_opinions(base, f1_neighbors, f2_neighbors)
+	for i in xrange(n):
+		G.node[i]['opinion'] = R[i, 0]
+	return f1_neighbors, cp.percentages(G, neutral_range)
 
 ##
 # Adds a forceful peer that is connected to all normal peers with a given weight
@@ -326,6 +1047,7 @@ def connect_to_all(G,lamda):
 		# Connect an edge only with a normal node
 		if G.node[n]['type'] == 'normal':
 			G.add_edge(forceful_key,n, weight = lamda)
+	gs.changed(G)
 
 
 ##
@@ -334,14 +1056,7 @@ def connect_to_all(G,lamda):
 # @param budget number of neighbors the forceful peer will choose
 #
 def strategy_D(G, budget):
-	# limits is a list that stores floats between 0 and one which defines
-	# the probabaility of choosing a certain node depending on its degree
-	limits = [0.0]
-	num_edges = G.number_of_edges()
-	# iterate nodes to calculate limits depending on degree
-	for i in G:
-		limits.append(G.degree(i)/(2*num_edges) + limits[i])
-	return select_neighbors(limits, budget)
+	return select_neighbors(strategy_limits(G, 'D'), budget)
 
 ##
 # returns a list of neighbors for a forceful peer with D^2 strategy
@@ -349,22 +1064,7 @@ def strategy_D(G, budget):
 # @param budget number of neighbors the forceful peer will choose
 #
 def strategy_D2(G, budget):
-	# limits is a list that stores floats between 0 and 1	 which defines
-	# the probabaility of choosing a certain node depending on its degree
-	limits = [0.0]
-	# store the degree of all nodes in a list
-	degrees = G.degree()
-	tmp = []
-	for i in range(len(degrees)):
-		tmp.append(degrees[i])
-	# squaring all degrees in the list
-	degrees2 = [x**2 for x in tmp]	
-	# summation of (degrees^2) for all nodes
-	sum_degs2 = sum(degrees2)
-	# iterate nodes to calculate limits depending on degree
-	for i in G:
-		limits.append((G.degree(i)** 2)/sum_degs2 + limits[i])
-	return select_neighbors(limits, budget)
+	return select_neighbors(strategy_limits(G, 'D^2'), budget)
 
 ##
 # returns a list of neighbors for a forceful peer with 1/D strategy
@@ -372,51 +1072,67 @@ def strategy_D2(G, budget):
 # @param budget number of neighbors the forceful peer will choose
 #
 def strategy_1_D(G, budget):
-	# limits is a list that stores floats between 0 and one which defines
-	# the probabaility of choosing a certain node depending on its degree
-	limits = [0.0]
-	# store the degree of all nodes in a list
-	degrees = G.degree()
-	tmp = []
-	for i in range(len(degrees)):
-		tmp.append(degrees[i]) 
-	# computes the reciprocal of all degrees
-	degrees_recp = []
-
-	for i in range(len(tmp)):
-		degrees_recp.append(1/tmp[i])
-
-	# summation of all reciprocals
-	sum_degs_recp = sum(degrees_recp)
-	for i in G:
-		try:
-			limits.append( ((1/G.degree(i))/sum_degs_recp) + limits[i] )
-		except ZeroDivisionError:
+	return select_neighbors(strategy_limits(G, '1/D'), budget)
+
+##
+# returns the limits of a strategy: an array of floats between 0 and 1 where limits[i] <= rnd < limits[i+1]
+# selects node i, i.e. the cumulative probability of choosing nodes depending on their degree
+# The array is built once and cached in G.graph['limits'] (graph_state.attributes), it is rebuilt if the graph changed since
+# (its 'version', see graph_state.changed, or its number of nodes or edges)
+# @param G graph with nodes from which the forceful peer will choose, or graph state (its normal peers)
+# @param strategy one of 'D', 'D^2' and '1/D'
+#
+def strategy_limits(G, strategy):
+	cache = gs.attributes(G).setdefault('limits', {})
+	version = gs.attributes(G).get('version', 0)
+	if gs.is_state(G): stamp = (version, gs.num_keys(G), G['W'].nnz)
+	else: stamp = (version, G.number_of_nodes(), G.number_of_edges())
+	if strategy in cache and cache[strategy][0] == stamp:
+		return cache[strategy][1]
+	# store the degree of all nodes in an array
+	if gs.is_state(G):
+		# number of neighbors of the normal peers, as the degree of the networkx graph
+		deg = np.diff(G['W'].indptr[:G['n']+1]).astype(np.int64)
+		total = np.sum(deg)
+	else:
+		degrees = G.degree()
+		deg = np.array([degrees[i] for i in G], dtype=np.int64)
+		total = 2*G.number_of_edges()
+	if strategy == 'D':
+		p = deg/total
+	elif strategy == 'D^2':
+		p = (deg**2)/np.sum(deg**2)
+	elif strategy == '1/D':
+		if np.any(deg == 0):
 			sys.exit('Division by zero when calculating neighbors for 1/D strategy\ndue to the presence of a node with zero degree')
-	return select_neighbors(limits, budget)
+		degrees_recp = 1/deg
+		# summation of all reciprocals in node order
+		p = degrees_recp/np.cumsum(degrees_recp)[-1]
+	else:
+		raise SystemExit('Chosen strategy [[' + strategy+ ']] has no degree distribution\nprogram will exit');
+	limits = np.concatenate(([0.0], np.cumsum(p)))
+	cache[strategy] = (stamp, limits)
+	return limits
 
 ##
 # returns of selected nodes to be neighbors of a forceful peer
 # depending on the given limits list
+# All random numbers are drawn at once and located in the limits by a binary search
 #
 def select_neighbors(limits, budget):
-	# list to contain keys of neighbors t be attached to the forceful peer
-	f_neighbors = []
-	# iterate budget times to add neighbors to the list
-	for i in range(budget):
-		rnd = np.random.random()
-		# compare the random number to the limits and add node accordingly
-		for j in range(len(limits) - 1):
-			if rnd >= limits[j] and rnd < limits[j+1]:
-				f_neighbors.append(j)
-	return f_neighbors;
+	limits = np.asarray(limits)
+	rnd = np.random.random(budget)
+	f_neighbors = np.searchsorted(limits, rnd, side='right') - 1
+	# a random number above the last limit (rounding of the sum) does not select any node
+	return f_neighbors[f_neighbors < len(limits) - 1]
 
 ##
 # Helping function to get the opinions of nodes in a graph
-# @param G graph to extract the opinion of its nodes
+# @param G graph to extract the opinion of its nodes, or graph state
 # returns list of opinions
 #
 def get_opinion(G):
+	if gs.is_state(G): return G['opinion'].tolist()
 	op_list = []
 	for i in G:
 		op_list.append(G.node[i]['opinion'])
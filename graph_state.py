@@ -0,0 +1,207 @@
+## @package graph_state
+# Array representation of a graph of peers, used instead of the per node attribute dictionaries of networkx for large graphs.
+# A state is a dictionary of contiguous arrays:
+# 'W': CSR matrix of the edge weights between all nodes (symmetric), 'opinion' and 'initial_opinion': float arrays,
+# 'type': int8 codes of the node types whose names are listed in 'types' (code 0 is 'normal'), 'budget': budget of every peer,
+# 'n': number of normal peers, which are the nodes 0..n-1, 'forceful': indices of the forceful peers in the order they were added,
+# 'pos': n x 2 positions of a geometric graph (None otherwise), 'g_type': the graph type and 'graph': the dictionary of graph
+# attributes that G.graph holds for a networkx graph (see attributes).
+# The computation and display functions accept a state wherever they accept a networkx graph.
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+##
+# returns True if G is a graph state rather than a networkx graph
+# @param G graph state or networkx graph
+#
+def is_state(G):
+	return isinstance(G, dict) and 'W' in G
+
+##
+# returns G if it is a graph state, its conversion by from_networkx otherwise
+# @param G graph state or networkx graph
+#
+def as_state(G):
+	if is_state(G): return G
+	return from_networkx(G)
+
+##
+# Makes the state of a graph of normal peers from its edge list, as generated by graph_modification.generate_edges
+# @param g_type graph type
+# @param num_peers number of normal peers
+# @param edges m x 2 integer array, every edge has a unit weight
+# @param pos num_peers x 2 positions of a geometric graph, None otherwise
+#
+def from_edges(g_type, num_peers, edges, pos=None):
+	edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+	ones = np.ones(len(edges))
+	W = sparse.coo_matrix((ones, (edges[:, 0], edges[:, 1])), shape=(num_peers, num_peers))
+	return from_matrix(g_type, (W + W.T).tocsr(), pos)
+
+##
+# Makes the state of a graph of normal peers around its symmetric CSR weight matrix, which is not copied
+# (e.g. the memory maps of corpus.load_graph, shared by the processes reading them until a forceful peer is attached)
+# @param g_type graph type
+# @param W symmetric CSR weight matrix of the normal peers
+# @param pos positions of a geometric graph, None otherwise
+#
+def from_matrix(g_type, W, pos=None):
+	num_peers = W.shape[0]
+	return {'W': W, 'opinion': np.zeros(num_peers), 'initial_opinion': np.zeros(num_peers),
+			'type': np.zeros(num_peers, dtype=np.int8), 'types': ['normal'], 'budget': np.zeros(num_peers, dtype=np.int64),
+			'n': num_peers, 'forceful': np.zeros(0, dtype=np.int64), 'pos': None if pos is None else np.asarray(pos, dtype=float),
+			'g_type': g_type, 'graph': {}}
+
+##
+# Makes the state of a networkx graph whose nodes are the keys 0..N-1, the normal peers first
+# Every node with a type other than 'normal' is a forceful peer
+# @param G networkx graph
+#
+def from_networkx(G):
+	N = G.number_of_nodes()
+	nodes = range(N)
+	W = nx.to_scipy_sparse_matrix(G, nodelist=nodes, weight='weight', dtype=float, format='csr')
+	types = ['normal']
+	codes = np.zeros(N, dtype=np.int8)
+	for i in nodes:
+		t = G.node[i]['type']
+		if t not in types: types.append(t)
+		codes[i] = types.index(t)
+	forceful = np.flatnonzero(codes != 0)
+	n = N - len(forceful)
+	if np.any(forceful < n):
+		raise SystemExit('Forceful peers must have the largest node keys to build a graph state.\nProgram will terminate')
+	pos = None
+	if n > 0 and 'pos' in G.node[0]:
+		pos = np.array([G.node[i]['pos'] for i in xrange(n)], dtype=float)
+	return {'W': W, 'opinion': np.array([G.node[i]['opinion'] for i in nodes], dtype=float),
+			'initial_opinion': np.array([G.node[i].get('initial_opinion', G.node[i]['opinion']) for i in nodes], dtype=float),
+			'type': codes, 'types': types, 'budget': np.array([G.node[i].get('budget', 0) for i in nodes], dtype=np.int64),
+			'n': n, 'forceful': forceful, 'pos': pos, 'g_type': G.graph.get('type'), 'graph': {}}
+
+##
+# Makes the networkx graph of a state, with the attributes used by the rest of the program
+# Integer weights are stored as integers, forceful peers get their 'budget' and normal peers their 'initial_opinion'
+# @param state graph state
+#
+def to_networkx(state):
+	G = nx.Graph()
+	N = len(state['opinion'])
+	for i in xrange(N):
+		t = state['types'][state['type'][i]]
+		if t == 'normal':
+			G.add_node(i, type = t, opinion = float(state['opinion'][i]), initial_opinion = float(state['initial_opinion'][i]))
+		else: G.add_node(i, type = t, opinion = float(state['opinion'][i]), budget = int(state['budget'][i]))
+	if state['pos'] is not None:
+		for i in xrange(state['n']): G.node[i]['pos'] = state['pos'][i].tolist()
+	upper = sparse.triu(state['W'], 1).tocoo()
+	weights = [int(w) if w == int(w) else float(w) for w in upper.data]
+	G.add_edges_from((i, j, {'weight': w}) for i, j, w in zip(upper.row.tolist(), upper.col.tolist(), weights))
+	G.graph['type'] = state['g_type']
+	# e.g. the 'convergence' of the last solve, the cached strategy limits are rebuilt for the networkx graph
+	G.graph.update((key, value) for key, value in state.get('graph', {}).items() if key != 'limits')
+	return G
+
+##
+# Adds a forceful peer with a static opinion to a state, its edge to every chosen neighbor is weighted by the number
+# of times the neighbor was chosen, as graph_modification.attach_neighbors does
+# returns the index of the new peer
+# @param state graph state, modified in place
+# @param peer_type type of the peer (strategy name)
+# @param opinion static opinion of the peer
+# @param f_neighbors list of the chosen normal peers
+# @param budget budget of the peer
+#
+def attach_peer(state, peer_type, opinion, f_neighbors, budget=0):
+	N = len(state['opinion'])
+	nodes, counts = np.unique(np.asarray(f_neighbors, dtype=np.int64), return_counts=True)
+	column = sparse.csr_matrix((counts.astype(float), (nodes, np.zeros(len(nodes), dtype=np.int64))), shape=(N, 1))
+	state['W'] = sparse.bmat([[state['W'], column], [column.T, None]], format='csr')
+	if peer_type not in state['types']: state['types'].append(peer_type)
+	state['type'] = np.append(state['type'], np.int8(state['types'].index(peer_type)))
+	state['opinion'] = np.append(state['opinion'], float(opinion))
+	state['initial_opinion'] = np.append(state['initial_opinion'], float(opinion))
+	state['budget'] = np.append(state['budget'], budget)
+	state['forceful'] = np.append(state['forceful'], N)
+	changed(state)
+	return N
+
+##
+# returns the dictionary of graph attributes (e.g. 'convergence' of graph_modification.sparse_update):
+# G.graph of a networkx graph, the 'graph' entry of a state
+# @param G graph state or networkx graph
+#
+def attributes(G):
+	if is_state(G): return G.setdefault('graph', {})
+	return G.graph
+
+##
+# Marks a graph as modified by bumping its 'version' attribute, the caches stamped with it (e.g. the strategy limits of
+# graph_modification.strategy_limits) are rebuilt. Every function changing nodes, edges or weights calls it, an edit made
+# directly on a networkx graph or on the arrays of a state must call it too
+# @param G graph state or networkx graph
+#
+def changed(G):
+	attrs = attributes(G)
+	attrs['version'] = attrs.get('version', 0) + 1
+
+##
+# returns the number of normal peers: n of a state, all nodes but the forceful peers listed in G.graph['forceful']
+# (see graph_modification.add_forceful_peers) or else the last 2 of a networkx graph
+# @param G graph state or networkx graph
+#
+def num_normal(G):
+	if is_state(G): return G['n']
+	return G.number_of_nodes() - len(G.graph.get('forceful', [0, 0]))
+
+##
+# returns the number N of node keys 0..N-1 spanned by a graph: its number of nodes, or more when a key is missing
+# (add_one_forceful adds its peer as n+1 and leaves n to the peer added next)
+# @param G graph state or networkx graph with integer keys
+#
+def num_keys(G):
+	if is_state(G): return len(G['opinion'])
+	if G.number_of_nodes() == 0: return 0
+	return max(G.number_of_nodes(), max(G.nodes_iter()) + 1)
+
+##
+# returns the initial opinions of the normal peers 0..n-1
+# @param G graph state or networkx graph
+#
+def normal_initial(G):
+	n = num_normal(G)
+	if is_state(G): return G['initial_opinion'][:n]
+	return np.array([G.node[i]['initial_opinion'] for i in xrange(n)], dtype=float)
+
+##
+# returns 3 arrays over the keys 0..N-1 (see num_keys): True for the normal peers, the initial opinions and the current opinions
+# A missing key is neither normal nor connected. A forceful peer without an opinion gets the one forceful_opinions gives it
+# @param G graph state or networkx graph
+#
+def node_arrays(G):
+	if is_state(G): return G['type'] == 0, G['initial_opinion'], G['opinion']
+	N = num_keys(G)
+	normal = np.zeros(N, dtype=bool)
+	opinion = np.zeros(N)
+	for i, data in G.nodes_iter(data=True):
+		normal[i] = data.get('type') == 'normal'
+		opinion[i] = data.get('opinion', 0)
+	initial = opinion.copy()
+	for i in np.flatnonzero(normal): initial[i] = G.node[i].get('initial_opinion', opinion[i])
+	# forceful peers without attributes (e.g. built by hand) take the default opinions of forceful_opinions
+	if 'forceful' not in G.graph:
+		keys = [i for i in xrange(num_normal(G), N) if G.has_node(i)]
+		for i, value in zip(keys, forceful_opinions(G).ravel()):
+			if 'opinion' not in G.node[i]: opinion[i] = initial[i] = value
+	return normal, initial, opinion
+
+##
+# returns the column of the static opinions of the forceful peers,
+# [[1], [-1]] for a networkx graph that does not list its forceful peers in G.graph['forceful']
+# @param G graph state or networkx graph
+#
+def forceful_opinions(G):
+	if is_state(G): return G['opinion'][G['forceful']].reshape(-1, 1)
+	if 'forceful' in G.graph: return np.array([[G.node[f]['opinion']] for f in G.graph['forceful']], dtype=float)
+	return np.array([ [1],[-1] ])
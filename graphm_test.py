@@ -1,8 +1,15 @@
 from __future__ import division
 import unittest as ut
 import graph_modification as gm
+import computation as cp
+import graph_state as gs
+import parallel_solve as ps
 import networkx as nx
 import numpy as np
+from scipy import sparse
+import os
+import shutil
+import tempfile
 
 
 class graphm_test(ut.TestCase):
@@ -113,5 +120,181 @@ class graphm_test(ut.TestCase):
 		np.random.seed(self.seed)
 		f_neighbors_actual = gm.strategy_1_D(self.G,budget)
 		np.testing.assert_array_almost_equal(f_neighbors_actual,f_neighbors_exp,6,'error in strategy 1/D')
+
+	# Asserting that the limits of a strategy are cached on the graph until it changes
+	def test_strategy_limits(self):
+		limits = gm.strategy_limits(self.G, 'D')
+		np.testing.assert_array_almost_equal(limits, [0, 0.25, 0.75, 1], 7, 'error in limits of strategy D.')
+		self.assertIs(gm.strategy_limits(self.G, 'D'), limits)
+		self.G.add_edge(0,2)
+		np.testing.assert_array_almost_equal(gm.strategy_limits(self.G, 'D'), [0, 1/3, 2/3, 1], 7, 'error in limits of strategy D.')
+		# an edge swap keeping the numbers of nodes and edges is seen through the version of the graph
+		self.G.remove_edge(1, 2)
+		self.G.add_edge(0, 2)
+		gs.changed(self.G)
+		np.testing.assert_array_almost_equal(gm.strategy_limits(self.G, 'D'), [0, 0.5, 2/3, 1], 7, 'error in limits of strategy D.')
+		# so is a weight change made by attach_neighbors
+		G = nx.path_graph(3)
+		G.add_node(3, type = 'D', opinion = 1)
+		gm.attach_neighbors(G, 3, [0])
+		gm.attach_neighbors(G, 3, [0])
+		self.assertEqual(G.graph['version'], 2)
+		state = gs.from_edges('random', 3, [(0, 1), (1, 2)])
+		limits = gm.strategy_limits(state, 'D')
+		gs.attach_peer(state, 'D', 1, [0, 0])
+		self.assertIsNot(gm.strategy_limits(state, 'D'), limits)
+
+	# Asserting the sparse opinion engine against the local update loop with forceful peers attached
+	def test_R_itr_sparse(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('barabasi_albert', 30, 2)
+		gm.add_forceful(G, 'D', 5, 'random', 5)
+		G_copy = G.copy()
+		R_loop = gm.R_itr(G, self.alpha)
+		R_sparse = gm.R_itr(G_copy, self.alpha, engine='sparse')
+		np.testing.assert_array_almost_equal(R_sparse, R_loop, 6, 'error in sparse opinion engine')
+		np.testing.assert_array_almost_equal(gm.get_opinion(G_copy), gm.get_opinion(G), 6, 'error in sparse opinion engine')
+	# Asserting that the local update of a graph state is the one of the networkx graph
+	def test_local_update_state(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('barabasi_albert', 30, 2)
+		gm.add_forceful(G, 'D', 5, 'random', 5)
+		state = gs.from_networkx(G)
+		for t in range(3):
+			gm.local_update(G, self.alpha)
+			gm.local_update(state, self.alpha)
+		np.testing.assert_array_almost_equal(gm.get_opinion(state), gm.get_opinion(G), 10)
+	# Asserting that a graph state goes through the solvers of R_itr as the networkx graph does
+	def test_R_itr_state(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('barabasi_albert', 30, 2)
+		gm.add_forceful(G, 'D', 5, 'random', 5)
+		state = gs.from_networkx(G)
+		for engine in ['sparse', 'cg']:
+			R = gm.R_itr(G.copy(), self.alpha, engine)
+			np.testing.assert_array_almost_equal(gm.R_itr(gs.from_networkx(G), self.alpha, engine), R, 10)
+		gm.R_itr(state, self.alpha, 'sparse')
+		self.assertGreater(gs.attributes(state)['convergence']['iterations'], 0)
+		np.testing.assert_array_almost_equal(state['opinion'][:30].reshape(-1, 1), cp.R_inf(G, self.alpha), 4)
+	# Asserting the accelerated solvers against the sparse direct solution
+	def test_R_itr_solvers(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('geometric', 40, 0.3)
+		gm.add_forceful(G, 'D', 6, 'D^2', 6)
+		R_inf = cp.R_inf(G, self.alpha)
+		for engine in ['sparse', 'gauss-seidel', 'sor', 'chebyshev', 'cg']:
+			R = gm.R_itr(G.copy(), self.alpha, engine)
+			np.testing.assert_array_almost_equal(R, R_inf, 4, 'error in ' + engine + ' engine')
+		G_sor = G.copy()
+		gm.R_itr(G_sor, self.alpha, 'sor')
+		G_jacobi = G.copy()
+		gm.R_itr(G_jacobi, self.alpha, 'sparse')
+		self.assertLess(G_sor.graph['convergence']['iterations'], G_jacobi.graph['convergence']['iterations'])
+	# Asserting that the parallel engine runs the sweeps of the sparse engine on blocks of peers
+	def test_R_itr_parallel(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('geometric', 60, 0.25)
+		gm.add_forceful(G, 'D', 6, '1/D', 6)
+		R_inf = cp.R_inf(G, self.alpha)
+		G_sparse = G.copy()
+		R_sparse = gm.R_itr(G_sparse, self.alpha, 'sparse')
+		for workers in [1, 3]:
+			G_parallel = G.copy()
+			R = gm.R_itr(G_parallel, self.alpha, 'parallel', workers = workers)
+			np.testing.assert_array_almost_equal(R, R_inf, 4, 'error in parallel engine')
+			np.testing.assert_array_almost_equal(R, R_sparse, 12, 'error in parallel engine')
+			self.assertEqual(G_parallel.graph['convergence']['iterations'], G_sparse.graph['convergence']['iterations'])
+		# the workers of the last solve are kept for the next one
+		processes = ps._solver['processes']
+		gm.R_itr(G.copy(), self.alpha, 'parallel', workers = 3)
+		self.assertTrue(ps._solver['processes'] is processes)
+		indptr = np.array([0, 10, 11, 12, 13, 14, 15])
+		bounds = ps.row_blocks(indptr, 3)
+		self.assertEqual((bounds[0], bounds[-1]), (0, 6))
+		self.assertTrue(np.all(np.diff(bounds) >= 0))
+		# a worker failing in its sweep (4 rows for the 3 peers of c) stops the solve instead of blocking it
+		Pf = sparse.csr_matrix(np.diag([0.5, 0.5, 0.5, 0.5])[:, ::-1])
+		self.assertRaises(SystemExit, ps.parallel_jacobi, Pf, np.ones(3), np.zeros(3), 1e-5, 2)
+		self.assertTrue(ps._solver is None)
+	# Asserting that the trace keeps the last residuals of every engine in its ring buffer
+	def test_trace(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('geometric', 40, 0.3)
+		gm.add_forceful(G, 'D', 6, 'D^2', 6)
+		for engine in ['loop', 'sparse', 'sor', 'cg']:
+			trace = gm.new_trace(8, [0, 5], 2, 3)
+			gm.R_itr(G.copy(), self.alpha, engine, trace = trace)
+			residuals = gm.trace_residuals(trace)
+			self.assertEqual(len(residuals), min(8, trace['iterations']))
+			self.assertEqual(residuals[-1], trace['last']['max_diff'])
+			self.assertEqual(trace['snapshots'].shape, (3, 2))
+			if trace['iterations'] >= 6:
+				self.assertEqual(trace['snapshot_iterations'].max(), trace['iterations'] - trace['iterations'] % 2)
+	# Asserting the array graph generators
+	def test_generate_edges(self):
+		np.random.seed(self.seed)
+		pos = np.random.random((200, 2))
+		edges = gm.geometric_edges(pos, 0.15)
+		d2 = ((pos[:, None, :] - pos[None, :, :])**2).sum(axis=2)
+		i, j = np.nonzero(np.triu(d2 <= 0.15**2, 1))
+		self.assertEqual(sorted(map(tuple, edges.tolist())), sorted(zip(i.tolist(), j.tolist())))
+		edges = gm.erdos_renyi_edges(200, 0.1)
+		self.assertTrue(np.all(edges[:, 0] < edges[:, 1]) and np.all(edges[:, 1] < 200))
+		self.assertEqual(len(set(map(tuple, edges.tolist()))), len(edges))
+		self.assertEqual(len(gm.erdos_renyi_edges(50, 1)), 50*49/2)
+		edges = gm.barabasi_albert_edges(200, 3)
+		# every new node attaches to 3 distinct earlier nodes, the first one to the starting nodes
+		self.assertTrue(np.all(edges[:, 1] < edges[:, 0]))
+		self.assertEqual(edges[:3].tolist(), [[3, 0], [3, 1], [3, 2]])
+		self.assertTrue(np.all(np.sort(edges[:, 1].reshape(-1, 3), axis=1)[:, 1:] != np.sort(edges[:, 1].reshape(-1, 3), axis=1)[:, :-1]))
+		G = gm.create_graph('barabasi_albert', 200, 3, 'fast')
+		self.assertEqual(G.number_of_edges(), (200-3)*3)
+		self.assertEqual(G.node[5]['type'], 'normal')
+		self.assertEqual(G[0][3]['weight'], 1)
+	# Asserting both connectivity repairs on a graph with 3 components
+	def test_connect_graph(self):
+		G = nx.Graph()
+		G.add_edges_from([(0,1),(1,2),(3,4),(5,6),(6,7),(7,8)], weight = 1)
+		G.add_node(9)
+		giant = gm.connect_graph(G.copy(), 'giant')
+		self.assertEqual(sorted(giant.nodes()), [0,1,2,3])
+		self.assertEqual(giant.graph['repair'], {'components': 4, 'added_edges': 0, 'dropped_nodes': 6})
+		bridged = gm.connect_graph(G, 'bridge')
+		self.assertTrue(nx.is_connected(bridged))
+		self.assertEqual(bridged.graph['repair']['added_edges'], 3)
+	# Asserting that the best response placement is consistent with R_inf and beats a random placement
+	def test_add_best_response(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('barabasi_albert', 30, 2)
+		gm.add_one_forceful(G, 'D', 6)
+		G_random = G.copy()
+		f1_neighbors, perc = gm.add_best_response(G, self.alpha, 6, 0.001)
+		self.assertEqual(len(f1_neighbors), 6)
+		R_inf = cp.R_inf(G, self.alpha)
+		np.testing.assert_array_almost_equal(gm.get_opinion(G)[:30], R_inf.ravel(), 7, 'error in best response opinions')
+		self.assertEqual(perc, cp.classify(R_inf, 0.001))
+		G_random.add_node(30, type = 'U', opinion = 1)
+		gm.attach_neighbors(G_random, 30, np.random.random_integers(0, 29, 6))
+		self.assertGreater(np.sum(R_inf), np.sum(cp.R_inf(G_random, self.alpha)))
+	# Asserting that the sparse model of the smart peer finds the budget of the pulp model
+	def test_add_smart(self):
+		np.random.seed(self.seed)
+		G = gm.create_graph('barabasi_albert', 8, 2)
+		gm.add_one_forceful(G, 'D', 3)
+		G_cbc = G.copy()
+		G_start = G.copy()
+		cwd = os.getcwd()
+		tmp = tempfile.mkdtemp()
+		try:
+			# attach_smart writes smart_peer_info.txt in the working directory
+			os.chdir(tmp)
+			budget = gm.add_smart(G, self.alpha, 3, 0.001, 'sparse', 60)
+			self.assertEqual(budget, gm.add_smart(G_cbc, self.alpha, 3, 0.001, 'cbc', 60))
+			weights = [G[8][i]['weight'] if G.has_edge(8, i) else 0 for i in range(8)]
+			self.assertEqual(gm.add_smart(G_start, self.alpha, 3, 0.001, 'sparse', 60, warm_start = weights), budget)
+		finally:
+			os.chdir(cwd)
+			shutil.rmtree(tmp)
+		self.assertGreater(cp.classify(cp.R_inf(G, self.alpha), 0.001)[0], 0.5)
 if __name__ == "__main__":
 	ut.main()
\ No newline at end of file
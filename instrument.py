@@ -0,0 +1,122 @@
+## @package instrument
+# Named timing spans and counters of the stages of a simulation, aggregated over all simulations of a run.
+# Instrumentation is disabled by default: span then returns a shared object whose enter and exit do nothing
+# and count returns at once, so the calls can stay in the simulation code.
+# Worker processes take a snapshot of their own state which the parent process merges.
+import json
+import time
+
+# 'spans': name -> [calls, total seconds, longest seconds], 'counters': name -> total
+_state = {'enabled': False, 'spans': {}, 'counters': {}}
+
+##
+# Timing span of one stage, added to the state when it exits
+class _Span(object):
+	__slots__ = ('name', 'start')
+	def __init__(self, name):
+		self.name = name
+	def __enter__(self):
+		self.start = time.time()
+		return self
+	def __exit__(self, exc_type, exc_value, traceback):
+		elapsed = time.time() - self.start
+		entry = _state['spans'].get(self.name)
+		if entry is None: _state['spans'][self.name] = [1, elapsed, elapsed]
+		else:
+			entry[0] += 1
+			entry[1] += elapsed
+			if elapsed > entry[2]: entry[2] = elapsed
+		return False
+
+##
+# Span used when the instrumentation is disabled
+class _NoSpan(object):
+	__slots__ = ()
+	def __enter__(self):
+		return self
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+_NO_SPAN = _NoSpan()
+
+##
+# Enables or disables the instrumentation, the recorded values are kept
+# @param enabled True to record spans and counters
+#
+def enable(enabled=True):
+	_state['enabled'] = enabled
+
+##
+# returns True if the instrumentation is enabled
+def enabled():
+	return _state['enabled']
+
+##
+# Drops all recorded spans and counters
+def reset():
+	_state['spans'] = {}
+	_state['counters'] = {}
+
+##
+# returns a context manager timing the stage 'name': with span('solve'): ...
+# @param name name of the stage
+#
+def span(name):
+	if not _state['enabled']: return _NO_SPAN
+	return _Span(name)
+
+##
+# Adds a value to a counter
+# @param name name of the counter
+# @param value value added
+#
+def count(name, value=1):
+	if not _state['enabled']: return
+	_state['counters'][name] = _state['counters'].get(name, 0) + value
+
+##
+# returns a copy of the recorded spans and counters that can be sent to another process and merged there
+def snapshot():
+	return {'spans': dict((name, list(entry)) for name, entry in _state['spans'].items()),
+			'counters': dict(_state['counters'])}
+
+##
+# Adds a snapshot (e.g. the one of a worker process) to the recorded spans and counters
+# @param snap dictionary returned by snapshot
+#
+def merge(snap):
+	for name, (calls, total, longest) in snap['spans'].items():
+		entry = _state['spans'].get(name)
+		if entry is None: _state['spans'][name] = [calls, total, longest]
+		else:
+			entry[0] += calls
+			entry[1] += total
+			entry[2] = max(entry[2], longest)
+	for name, value in snap['counters'].items():
+		_state['counters'][name] = _state['counters'].get(name, 0) + value
+
+##
+# returns a text summary: one line per stage from the longest total time, then one line per counter
+def summary():
+	spans = _state['spans']
+	total = sum(entry[1] for entry in spans.values())
+	lines = ['Stage\t\tcalls\ttotal (s)\tshare\tmean (s)\tmax (s)']
+	for name in sorted(spans, key = lambda name: -spans[name][1]):
+		calls, elapsed, longest = spans[name]
+		lines.append('%-12s\t%d\t%f\t%.1f%%\t%f\t%f' %(name, calls, elapsed, elapsed/total*100 if total > 0 else 0,
+				elapsed/calls, longest))
+	for name in sorted(_state['counters']):
+		lines.append('%-12s\t%s' %(name, _state['counters'][name]))
+	return '\n'.join(lines)
+
+##
+# Writes the recorded spans and counters as a JSON report
+# @param path file to write
+# @param extra dictionary of values added to the report (e.g. the parameters of the run)
+#
+def report(path, extra=None):
+	data = {'spans': dict((name, {'calls': calls, 'total': total, 'max': longest})
+			for name, (calls, total, longest) in _state['spans'].items()), 'counters': _state['counters']}
+	if extra is not None: data.update(extra)
+	with open(path, 'w') as f:
+		json.dump(data, f, indent = 1, sort_keys = True)
@@ -2,16 +2,18 @@
 # Simulates a network with peers and diffusion of information
 from __future__ import division # to allow integer division to produce a floating point
 import networkx as nx
-import matplotlib.pyplot as plt
 import graph_modification as gm
+import graph_state as gs
 import random as rd
 import numpy as np
 import computation as cp
 import time
 import excp as ex
 import sys
-import display as d
 import datetime
+import simulation as sim
+import sink as sk
+import instrument as ins
 print datetime.datetime.today()
 # Macros like variables
 start_time = time.time()
@@ -25,65 +27,92 @@ G_TYPE = 'geometric' # Graph type: random, geometric, scale_free (barabasi_alber
 #for Geometric graph: maximum euclidean distance for a edge to exist between 2 nodes
 #for barabasi albert graph: number of nodes starting the graph and number of edges a new node entering the graph will have
 G_CHAR = 0.2
+CONNECT = 'reject' # Graph that is not connected: reject (generate another), giant (keep the largest component), bridge (add edges)
+GRAPH_BACKEND = 'networkx' # Graph generators: networkx, fast (array generators for large graphs)
+CORPUS = None # Directory where generated graphs are stored and reloaded by later runs with the same graph parameters (None to disable)
 ALPHA = 0.3 # weight given to self opinion
 STRATEGY1 = 'D' # strategy chosen by first forceful peer ((+1))
 BUDGET1 = 10 # number of edges allowed for first forceful peer 
 STRATEGY2 ='1/D' # strategy chosen by second forceful peer ((-1))
 BUDGET2 = 10 # number of edges allowed for second forceful peers
 NEUTRAL_RANGE = 0.001 # opinion between +ve and -ve values of this range are considered neutral
+SMART_SOLVER = 'sparse' # MILP solver of the smart peer: sparse (sparse model solved by CBC), gurobi or cbc (pulp)
 SIMULATIONS = 1 # Number of repition of a match between 2 strategies
-repeated_sim = 0 # Repeated simulations in case of 1/D strategy
-# seed the random generator
-np.random.seed(SEED)  ;rd.seed(SEED)
-# arrays to store the followers percentages of forceful peers (positive or negative) and neutral nodes for each match
-S1_followers = np.zeros(SIMULATIONS)
-S2_followers = np.zeros(SIMULATIONS)
-neutral = np.zeros(SIMULATIONS)
+WORKERS = 1 # Number of processes running the simulations in parallel
+ENGINE = 'sparse' # opinion engine of R_itr: loop, sparse, parallel, float32, gauss-seidel, sor, chebyshev, cg
+# float32 halves the memory of the iterations and refuses to classify the nodes within its error of the neutral range boundary
+SOLVER_WORKERS = None # Processes of the parallel engine solving one graph (None for the number of cores), needs WORKERS = 1
+CHECK_R_INF = False # Assert that R_inf calculated by equation and by iteration are equal to 4 decimal places (one sparse LU per simulation)
+PRECISION = None # Stop as soon as this precision (% of the mean, e.g. 0.5) is reached, SIMULATIONS is then the maximum
+MIN_SIMULATIONS = 30 # Minimum number of simulations before stopping on the precision
+PRECISION_TARGET = 'followers' # Precision of the followers percentages (followers) or of the winning percentage (wins)
+SINK = None # Directory of a binary store receiving the opinions and placement of every simulation (None to disable)
+TRACE_FILE = "Opinions_last_simulation.txt" # Convergence trace and opinions of the last simulation (None to disable)
+RENDER_PATH = None # Image file (.png, .svg) where the last graph is drawn without a display, None to show it in a window
+INSTRUMENT = False # Time the stages (generate, connect, place, solve, classify) and count retries, iterations and solver calls
+INSTRUMENT_REPORT = None # JSON file receiving the stage timings and counters (None to only print them)
+params = {'g_type': G_TYPE, 'num_peers': NUM_PEERS, 'g_char': G_CHAR, 'backend': GRAPH_BACKEND, 'connect': CONNECT, 'alpha': ALPHA,
+		'strategy1': STRATEGY1, 'budget1': BUDGET1, 'strategy2': STRATEGY2, 'budget2': BUDGET2,
+		'neutral_range': NEUTRAL_RANGE, 'smart_solver': SMART_SOLVER, 'engine': ENGINE, 'solver_workers': SOLVER_WORKERS, 'check': CHECK_R_INF, 'instrument': INSTRUMENT,
+		'corpus': CORPUS}
+ins.enable(INSTRUMENT)
+# Strategies of a round robin tournament e.g. ['D', '1/D', 'D^2', 'random'], all pairings are played on the same graphs
+# An empty list plays only STRATEGY1 against STRATEGY2
+TOURNAMENT = []
+TOURNAMENT_BUDGETS = [(BUDGET1, BUDGET2)] # (budget1, budget2) played by every pairing of the tournament
+if TOURNAMENT:
+	table, stats = sim.tournament(params, TOURNAMENT, TOURNAMENT_BUDGETS, SIMULATIONS, SEED, WORKERS)
+	print 'seed used: %d\tGraph type: %s\t number of normal nodes: %d' %(SEED,G_TYPE,NUM_PEERS)
+	sim.print_tournament(table, stats, TOURNAMENT, TOURNAMENT_BUDGETS, SIMULATIONS)
+	if INSTRUMENT: print ins.summary()
+	if INSTRUMENT_REPORT is not None: ins.report(INSTRUMENT_REPORT, {'params': params, 'simulations': SIMULATIONS})
+	print 'Time elapsed %f' % (time.time() - start_time)
+	sys.exit()
+# Forceful peers (strategy, budget, opinion) of a multi-party campaign e.g. [('D', 10, 1), ('1/D', 10, -1), ('random', 10, 0.5)]
+# An empty list plays only STRATEGY1 against STRATEGY2
+CAMPAIGN = []
+if CAMPAIGN:
+	result = sim.campaign(params, CAMPAIGN, SIMULATIONS, SEED, WORKERS)
+	print 'seed used: %d\tGraph type: %s\t number of normal nodes: %d' %(SEED,G_TYPE,NUM_PEERS)
+	print 'After %d simulations:\npeer\tstrategy\tbudget\topinion\tfollowers\twins' %(SIMULATIONS)
+	for j, (strategy, budget, opinion) in enumerate(CAMPAIGN):
+		print '%d\t%s\t\t%d\t%.2f\t%.2f%%\t\t%.2f%%' %(j, strategy, budget, opinion, np.mean(result['shares'][:, j])*100,
+				result['wins'][j]/SIMULATIONS*100)
+	print 'neutral\t\t\t\t\t%.2f%%\t\t%.2f%% (ties)' %(np.mean(result['shares'][:, -1])*100, result['wins'][-1]/SIMULATIONS*100)
+	if INSTRUMENT: print ins.summary()
+	print 'Time elapsed %f' % (time.time() - start_time)
+	sys.exit()
+# Each simulation generates its graph, adds the forceful peers and evaluates the results with its own random stream derived from SEED
+# taking into consideration the possibility of having to redo a graph in case it is not connected
+if SINK is not None: sink = sk.open_sink(SINK, NUM_PEERS)
+else: sink = None
+# Residuals of the iterations kept in memory, written once at the end
+if TRACE_FILE is not None: trace = gm.new_trace()
+else: trace = None
+results = sim.run_simulations(params, SIMULATIONS, SEED, WORKERS, sink, PRECISION, MIN_SIMULATIONS, PRECISION_TARGET, trace)
+if sink is not None: sk.close_sink(sink)
+# arrays storing the followers percentages of forceful peers (positive or negative) and neutral nodes for each match
+S1_followers = results['S1_followers']
+S2_followers = results['S2_followers']
+neutral = results['neutral']
 # List that stores [S1_wins, S2_wins, ties]
-wins= [0,0,0]
-# for analytical reasons, store the winning percentage for each simulation for strategy 1
-S1_wins_list = []
-# Loop Simulation times to generate graph and evaluate results.
-# taking into consideration the possibility of having to redo a simulation in case of an edgeless node appears woth 1/D strategy
-i = 0
-while i < SIMULATIONS:
-	# Initialize the graph with normal peers
-	G = gm.create_graph(G_TYPE,NUM_PEERS, G_CHAR)
-	# Exception is thrown if the graph is not connected and simulation is repeated
-	try:
-		if not nx.is_connected(G): raise nx.NetworkXException('Exception: Graph is not connected, simulation will be repeated')
-	except nx.NetworkXException as exp:
-		# Ignore this simulation and do another one
-		print exp
-		repeated_sim += 1
-		continue
-	# If strategy 1 is not a smart peer, the 2 forceful peers can be added simultaneously
-	if STRATEGY1 != 'smart':
-		gm.add_forceful(G, STRATEGY1, BUDGET1, STRATEGY2, BUDGET2)
-	# If strategy 1 is smart then ofrceful peer with strategy 2 is added first then smart peer
-	else:
-		#Add one forceul peer to the graph
-		gm.add_one_forceful(G, STRATEGY2, BUDGET2)
-		## Linear programming method to beat an existing peer with minimum budget
-		BUDGET1 = gm.add_smart(G,ALPHA,BUDGET2, NEUTRAL_RANGE)
-	# Calculate final opinion vector by equation, considering the presence of 
-	# 2 forceful peers in the last 2 indices of the graph
-	#R_inf = cp.R_inf(G,ALPHA)
-	# Calculate final opinion vector by iterations
-	R_itr = gm.R_itr(G,ALPHA)
-	# Calculate the percentage of normal peers that followed either of the forceful peers
-	tmp = cp.percentages(G,NEUTRAL_RANGE)
-	# Update S1_wins_list for analytical reason
-	if (tmp[0]>0.5): S1_wins_list.append(1)
-	else: S1_wins_list.append(0)
-	# Update percentages arrays
-	cp.update_percentages(tmp, S1_followers, S2_followers, neutral, i, wins)
-	i += 1
-	# Asserting that R_inf calculated by equation and iteration are equal to decimal places
-	#try:
-	#	np.testing.assert_array_almost_equal(R_inf,R_itr,4)
-	#except AssertionError:
-	#	sys.exit('ConvergenceError: convergence of R_inf is not correct to 4 decimal places\nProgram will terminate')
+wins = results['wins']
+# for analytical reasons, the winning percentage for each simulation for strategy 1
+S1_wins_list = results['S1_wins_list']
+# Repeated simulations in case of a graph that is not connected
+repeated_sim = results['repeated']
+BUDGET1 = results['budget1']
+# Number of simulations actually done, less than SIMULATIONS if the precision was reached before
+SIMULATIONS = results['simulations']
+# Graph of the last simulation to save and display, regenerated if it was computed by a worker process
+G = results['graph']
+if G is None:
+	# not counted by the instrumentation
+	ins.enable(False)
+	G = sim.simulate(params, SEED, SIMULATIONS-1, trace)[0]
+# a graph of the corpus is a graph state, saved and displayed as a networkx graph
+if gs.is_state(G): G = gs.to_networkx(G)
+if trace is not None: gm.flush_trace(trace, TRACE_FILE)
 
 wins[0] = (wins[0]/SIMULATIONS)*100 
 wins[1] = (wins[1]/SIMULATIONS)*100
@@ -93,19 +122,28 @@ print 'seed used: %d\tGraph type: %s\t number of normal nodes: %d' %(SEED,G_TYPE
 print 'After %d simulations: %s strategy budget = %d, %s strategy budget = %d\n\t\t\t %s strategy \t %s strategy\t neutral' %(SIMULATIONS,STRATEGY1,BUDGET1,STRATEGY2,BUDGET2, STRATEGY1,STRATEGY2)
 print 'Follwers percentage\t %.2f%% \t\t %.2f%% \t %.2f%%' %(np.mean(S1_followers)*100,np.mean(S2_followers)*100,np.mean(neutral)*100) 
 print 'Winning percentage:\t %.2f%% \t\t %.2f%% \t %.2f%%' %(wins[0],wins[1], wins[2])
+if ENGINE == 'float32':
+	print 'Refused (within %g of the neutral range boundary): %.2f%%' %(G.graph['convergence']['error'], np.mean(results['refused'])*100)
 print 'Time elapsed %f' % (time.time() - start_time)
-#print 'Repeated simulations: ', repeated_sim
+print 'Repeated simulations: %d (%f s), added edges: %d, dropped nodes: %d' %(repeated_sim, results['rejected_time'], results['added_edges'], results['dropped_nodes'])
 #print 'The number of simulations needed to obtain 0.5% confidence interval: ',str(cp.get_sim_num(np.mean(S1_followers),S1_followers))
-#print 'The precision after ', str(SIMULATIONS), 'simulations is:', str(cp.get_precision(np.mean(S1_followers),S1_followers,SIMULATIONS))
+if PRECISION is not None and SIMULATIONS > 1 and np.mean(S1_followers) > 0:
+	print 'The precision after ', str(SIMULATIONS), 'simulations is:', str(cp.get_precision(np.mean(S1_followers),S1_followers,SIMULATIONS))
+if INSTRUMENT: print ins.summary()
+if INSTRUMENT_REPORT is not None: ins.report(INSTRUMENT_REPORT, {'params': params, 'simulations': SIMULATIONS})
 sys.stdout.write("\a")
 #input("Press Enter to continue...")
 #print '\n'.join(map(str, R_itr))
-# Save Calculated opinion of nodes by simulation
-f = open("smart_peer_info.txt", "a")
-f.write('Opinions after simulation\n')
-for n in xrange(NUM_PEERS):
-	f.write('opinion of node: '+ str(n) + ' = ' + str(G.node[n]['opinion']) + '\n')
+# Save Calculated opinion of nodes by simulation, already stored by the sink if there is one
+if sink is None:
+	f = open("smart_peer_info.txt", "a")
+	f.write('Opinions after simulation\n')
+	for n in xrange(G.number_of_nodes()-2):
+		f.write('opinion of node: '+ str(n) + ' = ' + str(G.node[n]['opinion']) + '\n')
 
-f.write('===========================\n')
+	f.write('===========================\n')
 # Display the graph including forceful peers (NUM_PEERS+2) or not (NUM_PEERS)categorizing nodes by category and by opinion based on the neutral range
-d.display_graph(G,NEUTRAL_RANGE,NUM_PEERS,SEED)
+# matplotlib is only imported when the graph is drawn
+import display as d
+if RENDER_PATH is not None: d.render_graph(G, NEUTRAL_RANGE, RENDER_PATH, SEED)
+else: d.display_graph(G,NEUTRAL_RANGE,NUM_PEERS,SEED)
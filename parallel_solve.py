@@ -0,0 +1,216 @@
+## @package parallel_solve
+# Jacobi iterations of the opinion system x(t) = c + Pf x(t-1) of one large graph on several cores.
+# The CSR arrays of Pf, the constant c and two opinion buffers are held in shared memory (multiprocessing RawArray)
+# and the updated peers are split in contiguous blocks of rows holding about the same number of non zeros.
+# Every worker process updates its block from one buffer into the other and writes the maximum difference of its block;
+# the master process acts as the barrier of every sweep (multiprocessing has no Barrier in python 2): it starts the sweep
+# on all workers, waits for all of them, reduces their differences and stops on the criterion of R_itr.
+# While it waits it checks every second that the workers are alive, so that a dead worker stops the solve instead of blocking it.
+# The workers and the shared arrays are kept from one solve to the next (see get_solver): a solve only copies its
+# system into the shared arrays, and nothing when the matrix is the one of the previous solve.
+# The iterations are the ones of the 'sparse' engine, row by row with the same arithmetic, so are the results.
+import atexit
+import ctypes
+import multiprocessing as mp
+import os
+import Queue
+import time
+import weakref
+import numpy as np
+from scipy import sparse
+
+# workers and shared arrays of the last solve, None before the first one (see get_solver)
+_solver = None
+
+##
+# returns a shared memory array of a given capacity and a numpy view of it
+# @param size number of elements
+# @param ctype ctypes type of the elements
+#
+def shared_array(size, ctype):
+	raw = mp.RawArray(ctype, max(1, size))
+	return raw, np.ctypeslib.as_array(raw)
+
+##
+# returns the workers + 1 row boundaries of contiguous blocks holding about the same number of non zeros
+# @param indptr row pointers of a CSR matrix
+# @param workers number of blocks
+#
+def row_blocks(indptr, workers):
+	rows = len(indptr) - 1
+	# weight every row by its non zeros plus one for its own update
+	cost = indptr + np.arange(rows + 1)
+	bounds = np.searchsorted(cost, np.linspace(0, cost[-1], workers + 1), side='left')
+	bounds[0] = 0
+	bounds[-1] = rows
+	return np.maximum.accumulate(bounds)
+
+##
+# Worker process: receives the block of every solve, then updates it at every sweep it receives until it receives None
+# A solve is announced by (n, start, end): the system of n peers is in the shared arrays and the block is the rows [start, end)
+# Sweep t reads the buffer t%2 and writes the buffer (t+1)%2, its maximum difference is written in diffs[w]
+# @param raws shared arrays (indptr, indices, data, c, x0, x1, diffs)
+# @param commands end of a pipe receiving the solves and the sweep numbers
+# @param done queue receiving the index of the worker at the end of every sweep
+# @param w index of the worker
+#
+def _sweep_worker(raws, commands, done, w):
+	shared_indptr, shared_indices, shared_data, shared_c, shared_x0, shared_x1, diffs = [np.ctypeslib.as_array(raw) for raw in raws]
+	while True:
+		t = commands.recv()
+		if t is None: break
+		if isinstance(t, tuple):
+			n, start, end = t
+			c, buffers = shared_c[:n], [shared_x0[:n], shared_x1[:n]]
+			lo, hi = shared_indptr[start], shared_indptr[end]
+			# views of the shared arrays, only the row pointers of the block are copied
+			block = sparse.csr_matrix((shared_data[lo:hi], shared_indices[lo:hi], shared_indptr[start:end+1] - lo), shape=(end-start, n), copy=False)
+			continue
+		x_old = buffers[t % 2]
+		x_new = buffers[(t+1) % 2]
+		if end > start:
+			x_t = c[start:end] + block.dot(x_old)
+			diffs[w] = np.abs(x_t - x_old[start:end]).max()
+			x_new[start:end] = x_t
+		else: diffs[w] = 0
+		done.put(w)
+
+##
+# returns the solver (workers and shared arrays) of a system of n peers with nnz non zeros on a number of workers
+# The solver of the previous solve is kept if it has these workers and room for the system, otherwise it is closed and
+# a new one is started with twice the room needed, so that a series of growing systems restarts the workers rarely
+# @param workers number of worker processes
+# @param n number of updated peers
+# @param nnz number of non zeros of the matrix of the updated peers
+#
+def get_solver(workers, n, nnz):
+	global _solver
+	# the solver of the parent of a forked process belongs to the parent
+	if _solver is not None and _solver['pid'] != os.getpid(): _solver = None
+	if _solver is not None:
+		if _solver['workers'] == workers and n <= _solver['rows'] and nnz <= _solver['nnz'] and \
+				all(p.is_alive() for p in _solver['processes']):
+			return _solver
+		close_solver()
+	rows, size = 2*n, 2*nnz
+	index_type = ctypes.c_int32 if rows < 2**31 else ctypes.c_int64
+	shared = [shared_array(rows + 1, ctypes.c_int64), shared_array(size, index_type), shared_array(size, ctypes.c_double),
+			shared_array(rows, ctypes.c_double), shared_array(rows, ctypes.c_double), shared_array(rows, ctypes.c_double),
+			shared_array(workers, ctypes.c_double)]
+	raws = [raw for raw, view in shared]
+	done = mp.Queue()
+	pipes = []
+	processes = []
+	for w in xrange(workers):
+		parent, child = mp.Pipe()
+		p = mp.Process(target = _sweep_worker, args = (raws, child, done, w))
+		p.daemon = True
+		p.start()
+		pipes.append(parent)
+		processes.append(p)
+	_solver = {'workers': workers, 'rows': rows, 'nnz': size, 'views': [view for raw, view in shared], 'raws': raws,
+			'done': done, 'pipes': pipes, 'processes': processes, 'matrix': None, 'pid': os.getpid()}
+	return _solver
+
+##
+# Stops the workers of the solver kept by get_solver, the next solve starts new ones
+#
+def close_solver():
+	global _solver
+	if _solver is None or _solver['pid'] != os.getpid():
+		_solver = None
+		return
+	for pipe, p in zip(_solver['pipes'], _solver['processes']):
+		if p.is_alive():
+			try:
+				pipe.send(None)
+			except IOError: pass
+	for p in _solver['processes']:
+		p.join(1)
+		# a worker still in a sweep (e.g. after a timeout)
+		if p.is_alive(): p.terminate()
+	_solver = None
+
+atexit.register(close_solver)
+
+##
+# Sends a command to every worker
+# @param solver solver returned by get_solver
+# @param commands one command per worker
+#
+def send_all(solver, commands):
+	for w, (pipe, command) in enumerate(zip(solver['pipes'], commands)):
+		try:
+			pipe.send(command)
+		except IOError:
+			raise SystemExit('Parallel solver worker ' + str(w) + ' stopped (exit code ' + str(solver['processes'][w].exitcode) + ').\nProgram will terminate')
+
+##
+# Waits for the end of a sweep on every worker
+# @param done queue receiving the index of the worker at the end of every sweep
+# @param processes worker processes
+# @param timeout maximum time of the sweep in seconds, None for no limit
+#
+def wait_sweep(done, processes, timeout):
+	start = time.time()
+	finished = 0
+	while finished < len(processes):
+		try:
+			done.get(timeout = 1)
+			finished += 1
+		except Queue.Empty:
+			dead = [w for w, p in enumerate(processes) if not p.is_alive()]
+			if len(dead) > 0:
+				raise SystemExit('Parallel solver worker ' + str(dead[0]) + ' stopped (exit code ' + str(processes[dead[0]].exitcode) + ').\nProgram will terminate')
+			if timeout is not None and time.time() - start > timeout:
+				raise SystemExit('Parallel solver sweep exceeded ' + str(timeout) + ' s.\nProgram will terminate')
+
+##
+# Jacobi iterations x(t) = c + Pf x(t-1) split over worker processes, stopped when the maximum difference of opinions
+# between two iterations is not above the threshold (as jacobi in graph_modification)
+# returns the solution and the list of maximum differences of every iteration
+# @param Pf matrix of the updated peers
+# @param c constant part of the update
+# @param x initial opinions
+# @param threshold maximum accepted difference of opinions between two iterations
+# @param workers number of worker processes, None for the number of cores
+# @param callback function called with the maximum difference and the opinions of every iteration, None for no call
+# @param timeout maximum time of one sweep in seconds, None for no limit
+#
+def parallel_jacobi(Pf, c, x, threshold, workers=None, callback=None, timeout=None):
+	matrix = Pf
+	Pf = sparse.csr_matrix(Pf)
+	n = len(c)
+	if workers is None: workers = mp.cpu_count()
+	workers = max(1, min(workers, n))
+	solver = get_solver(workers, max(n, Pf.shape[0]), Pf.nnz)
+	indptr, indices, data, shared_c, x0, x1, diffs = solver['views']
+	# the matrix of the previous solve is already in the shared arrays (it is referenced weakly, not kept alive)
+	if solver['matrix'] is None or solver['matrix']() is not matrix:
+		solver['matrix'] = None
+		indptr[:len(Pf.indptr)] = Pf.indptr
+		indices[:Pf.nnz] = Pf.indices
+		data[:Pf.nnz] = Pf.data
+		solver['matrix'] = weakref.ref(matrix)
+	shared_c[:n] = c
+	x0[:n] = x
+	buffers = [x0[:n], x1[:n]]
+	bounds = row_blocks(Pf.indptr, workers)
+	residuals = []
+	max_diff = 1
+	t = 0
+	try:
+		send_all(solver, [(n, bounds[w], bounds[w+1]) for w in xrange(workers)])
+		while (max_diff > threshold):
+			send_all(solver, [t]*workers)
+			# barrier: every block of the sweep is written
+			wait_sweep(solver['done'], solver['processes'], timeout)
+			max_diff = diffs[:workers].max()
+			t += 1
+			residuals.append(max_diff)
+			if callback is not None: callback(max_diff, buffers[t % 2])
+	except BaseException:
+		# the workers may be in the middle of a sweep
+		close_solver()
+		raise
+	return buffers[t % 2].copy(), residuals
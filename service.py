@@ -0,0 +1,183 @@
+## @package service
+# Resident simulation service: an HTTP server receiving simulation jobs as JSON and answering with JSON results.
+# The interpreter, the imported modules and the pool of worker processes stay alive between jobs, so do the caches
+# (layouts of the rendered graphs, pages of the graph corpus shared by all jobs). matplotlib is only imported by a job that
+# renders a graph and pulp only by a job with a pulp smart peer solver.
+# Usage: python service.py [port [workers [corpus_directory]]]
+# POST / with a job, e.g. {"type": "simulate", "simulations": 100, "seed": 1, "params": {"g_type": "random", "g_char": 0.1}}
+# job types: 'simulate' (optional "precision", "min_simulations", "target", "render": image file of the last graph),
+# 'tournament' ("strategies", "budgets": [[budget1, budget2], ...]) and 'campaign' ("peers": [[strategy, budget, opinion], ...])
+# GET / returns the state of the service.
+from __future__ import division # to allow integer division to produce a floating point
+import BaseHTTPServer
+import json
+import multiprocessing as mp
+import sys
+import time
+import traceback
+import numpy as np
+import computation as cp
+import graph_modification as gm
+import simulation as sim
+
+# parameters of a match missing from a job, as in main.py
+DEFAULTS = {'g_type': 'geometric', 'num_peers': 100, 'g_char': 0.2, 'backend': 'networkx', 'connect': 'reject', 'alpha': 0.3,
+		'strategy1': 'D', 'budget1': 10, 'strategy2': '1/D', 'budget2': 10, 'neutral_range': 0.001, 'smart_solver': 'sparse',
+		'engine': 'sparse', 'check': False, 'instrument': False, 'corpus': None}
+
+##
+# returns a new service: its resident pool of workers, default parameters and counters
+# @param workers number of worker processes, 1 runs the jobs in the service process
+# @param corpus directory of the graph corpus shared by all jobs, None to generate every graph
+#
+def new_service(workers=1, corpus=None):
+	return {'pool': mp.Pool(workers) if workers > 1 else None, 'workers': workers,
+			'defaults': dict(DEFAULTS, corpus = corpus), 'jobs': 0, 'failed': 0, 'started': time.time(), 'busy': 0.0}
+
+##
+# Stops the worker processes of a service
+# @param service dictionary returned by new_service
+#
+def close_service(service):
+	if service['pool'] is not None:
+		service['pool'].close()
+		service['pool'].join()
+		service['pool'] = None
+
+##
+# returns the summary of an array of followers percentages: mean, standard deviation and precision (get_precision)
+# @param followers array of followers percentages, one per simulation
+#
+def summary(followers):
+	mean = float(np.mean(followers)) if len(followers) > 0 else 0.0
+	precision = cp.get_precision(mean, followers, len(followers)) if len(followers) > 1 and mean > 0 else None
+	return {'mean': mean, 'std': float(np.std(followers)), 'precision': precision}
+
+##
+# Checks the names of a job before it is dispatched to the workers
+# raises ValueError on a strategy, opinion engine or smart peer solver that is not applicable
+# @param params parameters of the job, completed with the defaults
+# @param job dictionary of the job (see run_job)
+#
+def validate_job(params, job):
+	job_type = job.get('type', 'simulate')
+	if job_type == 'simulate':
+		strategies = [params['strategy2']]
+		if params['strategy1'] != 'smart': strategies.append(params['strategy1'])
+	elif job_type == 'tournament': strategies = list(job.get('strategies', []))
+	elif job_type == 'campaign': strategies = [peer[0] for peer in job.get('peers', [])]
+	else: raise ValueError('Chosen job type ['+str(job_type)+'] is not applicable.')
+	for strategy in strategies:
+		if strategy not in gm.STRATEGIES: raise ValueError('Chosen strategy ['+str(strategy)+'] is not applicable.')
+	if params['engine'] not in gm.ENGINES: raise ValueError('Chosen opinion engine ['+str(params['engine'])+'] is not applicable.')
+	if params['smart_solver'] not in gm.SMART_SOLVERS:
+		raise ValueError('Chosen smart peer solver ['+str(params['smart_solver'])+'] is not applicable.')
+
+##
+# Runs one job in a service
+# returns the JSON serializable result of the job
+# @param service dictionary returned by new_service
+# @param job dictionary with the 'type' of the job, its 'params' (missing ones are taken from the defaults),
+# the number of 'simulations' and the 'seed'; other keys depend on the type (see the package documentation)
+#
+def run_job(service, job):
+	params = dict(service['defaults'])
+	params.update(job.get('params', {}))
+	simulations = int(job.get('simulations', 1))
+	seed = int(job.get('seed', int(time.time())))
+	workers = service['workers']
+	pool = service['pool']
+	validate_job(params, job)
+	job_type = job.get('type', 'simulate')
+	if job_type == 'simulate':
+		results = sim.run_simulations(params, simulations, seed, workers, None, job.get('precision'),
+				int(job.get('min_simulations', 30)), job.get('target', 'followers'), pool = pool)
+		done = results['simulations']
+		reply = {'simulations': done, 'S1_followers': summary(results['S1_followers']),
+				'S2_followers': summary(results['S2_followers']), 'neutral': summary(results['neutral']),
+				'refused': summary(results['refused']), 'wins': [w/done*100 for w in results['wins']] if done > 0 else results['wins'], 'budget1': int(results['budget1'])}
+		if job.get('render') is not None and done > 0:
+			G = results['graph']
+			if G is None: G = sim.simulate(params, seed, done-1)[0]
+			# matplotlib is only imported by the jobs that render a graph
+			import display
+			display.render_graph(G, params['neutral_range'], job['render'], seed)
+			reply['render'] = job['render']
+	elif job_type == 'tournament':
+		budgets = [tuple(b) for b in job.get('budgets', [[params['budget1'], params['budget2']]])]
+		table, results = sim.tournament(params, job['strategies'], budgets, simulations, seed, workers, pool)
+		reply = {'simulations': simulations, 'pairings': []}
+		for key in sorted(table):
+			entry = table[key]
+			reply['pairings'].append({'strategy1': key[0], 'strategy2': key[1], 'budget1': key[2], 'budget2': key[3],
+					'S1_followers': summary(entry['S1_followers']), 'S2_followers': summary(entry['S2_followers']),
+					'neutral': summary(entry['neutral']), 'wins': [w/simulations*100 for w in entry['wins']]})
+	elif job_type == 'campaign':
+		peers = [tuple(p) for p in job['peers']]
+		results = sim.campaign(params, peers, simulations, seed, workers, pool)
+		reply = {'simulations': simulations, 'shares': [summary(results['shares'][:, j]) for j in xrange(len(peers)+1)],
+				'wins': [w/simulations*100 for w in results['wins']]}
+	else : raise SystemExit('Chosen job type ['+str(job_type)+'] is not applicable.')
+	for key in ['repeated', 'rejected_time', 'added_edges', 'dropped_nodes']:
+		reply[key] = results[key]
+	reply['seed'] = seed
+	return reply
+
+##
+# HTTP handler of the service, the service dictionary is the 'service' attribute of the server
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# returns the state of the service
+	def do_GET(self):
+		service = self.server.service
+		self.reply(200, {'jobs': service['jobs'], 'failed': service['failed'], 'workers': service['workers'],
+				'uptime': time.time() - service['started'], 'busy': service['busy'], 'defaults': service['defaults']})
+
+	# runs the job of the request body
+	def do_POST(self):
+		service = self.server.service
+		start = time.time()
+		try:
+			job = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+			reply = run_job(service, job)
+			reply['elapsed'] = time.time() - start
+			status = 200
+		# the simulation code ends with SystemExit on a parameter that is not applicable
+		except (SystemExit, Exception) as e:
+			service['failed'] += 1
+			reply = {'error': str(e), 'traceback': traceback.format_exc()}
+			status = 400
+		service['jobs'] += 1
+		service['busy'] += time.time() - start
+		self.reply(status, reply)
+
+	# sends a JSON reply
+	def reply(self, status, data):
+		body = json.dumps(data)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+##
+# Serves jobs until the process is interrupted, one job at a time
+# @param service dictionary returned by new_service
+# @param host address the server listens on
+# @param port port the server listens on
+#
+def serve(service, host='127.0.0.1', port=8642):
+	server = BaseHTTPServer.HTTPServer((host, port), Handler)
+	server.service = service
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		close_service(service)
+
+if __name__ == "__main__":
+	port = int(sys.argv[1]) if len(sys.argv) > 1 else 8642
+	workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+	corpus = sys.argv[3] if len(sys.argv) > 3 else None
+	serve(new_service(workers, corpus), port = port)
@@ -0,0 +1,487 @@
+## @package simulation
+# Runs the matches between two forceful peers, each on its own generated graph.
+# Every simulation seeds the random generators with a stream derived from the seed of the run and its index,
+# so simulations can be spread over worker processes and still give the same results for any number of workers.
+from __future__ import division # to allow integer division to produce a floating point
+import multiprocessing as mp
+import random as rd
+import itertools
+import sys
+import time
+import zlib
+import numpy as np
+import networkx as nx
+import graph_modification as gm
+import graph_state as gs
+import computation as cp
+import corpus as co
+import excp as ex
+import instrument as ins
+import sink as sk
+
+##
+# derives the seed of one simulation from the seed of the run and the index of the simulation
+# Uses the splitmix64 finalizer so that neighbouring indices give unrelated streams
+# returns an integer accepted by np.random.seed and random.seed
+# @param seed seed of the whole run
+# @param index index of the simulation
+#
+def sim_seed(seed, index):
+	mask = 0xFFFFFFFFFFFFFFFF
+	z = (seed * 0x9E3779B97F4A7C15 + index + 1) & mask
+	z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask
+	z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+	return int((z ^ (z >> 31)) & 0xFFFFFFFF)
+
+##
+# Generates a connected graph of normal peers
+# With params['connect'] = 'reject' (default) a graph that is not connected is thrown away and generated again,
+# with 'giant' or 'bridge' it is made connected by graph_modification.connect_graph
+# returns the graph and a dictionary of statistics: number of 'repeated' graphs, time spent on them 'rejected_time',
+# 'added_edges' and 'dropped_nodes' by the connectivity repair
+# @param params dictionary of the match parameters (see simulate)
+#
+def connected_graph(params):
+	mode = params.get('connect', 'reject')
+	stats = {'repeated': 0, 'rejected_time': 0.0, 'added_edges': 0, 'dropped_nodes': 0}
+	while True:
+		start = time.time()
+		with ins.span('generate'):
+			G = gm.create_graph(params['g_type'], params['num_peers'], params['g_char'], params.get('backend', 'networkx'))
+		if mode != 'reject':
+			with ins.span('connect'):
+				G = gm.connect_graph(G, mode)
+			stats['added_edges'] = G.graph['repair']['added_edges']
+			stats['dropped_nodes'] = G.graph['repair']['dropped_nodes']
+			return G, stats
+		with ins.span('connect'):
+			connected = nx.is_connected(G)
+		if connected: return G, stats
+		stats['repeated'] += 1
+		ins.count('retries')
+		stats['rejected_time'] += time.time() - start
+
+##
+# Makes the graph of a simulation from its own random stream, separate from the one of the forceful peers placement,
+# so that the same graph is obtained whatever is played on it.
+# With params['corpus'] (a directory) the graph is loaded from the corpus, or generated and stored there first; in both cases
+# it is rebuilt from the stored arrays so that a graph read from the corpus is identical to the one generated.
+# The graph of the corpus is a graph state (see graph_state) whose weight matrix is the memory mapped CSR arrays, without a
+# copy nor a networkx graph.
+# A graph read from the corpus has no 'repeated' graph nor 'rejected_time' in its statistics.
+# returns the graph (networkx graph or graph state) and the statistics of connected_graph
+# @param params dictionary of the match parameters (see simulate)
+# @param s seed of the simulation
+#
+def simulation_graph(params, s):
+	graph_seed = sim_seed(s, 0)
+	root = params.get('corpus')
+	if root is not None:
+		key = co.graph_key(params, graph_seed)
+		with ins.span('load'):
+			stored = co.load_graph(root, key)
+		if stored is not None:
+			ins.count('corpus_hits')
+			W, pos, meta = stored
+			stats = {'repeated': 0, 'rejected_time': 0.0, 'added_edges': meta['added_edges'], 'dropped_nodes': meta['dropped_nodes']}
+			return gs.from_matrix(params['g_type'], W, pos), stats
+	np.random.seed(graph_seed) ; rd.seed(graph_seed)
+	G, stats = connected_graph(params)
+	if root is not None:
+		W, pos = co.graph_arrays(G)
+		with ins.span('store'):
+			co.store_graph(root, key, W, pos, dict(stats, num_nodes = G.number_of_nodes()))
+		W, pos, meta = co.load_graph(root, key)
+		G = gs.from_matrix(params['g_type'], W, pos)
+	return G, stats
+
+##
+# Runs one match: graph creation, forceful peers placement, opinion computation and classification
+# returns the graph and a dictionary with the 'percentages' [S1, S2, neutral], the percentage of nodes the float32 engine
+# refused to classify 'refused' (see computation.guarded_percentages, 0 with the other engines),
+# the budget of the first forceful peer 'budget1' (computed when it is smart) and the statistics of connected_graph
+# @param params dictionary of the match parameters: g_type, num_peers, g_char, backend (of create_graph), connect (see connected_graph),
+# alpha, strategy1, budget1,
+# strategy2, budget2, neutral_range, smart_solver (of add_smart), engine (opinion engine of R_itr), solver_workers (worker processes
+# of the 'parallel' engine), check (compare R_itr with R_inf)
+# record (add the 'seed', final 'opinions' and 'placement' of the forceful peers to the result)
+# and corpus (directory of the graph corpus, see simulation_graph)
+# @param seed seed of the whole run
+# @param index index of the simulation
+# @param trace convergence trace of R_itr (see graph_modification.new_trace), None for no trace
+#
+def simulate(params, seed, index, trace=None):
+	s = sim_seed(seed, index)
+	G, stats = simulation_graph(params, s)
+	placement_seed = sim_seed(s, 1)
+	np.random.seed(placement_seed) ; rd.seed(placement_seed)
+	budget1 = params['budget1']
+	with ins.span('place'):
+		# If strategy 1 is not a smart peer, the 2 forceful peers can be added simultaneously
+		if params['strategy1'] != 'smart':
+			gm.add_forceful(G, params['strategy1'], params['budget1'], params['strategy2'], params['budget2'])
+		# If strategy 1 is smart then forceful peer with strategy 2 is added first then smart peer
+		else:
+			# the smart peer model is built on a networkx graph
+			if gs.is_state(G): G = gs.to_networkx(G)
+			gm.add_one_forceful(G, params['strategy2'], params['budget2'])
+			budget1 = gm.add_smart(G, params['alpha'], params['budget2'], params['neutral_range'], params.get('smart_solver', 'gurobi'))
+	with ins.span('solve'):
+		R_itr = gm.R_itr(G, params['alpha'], params.get('engine', 'loop'), trace = trace, workers = params.get('solver_workers'))
+	# Asserting that R_inf calculated by equation and iteration are equal to decimal places
+	if params.get('check', False):
+		with ins.span('check'):
+			R_inf = cp.R_inf(G, params['alpha'])
+		try:
+			np.testing.assert_array_almost_equal(R_inf, R_itr, 4)
+		except AssertionError:
+			sys.exit('ConvergenceError: convergence of R_inf is not correct to 4 decimal places\nProgram will terminate')
+	with ins.span('classify'):
+		if params.get('engine') == 'float32':
+			tmp = cp.guarded_percentages(G, params['neutral_range'], gs.attributes(G)['convergence']['error'])
+			result = {'percentages': tmp[:3], 'refused': tmp[3], 'budget1': budget1}
+		else: result = {'percentages': cp.percentages(G, params['neutral_range']), 'refused': 0.0, 'budget1': budget1}
+	result.update(stats)
+	# Final opinions and placement to be stored by a sink, nodes dropped by the connectivity repair have a nan opinion
+	if params.get('record', False):
+		n = gs.num_normal(G)
+		placement = np.zeros((2, params['num_peers']), dtype=np.int32)
+		if gs.is_state(G):
+			for p, f in enumerate(G['forceful']):
+				row = G['W'][f]
+				placement[p, row.indices] = row.data
+		else:
+			for p, f in enumerate([n, n+1]):
+				if G.has_node(f):
+					for i in G.neighbors(f): placement[p, i] = G[f][i]['weight']
+		opinions = np.empty(params['num_peers'])
+		opinions.fill(np.nan)
+		opinions[:n] = np.array(R_itr).ravel()
+		result['seed'] = s
+		result['opinions'] = opinions
+		result['placement'] = placement
+	return G, result
+
+##
+# Worker entry point, runs one simulation and drops the graph which is not needed by the parent process
+# With params['instrument'] the spans and counters of the simulation are returned under the key 'instrument'
+# @param job tuple (params, seed, index)
+#
+def _run_one(job):
+	params, seed, index = job
+	if not params.get('instrument', False): return _worker_call(simulate, params, seed, index)[1]
+	result, snap = _instrumented_call(simulate, params, seed, index)
+	result = result[1]
+	result['instrument'] = snap
+	return result
+
+##
+# Calls the function of a worker process, the SystemExit of the simulation code (e.g. an unknown strategy)
+# is raised again as ex.WorkerExit so that the pool returns it to the parent instead of losing the task
+# @param function function to call
+# @param args arguments of the function
+#
+def _worker_call(function, *args):
+	try:
+		return function(*args)
+	except SystemExit as e:
+		raise ex.WorkerExit(str(e))
+
+##
+# Calls the function of a worker process with the instrumentation enabled from a reset state
+# The previous enabled state is restored, the process (e.g. a worker of a resident pool) can run other jobs afterwards
+# returns the result of the function and the snapshot of its spans and counters
+# @param function function to call
+# @param args arguments of the function
+#
+def _instrumented_call(function, *args):
+	previous = ins.enabled()
+	ins.reset() ; ins.enable()
+	try:
+		result = _worker_call(function, *args)
+		return result, ins.snapshot()
+	finally:
+		ins.enable(previous)
+
+##
+# Runs a number of simulations on a pool of worker processes and merges their results in the order of their index
+# returns a dictionary with the arrays 'S1_followers', 'S2_followers', 'neutral', 'refused' (see simulate), the list 'wins' [S1_wins, S2_wins, ties],
+# 'S1_wins_list' (1 if S1 had more than half of the followers), the 'budget1' of the last simulation,
+# the totals of the connected_graph statistics ('repeated', 'rejected_time', 'added_edges', 'dropped_nodes'),
+# the 'graph' of the last simulation when workers is 1 (None otherwise) and the number of 'simulations' done
+# With a precision the run stops as soon as the precision (get_precision) of the selected target is reached,
+# the decision is taken in the order of the indices so the simulations done do not depend on the number of workers
+# @param params dictionary of the match parameters (see simulate)
+# @param simulations number of simulations, maximum number of simulations if a precision is given
+# @param seed seed of the whole run
+# @param workers number of worker processes, 1 runs all simulations in the calling process
+# @param sink optional store opened by sink.open_sink where every simulation is appended
+# @param precision requested precision as a percentage of the mean, None to run all the simulations
+# @param min_simulations minimum number of simulations before stopping on the precision
+# @param target 'followers': precision of the followers percentages of both strategies, 'wins': of the winning percentage of strategy 1
+# @param trace convergence trace recording the iterations of every simulation, only used when workers is 1
+# @param pool resident pool of workers processes (e.g. the one of the service) used instead of creating one, it is left open
+#
+def run_simulations(params, simulations, seed, workers=1, sink=None, precision=None, min_simulations=30, target='followers', trace=None, pool=None):
+	if target == 'followers':
+		running = [cp.running_stats(), cp.running_stats()]
+	elif target == 'wins':
+		running = [cp.running_stats()]
+	else : raise SystemExit('Chosen precision target ['+str(target)+'] is not applicable.\nProgram will terminate')
+	S1_followers = np.zeros(simulations)
+	S2_followers = np.zeros(simulations)
+	neutral = np.zeros(simulations)
+	refused = np.zeros(simulations)
+	wins = [0,0,0]
+	S1_wins_list = []
+	stats = {'repeated': 0, 'rejected_time': 0.0, 'added_edges': 0, 'dropped_nodes': 0}
+	budget1 = params['budget1']
+	if sink is not None: params = dict(params, record = True)
+	jobs = ((params, seed, i) for i in xrange(simulations))
+	own_pool = None
+	if pool is None and workers > 1: pool = own_pool = mp.Pool(workers)
+	if pool is not None:
+		# imap keeps the order of the jobs whatever the worker that finished first
+		# simulations are handed one by one when the run can stop early
+		if precision is None: results = pool.imap(_run_one, jobs, max(1, simulations // (4*workers)))
+		elif own_pool is not None: results = pool.imap(_run_one, jobs, 1)
+		# a resident pool cannot be terminated at the stopping point, the simulations are handed a batch at a time
+		else: results = _batched_imap(pool, _run_one, jobs, 2*workers)
+	else:
+		results = (simulate(*(job + (trace,))) for job in jobs)
+	# graph of the last simulation, only kept when the simulations run in the calling process
+	graph = None
+	done = 0
+	try:
+		for i, result in enumerate(results):
+			if pool is None: graph, result = result
+			elif 'instrument' in result: ins.merge(result['instrument'])
+			tmp = result['percentages']
+			if (tmp[0]>0.5): S1_wins_list.append(1)
+			else: S1_wins_list.append(0)
+			cp.update_percentages(tmp, S1_followers, S2_followers, neutral, i, wins)
+			refused[i] = result['refused']
+			for key in stats: stats[key] += result[key]
+			budget1 = result['budget1']
+			if sink is not None:
+				sk.sink_append(sink, i, result['seed'], [budget1, params['budget2']], tmp, result['opinions'], result['placement'])
+			done = i + 1
+			if precision is not None:
+				if target == 'followers':
+					cp.update_stats(running[0], tmp[0])
+					cp.update_stats(running[1], tmp[1])
+				else: cp.update_stats(running[0], 1 if tmp[0] > tmp[1] else 0)
+				if done >= min_simulations and max(cp.stats_precision(st) for st in running) <= precision:
+					break
+	except BaseException:
+		# a failed simulation (e.g. ex.WorkerExit) stops the workers of the run
+		if own_pool is not None: own_pool.terminate()
+		raise
+	if own_pool is not None:
+		# drops the simulations started after the stopping point
+		if done < simulations: own_pool.terminate()
+		else: own_pool.close()
+		own_pool.join()
+	if sink is not None: sk.flush_sink(sink)
+	return {'S1_followers': S1_followers[:done], 'S2_followers': S2_followers[:done], 'neutral': neutral[:done], 'refused': refused[:done], 'wins': wins,
+			'S1_wins_list': S1_wins_list, 'budget1': budget1, 'graph': graph, 'simulations': done, 'repeated': stats['repeated'],
+			'rejected_time': stats['rejected_time'], 'added_edges': stats['added_edges'], 'dropped_nodes': stats['dropped_nodes']}
+
+##
+# Maps a worker function over jobs with pool.imap a batch of jobs at a time, in the order of the jobs
+# so that no more than one batch is queued on the pool when the caller stops reading the results
+# @param pool pool of worker processes
+# @param function worker function
+# @param jobs iterator of jobs
+# @param batch number of jobs queued at a time
+#
+def _batched_imap(pool, function, jobs, batch):
+	jobs = iter(jobs)
+	while True:
+		chunk = list(itertools.islice(jobs, batch))
+		if len(chunk) == 0: return
+		for result in pool.imap(function, chunk):
+			yield result
+
+##
+# Plays every pairing of strategies and budgets on one generated graph
+# The normal peers system is factorized once (computation.base_system) and every pairing is scored by a low rank update,
+# each pairing draws its placement from its own random stream so the results do not depend on the list of pairings
+# returns a list of [S1, S2, neutral] (one per pairing) and the statistics of connected_graph
+# @param params dictionary of the match parameters (see simulate), strategies and budgets are taken from the pairings
+# @param pairings list of (strategy1, strategy2, budget1, budget2)
+# @param seed seed of the whole run
+# @param index index of the simulation
+#
+def play_graph(params, pairings, seed, index):
+	s = sim_seed(seed, index)
+	G, stats = simulation_graph(params, s)
+	with ins.span('factorize'):
+		base = cp.base_system(G, params['alpha'])
+	results = []
+	for pairing in pairings:
+		strategy1, strategy2, budget1, budget2 = pairing
+		# stream of the pairing derived from its content rather than its position in the list
+		s_p = sim_seed(s, zlib.crc32(repr(pairing)) & 0xFFFFFFFF)
+		np.random.seed(s_p) ; rd.seed(s_p)
+		with ins.span('place'):
+			f1_neighbors, f2_neighbors = gm.draw_placement(G, strategy1, budget1, strategy2, budget2)
+		with ins.span('solve'):
+			R = cp.placement_opinions(base, f1_neighbors, f2_neighbors)
+		with ins.span('classify'):
+			results.append(cp.classify(R, params['neutral_range']))
+	return results, stats
+
+##
+# Worker entry point of the tournament
+# With params['instrument'] the spans and counters of the graph are returned in the statistics under the key 'instrument'
+# @param job tuple (params, pairings, seed, index)
+#
+def _play_one(job):
+	if not job[0].get('instrument', False): return _worker_call(play_graph, *job)
+	(results, stats), snap = _instrumented_call(play_graph, *job)
+	stats['instrument'] = snap
+	return results, stats
+
+##
+# Round robin tournament: every graph is generated once and all pairings of strategies (and budgets) are played on it
+# returns a dictionary keyed by (strategy1, strategy2, budget1, budget2) with, for each pairing, the arrays 'S1_followers',
+# 'S2_followers', 'neutral', the list 'wins' [S1_wins, S2_wins, ties] and 'precision' [S1, S2] computed by get_precision (None for a single graph or a zero mean),
+# and a dictionary of the totals of the connected_graph statistics ('repeated', 'rejected_time', 'added_edges', 'dropped_nodes')
+# @param params dictionary of the match parameters (see simulate)
+# @param strategies list of strategies, every ordered pair is played (including a strategy against itself)
+# @param budgets list of (budget1, budget2)
+# @param simulations number of graphs
+# @param seed seed of the whole run
+# @param workers number of worker processes, 1 runs all graphs in the calling process
+# @param pool resident pool of workers processes used instead of creating one, it is left open
+#
+def tournament(params, strategies, budgets, simulations, seed, workers=1, pool=None):
+	pairings = [(s1, s2, b1, b2) for b1, b2 in budgets for s1 in strategies for s2 in strategies]
+	table = {}
+	for pairing in pairings:
+		table[pairing] = {'S1_followers': np.zeros(simulations), 'S2_followers': np.zeros(simulations),
+				'neutral': np.zeros(simulations), 'wins': [0,0,0]}
+	jobs = ((params, pairings, seed, i) for i in xrange(simulations))
+	own_pool = None
+	if pool is None and workers > 1: pool = own_pool = mp.Pool(workers)
+	if pool is not None: results = pool.imap(_play_one, jobs, max(1, simulations // (4*workers)))
+	else: results = (play_graph(*job) for job in jobs)
+	stats = {'repeated': 0, 'rejected_time': 0.0, 'added_edges': 0, 'dropped_nodes': 0}
+	try:
+		for i, (percentages, graph_stats) in enumerate(results):
+			if 'instrument' in graph_stats: ins.merge(graph_stats['instrument'])
+			for pairing, tmp in zip(pairings, percentages):
+				entry = table[pairing]
+				cp.update_percentages(tmp, entry['S1_followers'], entry['S2_followers'], entry['neutral'], i, entry['wins'])
+			for key in stats: stats[key] += graph_stats[key]
+	except BaseException:
+		# a failed simulation (e.g. ex.WorkerExit) stops the workers of the run
+		if own_pool is not None: own_pool.terminate()
+		raise
+	if own_pool is not None:
+		own_pool.close()
+		own_pool.join()
+	for pairing in pairings:
+		entry = table[pairing]
+		# as service.summary, no precision for a single graph or a zero mean
+		entry['precision'] = [cp.get_precision(np.mean(followers), followers, simulations)
+				if simulations > 1 and np.mean(followers) > 0 else None for followers in [entry['S1_followers'], entry['S2_followers']]]
+	return table, stats
+
+##
+# Prints the result of a tournament as matrices: rows are strategy 1, columns are strategy 2
+# Each cell holds the winning percentage of strategy 1 and its followers percentage +- precision (% of the mean)
+# @param table dictionary of the pairings returned by tournament
+# @param stats dictionary of the statistics returned by tournament
+# @param strategies list of strategies of the tournament
+# @param budgets list of (budget1, budget2) of the tournament
+# @param simulations number of graphs of the tournament
+#
+def print_tournament(table, stats, strategies, budgets, simulations):
+	for b1, b2 in budgets:
+		print 'After %d simulations: budget 1 = %d, budget 2 = %d' %(simulations, b1, b2)
+		print 'S1 \\ S2\t' + '\t\t\t'.join(strategies)
+		for s1 in strategies:
+			cells = []
+			for s2 in strategies:
+				entry = table[(s1, s2, b1, b2)]
+				precision = 'n/a' if entry['precision'][0] is None else '%.2f%%' % entry['precision'][0]
+				cells.append('%.2f%% (%.2f%% +-%s)' %(entry['wins'][0]/simulations*100,
+						np.mean(entry['S1_followers'])*100, precision))
+			print s1 + '\t' + '\t'.join(cells)
+	print 'Repeated simulations: ', stats['repeated']
+
+##
+# Plays one multi-party campaign: k forceful peers are placed on one graph and their influence on every normal peer
+# is solved with one factorization (computation.influence_matrix)
+# returns the shares [peer 0, ..., peer k-1, neutral] (see computation.peer_shares) and the statistics of connected_graph
+# @param params dictionary of the match parameters (see simulate), strategies and budgets are taken from the peers
+# @param peers list of (strategy, budget, opinion) of the forceful peers
+# @param seed seed of the whole run
+# @param index index of the simulation
+#
+def play_campaign(params, peers, seed, index):
+	s = sim_seed(seed, index)
+	G, stats = simulation_graph(params, s)
+	placement_seed = sim_seed(s, 1)
+	np.random.seed(placement_seed) ; rd.seed(placement_seed)
+	with ins.span('place'):
+		gm.add_forceful_peers(G, peers)
+	with ins.span('solve'):
+		X = cp.influence_matrix(G, params['alpha'])
+	with ins.span('classify'):
+		shares = cp.peer_shares(X, [opinion for strategy, budget, opinion in peers], params['neutral_range'])
+	return shares, stats
+
+##
+# Worker entry point of the campaigns
+# With params['instrument'] the spans and counters of the graph are returned in the statistics under the key 'instrument'
+# @param job tuple (params, peers, seed, index)
+#
+def _campaign_one(job):
+	if not job[0].get('instrument', False): return _worker_call(play_campaign, *job)
+	(shares, stats), snap = _instrumented_call(play_campaign, *job)
+	stats['instrument'] = snap
+	return shares, stats
+
+##
+# Plays a campaign of k forceful peers on a number of graphs
+# returns a dictionary with the 'shares' (simulations x (k+1) array, the last column is the neutral share),
+# the 'wins' of every peer (graphs where its share is strictly the largest) followed by the ties,
+# and the totals of the connected_graph statistics under the keys 'repeated', 'rejected_time', 'added_edges' and 'dropped_nodes'
+# @param params dictionary of the match parameters (see simulate)
+# @param peers list of (strategy, budget, opinion) of the forceful peers
+# @param simulations number of graphs
+# @param seed seed of the whole run
+# @param workers number of worker processes, 1 runs all graphs in the calling process
+# @param pool resident pool of workers processes used instead of creating one, it is left open
+#
+def campaign(params, peers, simulations, seed, workers=1, pool=None):
+	k = len(peers)
+	shares = np.zeros((simulations, k+1))
+	wins = [0]*(k+1)
+	stats = {'repeated': 0, 'rejected_time': 0.0, 'added_edges': 0, 'dropped_nodes': 0}
+	jobs = ((params, peers, seed, i) for i in xrange(simulations))
+	own_pool = None
+	if pool is None and workers > 1: pool = own_pool = mp.Pool(workers)
+	if pool is not None: results = pool.imap(_campaign_one, jobs, max(1, simulations // (4*workers)))
+	else: results = (play_campaign(*job) for job in jobs)
+	try:
+		for i, (tmp, graph_stats) in enumerate(results):
+			if 'instrument' in graph_stats: ins.merge(graph_stats['instrument'])
+			shares[i] = tmp
+			best = np.flatnonzero(shares[i, :k] == shares[i, :k].max())
+			if len(best) == 1: wins[best[0]] += 1
+			else: wins[k] += 1
+			for key in stats: stats[key] += graph_stats[key]
+	except BaseException:
+		# a failed simulation (e.g. ex.WorkerExit) stops the workers of the run
+		if own_pool is not None: own_pool.terminate()
+		raise
+	if own_pool is not None:
+		own_pool.close()
+		own_pool.join()
+	result = {'shares': shares, 'wins': wins}
+	result.update(stats)
+	return result
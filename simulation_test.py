@@ -0,0 +1,142 @@
+from __future__ import division
+import unittest as ut
+import simulation as sim
+import sink as sk
+import instrument as ins
+import service as sv
+import excp as ex
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+class SimulationTest(ut.TestCase):
+	# Setting up fixture
+	def setUp(self):
+		self.seed = 10
+		self.params = {'g_type': 'barabasi_albert', 'num_peers': 30, 'g_char': 2, 'alpha': 0.3,
+				'strategy1': 'D', 'budget1': 5, 'strategy2': 'random', 'budget2': 5,
+				'neutral_range': 0.001, 'engine': 'sparse'}
+
+	# Asserting that the aggregated results do not depend on the number of workers
+	def test_workers(self):
+		serial = sim.run_simulations(self.params, 6, self.seed, 1)
+		parallel = sim.run_simulations(self.params, 6, self.seed, 3)
+		np.testing.assert_array_equal(serial['S1_followers'], parallel['S1_followers'])
+		np.testing.assert_array_equal(serial['S2_followers'], parallel['S2_followers'])
+		np.testing.assert_array_equal(serial['neutral'], parallel['neutral'])
+		self.assertEqual(serial['wins'], parallel['wins'])
+	# Asserting that the adaptive stopping point does not depend on the number of workers
+	def test_precision(self):
+		serial = sim.run_simulations(self.params, 40, self.seed, 1, precision = 5, min_simulations = 4)
+		parallel = sim.run_simulations(self.params, 40, self.seed, 2, precision = 5, min_simulations = 4)
+		self.assertEqual(serial['simulations'], parallel['simulations'])
+		self.assertEqual(len(serial['S1_followers']), serial['simulations'])
+		np.testing.assert_array_equal(serial['S1_followers'], parallel['S1_followers'])
+
+	# Asserting that a pairing of the tournament gives the same results whatever the other pairings played
+	def test_tournament(self):
+		table, stats = sim.tournament(self.params, ['D', 'random'], [(5, 5)], 4, self.seed)
+		single = sim.tournament(self.params, ['random'], [(5, 5)], 4, self.seed)[0]
+		self.assertEqual(len(table), 4)
+		self.assertEqual(sorted(stats), ['added_edges', 'dropped_nodes', 'rejected_time', 'repeated'])
+		entry = table[('random', 'random', 5, 5)]
+		np.testing.assert_array_almost_equal(entry['S1_followers'] + entry['S2_followers'] + entry['neutral'], np.ones(4), 12)
+		self.assertEqual(sum(entry['wins']), 4)
+		np.testing.assert_array_equal(entry['S1_followers'], single[('random', 'random', 5, 5)]['S1_followers'])
+		# one graph has no precision
+		one = sim.tournament(self.params, ['D'], [(5, 5)], 1, self.seed)[0]
+		self.assertEqual(one[('D', 'D', 5, 5)]['precision'], [None, None])
+	# Asserting that every simulation is streamed to the sink in the order of its index
+	def test_sink(self):
+		path = tempfile.mkdtemp()
+		try:
+			sink = sk.open_sink(path, 30, chunk = 2)
+			results = sim.run_simulations(self.params, 3, self.seed, 1, sink)
+			sk.close_sink(sink)
+			store = sk.load_sink(path)
+			np.testing.assert_array_equal(store['index'].ravel(), [0, 1, 2])
+			np.testing.assert_array_equal(store['percentages'][:, 0], results['S1_followers'])
+			np.testing.assert_array_equal(store['placement'].sum(axis=1), [10, 10, 10])
+			self.assertEqual(store['opinions'].shape, (3, 30))
+		finally:
+			shutil.rmtree(path)
+	# Asserting that graphs read back from the corpus give the results of the run that generated them
+	def test_corpus(self):
+		path = tempfile.mkdtemp()
+		try:
+			params = dict(self.params, corpus = path, connect = 'giant')
+			generated = sim.run_simulations(params, 3, self.seed, 1)
+			loaded = sim.run_simulations(params, 3, self.seed, 2)
+			self.assertEqual(len([d for d in os.listdir(path) if not d.startswith('.')]), 3)
+			np.testing.assert_array_equal(generated['S1_followers'], loaded['S1_followers'])
+			np.testing.assert_array_equal(generated['S2_followers'], loaded['S2_followers'])
+			self.assertEqual(generated['dropped_nodes'], loaded['dropped_nodes'])
+			# the matrix of a graph of the corpus is the memory maps, not a copy
+			W = sim.simulation_graph(params, sim.sim_seed(self.seed, 0))[0]['W']
+			self.assertFalse(W.data.flags.owndata or W.indices.flags.owndata or W.indptr.flags.owndata)
+			# the graph states of the corpus give the results of the networkx graphs
+			plain = sim.run_simulations(dict(params, corpus = None), 3, self.seed, 1)
+			np.testing.assert_array_equal(plain['S1_followers'], loaded['S1_followers'])
+			table = sim.tournament(params, ['D', '1/D'], [(5, 5)], 2, self.seed)[0]
+			plain = sim.tournament(dict(params, corpus = None), ['D', '1/D'], [(5, 5)], 2, self.seed)[0]
+			for pairing in table:
+				np.testing.assert_array_almost_equal(table[pairing]['S1_followers'], plain[pairing]['S1_followers'], 10)
+			peers = [('D', 5, 1), ('random', 5, -1)]
+			np.testing.assert_array_almost_equal(sim.campaign(params, peers, 2, self.seed)['shares'],
+					sim.campaign(dict(params, corpus = None), peers, 2, self.seed)['shares'], 10)
+		finally:
+			shutil.rmtree(path)
+	# Asserting that the campaign shares do not depend on the number of workers
+	def test_campaign(self):
+		peers = [('D', 5, 1), ('random', 5, -1), ('1/D', 5, 1)]
+		serial = sim.campaign(self.params, peers, 4, self.seed, 1)
+		parallel = sim.campaign(self.params, peers, 4, self.seed, 2)
+		self.assertEqual(serial['shares'].shape, (4, 4))
+		np.testing.assert_array_almost_equal(serial['shares'].sum(axis=1), np.ones(4), 10)
+		np.testing.assert_array_equal(serial['shares'], parallel['shares'])
+		self.assertEqual(sum(serial['wins']), 4)
+	# Asserting that a job of the service on its resident pool gives the results of run_simulations
+	def test_service(self):
+		service = sv.new_service(2)
+		try:
+			reply = sv.run_job(service, {'type': 'simulate', 'params': self.params, 'simulations': 4, 'seed': self.seed})
+			precise = sv.run_job(service, {'type': 'simulate', 'params': self.params, 'simulations': 40, 'seed': self.seed,
+					'precision': 5, 'min_simulations': 4})
+			self.assertRaises(ValueError, sv.run_job, service, {'type': 'simulate', 'params': dict(self.params, strategy2 = 'X')})
+			one = sv.run_job(service, {'type': 'tournament', 'params': self.params, 'strategies': ['D'], 'simulations': 1, 'seed': self.seed})
+			self.assertEqual(one['pairings'][0]['S1_followers']['precision'], None)
+			# a SystemExit in a worker of the resident pool comes back as an exception and the pool keeps running
+			self.assertRaises(ex.WorkerExit, sim.run_simulations, dict(self.params, engine = 'X'), 4, self.seed, 2, pool = service['pool'])
+			self.assertEqual(sv.run_job(service, {'type': 'simulate', 'params': self.params, 'simulations': 4, 'seed': self.seed}), reply)
+		finally:
+			sv.close_service(service)
+		results = sim.run_simulations(self.params, 4, self.seed, 1)
+		self.assertAlmostEqual(reply['S1_followers']['mean'], np.mean(results['S1_followers']), 10)
+		self.assertEqual(reply['simulations'], 4)
+		self.assertEqual(precise['simulations'], sim.run_simulations(self.params, 40, self.seed, 1, precision = 5, min_simulations = 4)['simulations'])
+	# Asserting that the counters merged from the workers are the ones of a serial run
+	def test_instrument(self):
+		params = dict(self.params, instrument = True)
+		try:
+			ins.reset() ; ins.enable()
+			sim.run_simulations(params, 4, self.seed, 1)
+			serial = ins.snapshot()
+			ins.reset()
+			sim.run_simulations(params, 4, self.seed, 2)
+			parallel = ins.snapshot()
+		finally:
+			ins.enable(False) ; ins.reset()
+		self.assertEqual(serial['counters'], parallel['counters'])
+		self.assertEqual(serial['spans']['solve'][0], 4)
+		self.assertEqual(parallel['spans']['classify'][0], 4)
+		self.assertEqual(serial['counters']['solver_calls'], 4)
+		# a worker entry point leaves the instrumentation as it found it, even when the simulation fails
+		result = sim._run_one((params, self.seed, 0))
+		self.assertEqual(result['instrument']['counters']['solver_calls'], 1)
+		self.assertFalse(ins.enabled())
+		self.assertRaises(ex.WorkerExit, sim._play_one, (dict(params, strategy1 = 'X'), [('X', 'D', 5, 5)], self.seed, 0))
+		self.assertFalse(ins.enabled())
+if __name__ == "__main__":
+	ut.main()
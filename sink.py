@@ -0,0 +1,94 @@
+## @package sink
+# Append-only binary store of the results of every simulation: final opinion vector, placement of the forceful peers and metadata.
+# The store is a directory with one raw little-endian file per column and a 'columns.json' header.
+# Records have a fixed size, they are buffered in memory and written a chunk at a time without any string formatting,
+# and every column can be loaded back as a memory map.
+import json
+import os
+import numpy as np
+
+##
+# returns the columns of a store as a list of (name, dtype, width) for graphs with num_nodes normal peers
+# index: simulation index, seed: seed of the simulation, budgets: budgets of the 2 forceful peers,
+# percentages: [S1, S2, neutral], opinions: final opinion of every normal peer,
+# placement: edge weight from the first then the second forceful peer to every normal peer
+# @param num_nodes number of normal peers
+#
+def columns(num_nodes):
+	return [('index', '<i8', 1), ('seed', '<i8', 1), ('budgets', '<i8', 2), ('percentages', '<f8', 3),
+			('opinions', '<f8', num_nodes), ('placement', '<i4', 2*num_nodes)]
+
+##
+# Opens a store for writing, creating it if needed; records are appended to an existing store
+# returns the sink dictionary to be passed to sink_append and close_sink
+# @param path directory of the store
+# @param num_nodes number of normal peers of every record
+# @param chunk number of records buffered in memory before they are written
+#
+def open_sink(path, num_nodes, chunk=64):
+	header_path = os.path.join(path, 'columns.json')
+	if os.path.exists(header_path):
+		with open(header_path) as f:
+			header = json.load(f)
+		if header['num_nodes'] != num_nodes:
+			raise SystemExit('Store [' + path + '] holds records of ' + str(header['num_nodes']) + ' nodes, not ' + str(num_nodes) + '\nProgram will terminate')
+	else:
+		if not os.path.isdir(path): os.makedirs(path)
+		with open(header_path, 'w') as f:
+			json.dump({'num_nodes': num_nodes, 'columns': columns(num_nodes)}, f)
+	return {'path': path, 'num_nodes': num_nodes, 'chunk': chunk,
+			'buffers': dict((name, []) for name, dtype, width in columns(num_nodes))}
+
+##
+# Appends the record of one simulation to the store
+# @param sink dictionary returned by open_sink
+# @param index index of the simulation
+# @param seed seed of the simulation
+# @param budgets [budget1, budget2]
+# @param percentages [S1, S2, neutral]
+# @param opinions final opinion of every normal peer
+# @param placement 2 x num_nodes edge weights from the forceful peers to the normal peers
+#
+def sink_append(sink, index, seed, budgets, percentages, opinions, placement):
+	record = {'index': index, 'seed': seed, 'budgets': budgets, 'percentages': percentages,
+			'opinions': opinions, 'placement': placement}
+	for name, dtype, width in columns(sink['num_nodes']):
+		sink['buffers'][name].append(np.asarray(record[name], dtype=dtype).reshape(width))
+	if len(sink['buffers']['index']) >= sink['chunk']:
+		flush_sink(sink)
+
+##
+# Writes the buffered records at the end of the column files
+# @param sink dictionary returned by open_sink
+#
+def flush_sink(sink):
+	if len(sink['buffers']['index']) == 0: return
+	for name, dtype, width in columns(sink['num_nodes']):
+		with open(os.path.join(sink['path'], name + '.bin'), 'ab') as f:
+			np.vstack(sink['buffers'][name]).astype(dtype).tofile(f)
+		sink['buffers'][name] = []
+
+##
+# Writes the remaining records, the sink cannot be used afterwards
+# @param sink dictionary returned by open_sink
+#
+def close_sink(sink):
+	flush_sink(sink)
+	sink['buffers'] = None
+
+##
+# Loads a store as read only memory maps without copying it in memory
+# returns a dictionary with one (records x width) array per column
+# @param path directory of the store
+#
+def load_sink(path):
+	with open(os.path.join(path, 'columns.json')) as f:
+		header = json.load(f)
+	store = {}
+	for name, dtype, width in header['columns']:
+		column_path = os.path.join(path, name + '.bin')
+		if not os.path.exists(column_path) or os.path.getsize(column_path) == 0:
+			store[name] = np.zeros((0, width), dtype=dtype)
+		else:
+			store[name] = np.memmap(column_path, dtype=dtype, mode='r').reshape(-1, width)
+	return store